@@ -0,0 +1,293 @@
+"""nginx访问日志统计
+
+按行读取combined格式的访问日志（可以持续跟踪正在写入的文件），取出客户端IP，按地区、ASN、ISP等维度
+滚动统计最近一段时间的请求数。
+
+每行只取出IP并计数，不做查询；一个时间窗口结束（或窗口内不同IP数达到上限）时，窗口内每个不同的IP只查询一次，
+再按请求数累加到各维度。保留最近若干个窗口，窗口移出时从合计中减去，快照不需要重新汇总。
+
+nginx常用的日志格式在combined之后追加 "$http_x_forwarded_for"，有这一列时取其中第一个有效IP，
+没有或为 "-" 时使用行首的 $remote_addr。
+"""
+import argparse
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# 统计维度没有结果时的取值
+UNKNOWN = '未知'
+
+
+def client_ip(line, use_xff=True):
+    """从一行日志中取出客户端IP（未校验的字符串），空行返回None"""
+    if use_xff and line.count('"') >= 8:
+        # combined格式有请求、来源、UA三个带引号的列，第四个是X-Forwarded-For
+        forwarded = line.rsplit('"', 2)[-2]
+        if forwarded and forwarded != '-':
+            for candidate in forwarded.split(','):
+                candidate = candidate.strip()
+                if candidate and candidate != 'unknown':
+                    return candidate
+    head = line.split(' ', 1)[0].strip()
+    return head or None
+
+
+class _Window:
+    """一个时间窗口内的计数"""
+
+    def __init__(self, started, dimensions):
+        self.started = started
+        self.lines = 0
+        self.invalid = 0
+        self.unique_ips = 0
+        self.counts = {dim: Counter() for dim in dimensions}
+
+
+class LogAggregator:
+    """按时间窗口去重查询并滚动统计访问日志
+
+    resolve(ips) 接收规范化后的IP列表，返回同样长度的 {维度: 取值} 列表。
+    feed() 只应在一个线程中调用；snapshot() 可以在其他线程中随时调用。
+    """
+
+    def __init__(self, resolve, dimensions, window=60, windows=60, use_xff=True, max_pending=100000):
+        self.resolve = resolve
+        self.dimensions = tuple(dimensions)
+        self.window = window
+        self.use_xff = use_xff
+        self.max_pending = max_pending
+        self._windows = deque()
+        self._max_windows = windows
+        self._totals = {dim: Counter() for dim in self.dimensions}
+        self._totals_lines = 0
+        self._totals_invalid = 0
+        # 当前窗口中还未查询的 原始IP字符串 -> 请求数
+        self._pending = {}
+        self._pending_lines = 0
+        self._lock = threading.Lock()
+        self.lines = 0
+        self.lookups = 0
+        self.started = time.time()
+        self._roll(time.time())
+
+    def _roll(self, now):
+        """开始新的窗口，超出保留个数的旧窗口从合计中减去"""
+        with self._lock:
+            self._windows.append(_Window(now, self.dimensions))
+            while len(self._windows) > self._max_windows:
+                old = self._windows.popleft()
+                for dim, counts in old.counts.items():
+                    self._totals[dim].subtract(counts)
+                    # 减到0的取值不再出现在快照中
+                    for value in [v for v, n in self._totals[dim].items() if n <= 0]:
+                        del self._totals[dim][value]
+                self._totals_lines -= old.lines
+                self._totals_invalid -= old.invalid
+
+    def feed(self, lines):
+        """读入一批日志行，只计数，不查询"""
+        pending = self._pending
+        use_xff = self.use_xff
+        count = 0
+        for line in lines:
+            ip = client_ip(line, use_xff)
+            if ip is None:
+                continue
+            pending[ip] = pending.get(ip, 0) + 1
+            count += 1
+        self._pending_lines += count
+        self.lines += count
+        if len(pending) >= self.max_pending:
+            self.flush()
+        self.tick()
+
+    def tick(self, now=None):
+        """当前窗口到期时结束它并开始新窗口，跟踪文件时没有新行也要定期调用"""
+        now = time.time() if now is None else now
+        if now - self._windows[-1].started >= self.window:
+            self.flush()
+            self._roll(now)
+
+    def flush(self):
+        """查询当前窗口中积累的IP，累加到当前窗口和合计"""
+        pending, self._pending = self._pending, {}
+        lines, self._pending_lines = self._pending_lines, 0
+        if not pending:
+            return
+        # 同一个IP可能有不同写法（例如IPv6的大小写），规范化后合并计数
+        hits = {}
+        invalid = 0
+        for raw, n in pending.items():
+            try:
+                ip = str(ipaddress.ip_address(raw))
+            except ValueError:
+                invalid += n
+                continue
+            hits[ip] = hits.get(ip, 0) + n
+        ips = list(hits)
+        results = self.resolve(ips) if ips else []
+        self.lookups += len(ips)
+
+        batch = {dim: Counter() for dim in self.dimensions}
+        for ip, result in zip(ips, results):
+            n = hits[ip]
+            for dim in self.dimensions:
+                batch[dim][result.get(dim) or UNKNOWN] += n
+        with self._lock:
+            window = self._windows[-1]
+            window.lines += lines
+            window.invalid += invalid
+            window.unique_ips += len(ips)
+            for dim, counts in batch.items():
+                window.counts[dim].update(counts)
+                self._totals[dim].update(counts)
+            self._totals_lines += lines
+            self._totals_invalid += invalid
+
+    def snapshot(self, top=20):
+        """最近各窗口合计的统计，每个维度按请求数取前top个；当前窗口只包含已经查询过的部分"""
+        with self._lock:
+            windows = list(self._windows)
+            return {
+                'window_seconds': self.window,
+                'windows': len(windows),
+                'since': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(windows[0].started)),
+                'lines': self._totals_lines,
+                'invalid': self._totals_invalid,
+                'unique_ips_per_window': [w.unique_ips for w in windows],
+                'total_lines': self.lines,
+                'total_lookups': self.lookups,
+                'dimensions': {dim: [{'value': value, 'hits': n} for value, n in counts.most_common(top)]
+                               for dim, counts in self._totals.items()},
+            }
+
+
+def follow(path, from_end=True, poll_interval=1.0, batch_bytes=1 << 20):
+    """持续读取正在写入的日志文件，每次返回一批完整的行；没有新行时返回空列表
+
+    文件被轮转（inode变化）或截断时重新从头打开。
+    """
+    f = None
+    inode = None
+    partial = ''
+    while True:
+        if f is None:
+            try:
+                f = open(path, encoding='utf-8', errors='replace')
+            except FileNotFoundError:
+                yield []
+                time.sleep(poll_interval)
+                continue
+            inode = os.fstat(f.fileno()).st_ino
+            if from_end:
+                f.seek(0, os.SEEK_END)
+                from_end = False
+            partial = ''
+        lines = f.readlines(batch_bytes)
+        if lines:
+            lines[0] = partial + lines[0]
+            partial = '' if lines[-1].endswith('\n') else lines.pop()
+            yield lines
+            continue
+        yield []
+        time.sleep(poll_interval)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if st.st_ino != inode or st.st_size < f.tell():
+            # 轮转后旧文件中剩下的内容已经读完，从头读取新文件
+            f.close()
+            f = None
+
+
+def read_batches(f, batch_bytes=1 << 20):
+    """一次性读完文件，每次返回一批行"""
+    while True:
+        lines = f.readlines(batch_bytes)
+        if not lines:
+            return
+        yield lines
+
+
+_tail_pid = None
+_tail_lock = threading.Lock()
+
+
+def start_tail(path, aggregator, poll_interval=1.0):
+    """启动后台线程从文件末尾开始跟踪日志；每个进程只启动一次"""
+    global _tail_pid
+    with _tail_lock:
+        if _tail_pid == os.getpid():
+            return None
+        _tail_pid = os.getpid()
+
+    def run():
+        for lines in follow(path, poll_interval=poll_interval):
+            try:
+                if lines:
+                    aggregator.feed(lines)
+                else:
+                    aggregator.tick()
+            except Exception as e:
+                print(f"Error processing access log {path}: {e}")
+
+    thread = threading.Thread(target=run, name='access-log-tail', daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv, app):
+    """命令行入口：统计日志文件或标准输入，按间隔把快照以NDJSON写到标准输出"""
+    parser = argparse.ArgumentParser(prog='app.py logs', description='统计访问日志中客户端IP的地区、ASN和ISP')
+    parser.add_argument('input', help='日志文件，- 表示标准输入（例如 zcat access.log.gz | ...）')
+    parser.add_argument('-f', '--follow', action='store_true', help='从文件末尾开始持续跟踪，类似 tail -F')
+    parser.add_argument('--window', type=int, default=60, help='时间窗口（秒），默认60')
+    parser.add_argument('--windows', type=int, default=60, help='保留的窗口个数，默认60')
+    parser.add_argument('--interval', type=float, default=10, help='输出快照的间隔（秒），默认10')
+    parser.add_argument('--top', type=int, default=20, help='每个维度输出前多少个取值，默认20')
+    parser.add_argument('--no-xff', action='store_true', help='忽略X-Forwarded-For，只使用$remote_addr')
+    args = parser.parse_args(argv)
+    if args.follow and args.input == '-':
+        parser.error('--follow 只能用于文件')
+
+    aggregator = LogAggregator(app.resolve_log_ips, app.LOG_DIMENSIONS, window=args.window,
+                               windows=args.windows, use_xff=not args.no_xff)
+
+    def write_snapshot():
+        sys.stdout.write(json.dumps(aggregator.snapshot(args.top), ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+    started = last_report = time.monotonic()
+    source = None
+    try:
+        if args.follow:
+            batches = follow(args.input)
+        else:
+            source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', errors='replace')
+            batches = read_batches(source)
+        for lines in batches:
+            if lines:
+                aggregator.feed(lines)
+            else:
+                aggregator.tick()
+            now = time.monotonic()
+            if args.interval and now - last_report >= args.interval:
+                last_report = now
+                aggregator.flush()
+                write_snapshot()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if source is not None and source is not sys.stdin:
+            source.close()
+    aggregator.flush()
+    write_snapshot()
+    elapsed = time.monotonic() - started
+    print(f"✓ processed {aggregator.lines} lines in {elapsed:.1f}s "
+          f"({aggregator.lines / elapsed if elapsed else 0:.0f} lines/s, {aggregator.lookups} lookups)", file=sys.stderr)
+    return 0
@@ -0,0 +1,147 @@
+"""批量查询接口的响应格式
+
+按请求的Accept头选择：
+    application/x-ndjson                 每行一个JSON对象（默认）
+    application/x-msgpack                连续的MessagePack对象，结构与NDJSON相同
+    application/vnd.apache.arrow.stream  Arrow IPC流，每行一个IP，列与 enrich.py 输出相同
+
+Arrow格式中字符串列为字典编码，国家、地区、ISP等取值在每个批次中只出现一次；经纬度和ASN为数值列。
+msgpack和pyarrow为可选依赖，未安装时请求对应格式返回406。
+"""
+import io
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/x-msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+# Accept头中可以使用的类型 -> 响应类型
+MIMETYPES = {
+    NDJSON: NDJSON,
+    'application/json': NDJSON,
+    MSGPACK: MSGPACK,
+    'application/msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+    ARROW: ARROW,
+}
+
+# Arrow格式中的数值字段，其余字段为字典编码的字符串
+NUMERIC_FIELDS = {'latitude': 'float64', 'longitude': 'float64', 'asn': 'int64'}
+
+# Arrow格式攒够这么多行再输出一个批次，批次太小时字典和元数据的开销占比大
+ARROW_BATCH_ROWS = 4096
+
+
+def negotiate(accept):
+    """按Accept头（werkzeug的MIMEAccept）选择响应类型，没有可用的类型时与以前一样返回NDJSON"""
+    return MIMETYPES.get(accept.best_match(list(MIMETYPES)), NDJSON)
+
+
+def missing_dependency(mimetype):
+    """返回输出该格式缺少的依赖包名，不缺时返回None"""
+    if mimetype == MSGPACK and msgpack is None:
+        return 'msgpack'
+    if mimetype == ARROW and pa is None:
+        return 'pyarrow'
+    return None
+
+
+class NdjsonEncoder:
+    def __init__(self, columns):
+        pass
+
+    def write(self, items):
+        return ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items).encode('utf-8')
+
+    def close(self):
+        return b''
+
+
+class MsgpackEncoder:
+    def __init__(self, columns):
+        self.packer = msgpack.Packer(use_bin_type=True)
+
+    def write(self, items):
+        pack = self.packer.pack
+        return b''.join(pack(item) for item in items)
+
+    def close(self):
+        return b''
+
+
+class ArrowEncoder:
+    """把查询结果按列写成Arrow IPC流
+
+    columns为 [(数据源, (字段, ...)), ...]；列名为 ip、error 和各数据源的 {数据源}_{字段}、{数据源}_error。
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        text = pa.dictionary(pa.int32(), pa.string())
+        fields = [pa.field('ip', pa.string()), pa.field('error', text)]
+        for provider, names in columns:
+            for name in names + ('error',):
+                type_name = NUMERIC_FIELDS.get(name) if name != 'error' else None
+                fields.append(pa.field(f'{provider}_{name}', pa.type_for_alias(type_name) if type_name else text))
+        self.schema = pa.schema(fields)
+        self.pending = []
+        self.sink = io.BytesIO()
+        # 各批次的字典不同，IPC流中以替换字典的方式写出
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def _arrays(self, items):
+        arrays = [pa.array([item['ip'] for item in items], pa.string()),
+                  pa.array([item.get('error') for item in items], pa.string()).dictionary_encode()]
+        position = 2
+        for provider, names in self.columns:
+            results = [item.get(provider, {}) for item in items]
+            for name in names + ('error',):
+                values = [result.get(name) for result in results]
+                field = self.schema.field(position)
+                if pa.types.is_dictionary(field.type):
+                    # 空字符串与NDJSON中一样保留，只有缺少的字段为null
+                    arrays.append(pa.array(values, pa.string()).dictionary_encode())
+                else:
+                    arrays.append(pa.array(values, field.type))
+                position += 1
+        return arrays
+
+    def _drain(self):
+        """取出已写入sink的数据"""
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def _flush(self):
+        if self.pending:
+            self.writer.write_batch(pa.RecordBatch.from_arrays(self._arrays(self.pending), schema=self.schema))
+            self.pending = []
+
+    def write(self, items):
+        self.pending.extend(items)
+        if len(self.pending) >= ARROW_BATCH_ROWS:
+            self._flush()
+        return self._drain()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        return self._drain()
+
+
+ENCODERS = {
+    NDJSON: NdjsonEncoder,
+    MSGPACK: MsgpackEncoder,
+    ARROW: ArrowEncoder,
+}
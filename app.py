@@ -1,20 +1,49 @@
-from flask import Flask, request, render_template_string
+from flask import Flask, request, Response, stream_with_context, g
 import maxminddb
 import IP2Location
 import os
+import time
+import hmac
+import hashlib
+import signal
+import sys
 import socket
-from ip2region.searcher import new_with_file_only
-from ip2region.util import load_header_from_file, version_from_header
+import json
+import ipaddress
+from collections import OrderedDict
+from itertools import islice
+from werkzeug.exceptions import BadRequest
+from ip2region.searcher import new_with_file_only, new_with_vector_index
+from ip2region.util import load_header_from_file, version_from_header, load_vector_index_from_file
 from ipdb import City
+from result_cache import PrefixCache, range_prefix_len
+from shared_cache import SharedResultCache, make_tag
+from ip2location_mem import MemoryIP2Location, INVALID_ADDRESS
+from mmdb_mem import MemoryMMDB
+from ipdb_mem import MemoryIpdb
+from generations import GenerationManager, ReaderGeneration, file_signature
+from unified_db import UnifiedDB, compile_unified
+from xdb import XdbFile, XdbBulk, pack_addresses
+from db_ranges import partition, MMDBRanges, IpdbRanges, IP2LocationRanges, XdbRanges
+from db_diff import compare as compare_databases, cached_report, report_ranges, merge_ranges
+from reverse_index import ReverseIndex, BackgroundIndex, build as build_reverse, search_networks
+from access_log import LogAggregator, start_tail
+from metrics import Registry, SIZE_BUCKETS
+from single_flight import SingleFlight
+import api_formats
 
-app = Flask(__name__)
+# 静态文件放在 /ip 路径下，与页面一起由反向代理转发
+app = Flask(__name__, static_url_path='/ip/static')
+# 静态文件的URL带有内容摘要，可以长期缓存
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 365 * 24 * 3600
 
-# 定义IP库路径
+# 定义IP库路径，可以使用通配符
 DB_PATH = {
     'geolite2_city': './db/GeoLite2/GeoLite2-City.mmdb',
     'geolite2_country': './db/GeoLite2/GeoLite2-Country.mmdb',
     'geolite2_asn': './db/GeoLite2/GeoLite2-ASN.mmdb',
-    'dbip_city': './db/db-ip/dbip-city-lite-2025-12.mmdb',
+    # db-ip按月发布，文件名带日期，取匹配到的最新文件
+    'dbip_city': './db/db-ip/dbip-city-lite-*.mmdb',
     'ip2location_v4': './db/ip2location/IP2LOCATION-LITE-DB11.BIN',
     'ip2location_v6': './db/ip2location/IP2LOCATION-LITE-DB11.IPV6.BIN',
     'ip2region_v4': './db/ip2region/ip2region_v4.xdb',
@@ -23,72 +52,203 @@ DB_PATH = {
     'qqwry': './db/qqwry/qqwry.ipdb'
 }
 
-# 初始化IP库读取器
+# 各IP库文件的区间索引，编译合并库和范围查询时按地址范围遍历
+RANGE_INDEXES = {
+    'geolite2_city': MMDBRanges,
+    'geolite2_country': MMDBRanges,
+    'geolite2_asn': MMDBRanges,
+    'dbip_city': MMDBRanges,
+    'ip2location_v4': IP2LocationRanges,
+    'ip2location_v6': IP2LocationRanges,
+    'ip2region_v4': XdbRanges,
+    'ip2region_v6': XdbRanges,
+    'ipip_free': IpdbRanges,
+    'qqwry': IpdbRanges,
+}
+
+# ip2region缓存策略：
+#   file        - 只打开文件，每次查询都要多次读文件
+#   vectorIndex - 缓存向量索引（512KB），每次查询少一次读文件
+#   content     - 整个xdb文件mmap到内存，查询时没有系统调用，多个进程共享同一份页缓存
+IP2REGION_CACHE_POLICY = os.environ.get('IP2REGION_CACHE_POLICY', 'vectorIndex')
+
+def open_ip2region(db_path, policy=IP2REGION_CACHE_POLICY):
+    """按缓存策略打开ip2region xdb文件"""
+    if policy == 'content':
+        # 只读的共享映射，gunicorn多个worker映射同一文件时共用物理内存；查询时同时得到命中的段，用于网段缓存
+        return XdbFile(db_path, willneed=True)
+    header = load_header_from_file(db_path)
+    version = version_from_header(header)
+    if policy == 'vectorIndex':
+        return new_with_vector_index(version, db_path, load_vector_index_from_file(db_path))
+    if policy == 'file':
+        return new_with_file_only(version, db_path)
+    raise ValueError(f'未知的ip2region缓存策略: {policy}')
+
+# ip2location读取方式：memory 使用常驻内存的读取器，library 使用官方库逐次读文件
+IP2LOCATION_ENGINE = os.environ.get('IP2LOCATION_ENGINE', 'memory')
+
+def open_ip2location(db_path, engine=IP2LOCATION_ENGINE):
+    """按读取方式打开ip2location BIN文件"""
+    if engine == 'memory':
+        return MemoryIP2Location(db_path)
+    if engine == 'library':
+        return IP2Location.IP2Location(db_path)
+    raise ValueError(f'未知的ip2location读取方式: {engine}')
+
+# MMDB读取方式：memory 自己查找搜索树并按记录位置缓存结果，library 使用 maxminddb 每次解码记录
+MMDB_ENGINE = os.environ.get('MMDB_ENGINE', 'memory')
+
+def open_mmdb(db_path, engine=MMDB_ENGINE):
+    """按读取方式打开GeoLite2、db-ip的mmdb文件"""
+    if engine == 'memory':
+        return MemoryMMDB(db_path)
+    if engine == 'library':
+        return maxminddb.open_database(db_path)
+    raise ValueError(f'未知的MMDB读取方式: {engine}')
+
+# 每一代读取器按记录位置缓存的结果数，超过后清空重新缓存，设为0关闭
+IP_RECORD_MEMO_SIZE = int(os.environ.get('IP_RECORD_MEMO_SIZE', 200000))
+_MISSING = object()
+
+# 查询方式：live 分别查询各IP库，unified 使用 unified_db.py 编译好的合并库
+# unified按规范的IP地址查询，ipaddress不接受的写法（127.1、01.2.3.4等）只有geolite2/dbip和ip2location
+# 得到与live相同的结果（见 _unified_fallback），其余数据源统一返回"无效的IP地址"
+IP_DB_ENGINE = os.environ.get('IP_DB_ENGINE', 'live')
+UNIFIED_DB_PATH = os.environ.get('UNIFIED_DB_PATH', './db/unified/unified.db')
+
+# 加载和热加载时检查的文件
+READER_PATHS = {'unified': UNIFIED_DB_PATH} if IP_DB_ENGINE == 'unified' else DB_PATH
+
+# 当前一代的IP库读取器，热加载时整体替换为新的一代，不在原字典上修改
 readers = {}
 
-# 初始化GeoLite2和db-ip的mmdb读取器
-try:
-    readers['geolite2_city'] = maxminddb.open_database(DB_PATH['geolite2_city'])
-    readers['geolite2_country'] = maxminddb.open_database(DB_PATH['geolite2_country'])
-    readers['geolite2_asn'] = maxminddb.open_database(DB_PATH['geolite2_asn'])
-    readers['dbip_city'] = maxminddb.open_database(DB_PATH['dbip_city'])
-except Exception as e:
-    print(f"Error opening MMDB files: {e}")
-
-# 初始化ip2location读取器
-try:
-    readers['ip2location_v4'] = IP2Location.IP2Location(DB_PATH['ip2location_v4'])
-    readers['ip2location_v6'] = IP2Location.IP2Location(DB_PATH['ip2location_v6'])
-except Exception as e:
-    print(f"Error opening IP2Location files: {e}")
-
-# 初始化ip2region读取器
-try:
-    # 加载IPv4数据库
-    header_v4 = load_header_from_file(DB_PATH['ip2region_v4'])
-    version_v4 = version_from_header(header_v4)
-    readers['ip2region_v4'] = new_with_file_only(version_v4, DB_PATH['ip2region_v4'])
-    
-    # 加载IPv6数据库
-    header_v6 = load_header_from_file(DB_PATH['ip2region_v6'])
-    version_v6 = version_from_header(header_v6)
-    readers['ip2region_v6'] = new_with_file_only(version_v6, DB_PATH['ip2region_v6'])
-    
-except Exception as e:
-    print(f"Error opening ip2region files: {e}")
-
-# 初始化ipip.net读取器
-try:
-    readers['ipip_free'] = City(DB_PATH['ipip_free'])
-except Exception as e:
-    print(f"Error opening ipip.net files: {e}")
-
-# 初始化qqwry读取器
-try:
-    readers['qqwry'] = City(DB_PATH['qqwry'])
-    print(f"✓ qqwry database initialized successfully from {DB_PATH['qqwry']}")
-except Exception as e:
-    print(f"Error initializing qqwry database: {e}")
+# 预热新一代读取器时查询的地址
+WARMUP_IPS = ('8.8.8.8', '114.114.114.114', '223.5.5.5', '2001:4860:4860::8888', '240e::1')
+
+def warm_reader(reader):
+    """用几个常见地址查询新打开的读取器，让映射的页面和各库的内部缓存在使用前就绪"""
+    for ip in WARMUP_IPS:
+        try:
+            if isinstance(reader, (MemoryIP2Location, UnifiedDB)):
+                reader.lookup(ip)
+            elif isinstance(reader, IP2Location.IP2Location):
+                reader.get_all(ip)
+            elif isinstance(reader, City):
+                reader.find_map(ip, 'CN')
+            elif hasattr(reader, 'search'):
+                reader.search(ip)
+            else:
+                reader.get(ip)
+        except Exception:
+            # IPv4库查询IPv6地址等情况会报错，预热时忽略
+            pass
+
+# 各读取器的打开函数，以及是否通过文件偏移读文件（查询时每个线程各打开一个）
+if IP_DB_ENGINE == 'unified':
+    READER_OPENERS = {'unified': (UnifiedDB, False)}
+else:
+    READER_OPENERS = {
+        # GeoLite2和db-ip的mmdb读取器
+        'geolite2_city': (open_mmdb, False),
+        'geolite2_country': (open_mmdb, False),
+        'geolite2_asn': (open_mmdb, False),
+        'dbip_city': (open_mmdb, False),
+        # ip2location官方库每个线程各用一个
+        'ip2location_v4': (open_ip2location, IP2LOCATION_ENGINE == 'library'),
+        'ip2location_v6': (open_ip2location, IP2LOCATION_ENGINE == 'library'),
+        # ip2region content以外的模式每个线程各用一个
+        'ip2region_v4': (open_ip2region, IP2REGION_CACHE_POLICY != 'content'),
+        'ip2region_v6': (open_ip2region, IP2REGION_CACHE_POLICY != 'content'),
+        # ipip.net和qqwry整个文件读入内存
+        'ipip_free': (MemoryIpdb, False),
+        'qqwry': (MemoryIpdb, False),
+    }
+
+# 启动时打开IP库的方式：
+#   eager      - 导入时同时打开全部IP库，打开完成后才开始服务（gunicorn预加载时使用）
+#   background - 导入时只登记，开始服务时在后台同时打开全部IP库，请求先用到的库由请求线程打开
+#   lazy       - 只在第一次用到时打开，只查询部分数据源时其余的库不会打开
+# 热加载的新一代总是全部打开并预热之后才替换当前代
+IP_DB_OPEN = os.environ.get('IP_DB_OPEN', 'background')
+# 热加载时比较新旧IP库的报告目录，同一对文件只比较一次，多个进程共用结果
+IP_DB_DIFF_DIR = os.environ.get('IP_DB_DIFF_DIR', './db/diff')
+
+def add_reader(readers, key, opener, path, stateful=False):
+    """登记读取器，第一次使用时打开并预热；stateful表示读取器通过文件偏移读文件，查询时每个线程各打开一个"""
+    readers.add(key, lambda: opener(path), stateful, warm_reader)
+
+def load_readers(number, paths):
+    """登记一代IP库读取器，paths为解析通配符后的READER_PATHS
+
+    第一代按IP_DB_OPEN决定何时打开；热加载的新一代在这里同时打开并预热全部读取器。
+    """
+    gen = ReaderGeneration(number, paths)
+    started = time.perf_counter()
+    for key, (opener, stateful) in READER_OPENERS.items():
+        if gen.signatures[key] is None:
+            gen.errors[key] = f'文件不存在: {paths[key]}'
+            print(f"Error opening {key}: {paths[key]} not found")
+            continue
+        add_reader(gen.readers, key, opener, paths[key], stateful)
+
+    if number > 1 or IP_DB_OPEN == 'eager':
+        gen.readers.open_all()
+        pin_range_indexes(gen)
+    if number > 1:
+        old = reader_manager.acquire()
+        try:
+            if old is not None:
+                diff_generations(old, gen)
+        finally:
+            if old is not None:
+                reader_manager.release(old)
+    gen.load_seconds = time.perf_counter() - started
+    gen.loaded_at = time.time()
+    if gen.readers.pending():
+        print(f"✓ IP databases generation {number} registered in {gen.load_seconds * 1000:.1f}ms "
+              f"({IP_DB_OPEN}, {len(gen.readers)} databases)")
+    else:
+        print(f"✓ IP databases generation {number} loaded in {gen.load_seconds:.2f}s")
+    return gen
+
+# 页面每次最多查询的IP数
+PAGE_MAX_IPS = int(os.environ.get('IP_PAGE_MAX_IPS', 10))
+# 流式输出页面时每次发送的模板片段数，片段很小，合并后再发送
+PAGE_STREAM_BUFFER = 64
+
+def _static_version(filename):
+    """静态文件内容的摘要，加在URL上，文件修改后浏览器和代理缓存自动失效"""
+    with open(os.path.join(app.static_folder, filename), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:10]
+
+# 模板在启动时编译一次，之后每次请求直接渲染
+INDEX_TEMPLATE = app.jinja_env.get_template('index.html')
+STATIC_VERSION = _static_version('ip.css')
+
+def stream_page(template, **context):
+    """流式渲染页面，已经渲染的部分先发给浏览器，首字节时间与结果多少无关"""
+    app.update_template_context(context)
+    context['static_version'] = STATIC_VERSION
+    stream = template.stream(context)
+    stream.enable_buffering(PAGE_STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+def _page_results(ips):
+    """按批查询页面上的IP，逐个返回 (IP, 结果)，渲染到哪一批才查询哪一批"""
+    for start in range(0, len(ips), API_BATCH_SIZE):
+        batch = ips[start:start + API_BATCH_SIZE]
+        yield from zip(batch, lookup_batch(batch))
 
 @app.route('/ip', methods=['GET', 'POST'])
 def index():
-    result = {}
+    user_ip = None
     
     if request.method == 'POST':
         # 处理表单提交的IP
         ips = request.form.get('ips', '').strip().split('\n')
         ips = [ip.strip() for ip in ips if ip.strip()]
-        ips = ips[:10]  # 最多处理10个IP
-        
-        for ip in ips:
-            result[ip] = {
-                'geolite2': query_geolite2(ip),
-                'dbip': query_dbip(ip),
-                'ip2location': query_ip2location(ip),
-                'ip2region': query_ip2region(ip),
-                'ipip': query_ipip(ip),
-                'qqwry': query_qqwry(ip)
-            }
+        ips = list(dict.fromkeys(ips[:PAGE_MAX_IPS]))  # 最多处理PAGE_MAX_IPS个IP
     else:
         # 默认访问时，显示用户当前IP
         # 获取用户真实IP
@@ -96,620 +256,258 @@ def index():
         if not user_ip or user_ip == '127.0.0.1' or user_ip == '::1':
             # 尝试从X-Forwarded-For等头信息获取真实IP
             user_ip = request.headers.get('X-Real-IP') or request.headers.get('X-Forwarded-For', '').split(',')[0].strip() or user_ip
-        
-        # 查询用户IP信息
-        result[user_ip] = {
-            'geolite2': query_geolite2(user_ip),
-            'dbip': query_dbip(user_ip),
-            'ip2location': query_ip2location(user_ip),
-            'ip2region': query_ip2region(user_ip),
-            'ipip': query_ipip(user_ip),
-            'qqwry': query_qqwry(user_ip)
-        }
+        ips = [user_ip]
     
-    return render_template_string('''
-        <!DOCTYPE html>
-        <html lang="zh-CN">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>IP查询工具 - Timo Tools</title>
-            <style>
-                * {
-                    margin: 0;
-                    padding: 0;
-                    box-sizing: border-box;
-                }
-                
-                body {
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'PingFang SC', 'Hiragino Sans GB', 'Microsoft YaHei', Arial, sans-serif;
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    min-height: 100vh;
-                    padding: 20px;
-                }
-                
-                .container {
-                    max-width: 1200px;
-                    margin: 0 auto;
-                    background: white;
-                    border-radius: 12px;
-                    box-shadow: 0 10px 30px rgba(0, 0, 100, 0.1);
-                    overflow: hidden;
-                    display: flex;
-                    flex-direction: column;
-                    min-height: calc(100vh - 40px);
-                }
-                
-                header {
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white;
-                    padding: 30px;
-                    text-align: center;
-                }
-                
-                header h1 {
-                    font-size: 28px;
-                    margin-bottom: 10px;
-                    font-weight: 600;
-                }
-                
-                header p {
-                    font-size: 16px;
-                    opacity: 0.9;
-                }
-                
-                main {
-                    flex: 1;
-                    padding: 30px;
-                }
-                
-                .input-section {
-                    background: #f8f9fa;
-                    padding: 25px;
-                    border-radius: 8px;
-                    margin-bottom: 30px;
-                    border: 1px solid #e9ecef;
-                }
-                
-                .input-section h2 {
-                    font-size: 20px;
-                    color: #343a40;
-                    margin-bottom: 15px;
-                    font-weight: 600;
-                }
-                
-                textarea {
-                    width: 100%;
-                    padding: 15px;
-                    border: 2px solid #e9ecef;
-                    border-radius: 8px;
-                    font-size: 16px;
-                    min-height: 180px;
-                    resize: vertical;
-                    font-family: inherit;
-                    transition: all 0.3s ease;
-                    background: white;
-                }
-                
-                textarea:focus {
-                    outline: none;
-                    border-color: #667eea;
-                    box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-                }
-                
-                button {
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white;
-                    padding: 12px 30px;
-                    border: none;
-                    border-radius: 8px;
-                    cursor: pointer;
-                    font-size: 16px;
-                    font-weight: 500;
-                    transition: all 0.3s ease;
-                    margin-top: 15px;
-                }
-                
-                button:hover {
-                    transform: translateY(-2px);
-                    box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
-                }
-                
-                button:active {
-                    transform: translateY(0);
-                }
-                
-                .result-section {
-                    background: #f8f9fa;
-                    padding: 25px;
-                    border-radius: 8px;
-                    border: 1px solid #e9ecef;
-                }
-                
-                .result-section h2 {
-                    font-size: 20px;
-                    color: #343a40;
-                    margin-bottom: 20px;
-                    font-weight: 600;
-                }
-                
-                .ip-result {
-                    background: white;
-                    margin-bottom: 20px;
-                    padding: 20px;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 8px rgba(0, 0, 0, 0.05);
-                    border: 1px solid #e9ecef;
-                    transition: all 0.3s ease;
-                }
-                
-                .ip-result:hover {
-                    box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-                }
-                
-                .ip-title {
-                    font-size: 20px;
-                    font-weight: 600;
-                    margin-bottom: 20px;
-                    color: #343a40;
-                    padding-bottom: 10px;
-                    border-bottom: 2px solid #e9ecef;
-                }
-                
-                .database-container {
-                    display: grid;
-                    grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
-                    gap: 20px;
-                }
-                
-                .database-result {
-                    background: #f8f9fa;
-                    padding: 18px;
-                    border-radius: 6px;
-                    border: 1px solid #e9ecef;
-                }
-                
-                .database-name {
-                    font-weight: 600;
-                    color: #667eea;
-                    margin-bottom: 12px;
-                    font-size: 16px;
-                }
-                
-                .info-list {
-                    list-style: none;
-                }
-                
-                .info-item {
-                    font-size: 14px;
-                    color: #555;
-                    margin-bottom: 8px;
-                    display: flex;
-                    align-items: center;
-                }
-                
-                .info-item:last-child {
-                    margin-bottom: 0;
-                }
-                
-                .info-label {
-                    font-weight: 500;
-                    color: #666;
-                    margin-right: 8px;
-                    min-width: 60px;
-                }
-                
-                .error {
-                    color: #dc3545;
-                    font-size: 14px;
-                    padding: 10px;
-                    background: #f8d7da;
-                    border: 1px solid #f5c6cb;
-                    border-radius: 4px;
-                    margin-top: 10px;
-                }
-                
-                footer {
-                    background: #343a40;
-                    color: white;
-                    padding: 20px;
-                    text-align: center;
-                    font-size: 14px;
-                    margin-top: auto;
-                }
-                
-                footer a {
-                    color: #667eea;
-                    text-decoration: none;
-                    transition: color 0.3s ease;
-                }
-                
-                footer a:hover {
-                    color: #764ba2;
-                    text-decoration: underline;
-                }
-                
-                .footer-content {
-                    max-width: 1200px;
-                    margin: 0 auto;
-                    display: flex;
-                    flex-direction: column;
-                    align-items: center;
-                    gap: 10px;
-                }
-                
-                .footer-info {
-                    text-align: center;
-                }
-                
-                .footer-info p {
-                    margin: 2px 0;
-                    color: white;
-                    opacity: 0.9;
-                    line-height: 1.4;
-                }
-                
-                .footer-info a {
-                    color: #667eea;
-                    text-decoration: none;
-                    transition: color 0.3s ease;
-                }
-                
-                .footer-info a:hover {
-                    color: #764ba2;
-                    text-decoration: underline;
-                }
-                
-                @media (max-width: 768px) {
-                    body {
-                        padding: 10px;
-                    }
-                    
-                    .container {
-                        min-height: calc(100vh - 20px);
-                    }
-                    
-                    header, main {
-                        padding: 20px;
-                    }
-                    
-                    header h1 {
-                        font-size: 24px;
-                    }
-                    
-                    .database-container {
-                        grid-template-columns: 1fr;
-                    }
-                    
-                    .footer-links {
-                        flex-direction: column;
-                        gap: 10px;
-                    }
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <header>
-                    <h1>IP查询工具</h1>
-                    <p>支持最多10个IP地址的批量查询，包括IPv4和IPv6</p>
-                    {% if request.method == 'GET' and result %}
-                    <p style="margin-top: 10px; font-weight: 600;">你的IP是: {% for ip in result.keys() %}{{ ip }}{% endfor %}</p>
-                    {% endif %}
-                </header>
-                
-                <main>
-                    <div class="input-section">
-                        <h2>输入IP地址</h2>
-                        <form method="post" action="/ip">
-                            <textarea name="ips" placeholder="请输入IP地址，每行一个，最多10个">{{ request.form.get('ips', '') }}</textarea>
-                            <br>
-                            <button type="submit">查询</button>
-                        </form>
-                    </div>
-                    
-                    {% if result %}
-                    <div class="result-section">
-                        <h2>查询结果</h2>
-                        {% for ip, data in result.items() %}
-                        <div class="ip-result">
-                            <div class="ip-title">IP: {{ ip }}</div>
-                            
-                            <div class="database-container">
-                                <!-- GeoLite2 -->
-                                <div class="database-result">
-                                    <div class="database-name">1. GeoLite2</div>
-                                    {% if data.geolite2.error %}
-                                    <div class="error">{{ data.geolite2.error }}</div>
-                                    {% else %}
-                                    <ul class="info-list">
-                                        {% if data.geolite2.country %}
-                                        <li class="info-item"><span class="info-label">国家:</span> {{ data.geolite2.country }}</li>
-                                        {% endif %}
-                                        {% if data.geolite2.region %}
-                                        <li class="info-item"><span class="info-label">地区:</span> {{ data.geolite2.region }}</li>
-                                        {% endif %}
-                                        {% if data.geolite2.city %}
-                                        <li class="info-item"><span class="info-label">城市:</span> {{ data.geolite2.city }}</li>
-                                        {% endif %}
-                                        {% if data.geolite2.latitude %}
-                                        <li class="info-item"><span class="info-label">纬度:</span> {{ data.geolite2.latitude }}</li>
-                                        {% endif %}
-                                        {% if data.geolite2.longitude %}
-                                        <li class="info-item"><span class="info-label">经度:</span> {{ data.geolite2.longitude }}</li>
-                                        {% endif %}
-                                        {% if data.geolite2.asn %}
-                                        <li class="info-item"><span class="info-label">ASN:</span> {{ data.geolite2.asn }}</li>
-                                        {% endif %}
-                                        {% if data.geolite2.isp %}
-                                        <li class="info-item"><span class="info-label">ISP:</span> {{ data.geolite2.isp }}</li>
-                                        {% endif %}
-                                    </ul>
-                                    {% endif %}
-                                </div>
-                                
-                                <!-- db-ip -->
-                                <div class="database-result">
-                                    <div class="database-name">2. db-ip</div>
-                                    {% if data.dbip.error %}
-                                    <div class="error">{{ data.dbip.error }}</div>
-                                    {% else %}
-                                    <ul class="info-list">
-                                        {% if data.dbip.country %}
-                                        <li class="info-item"><span class="info-label">国家:</span> {{ data.dbip.country }}</li>
-                                        {% endif %}
-                                        {% if data.dbip.region %}
-                                        <li class="info-item"><span class="info-label">地区:</span> {{ data.dbip.region }}</li>
-                                        {% endif %}
-                                        {% if data.dbip.city %}
-                                        <li class="info-item"><span class="info-label">城市:</span> {{ data.dbip.city }}</li>
-                                        {% endif %}
-                                        {% if data.dbip.latitude %}
-                                        <li class="info-item"><span class="info-label">纬度:</span> {{ data.dbip.latitude }}</li>
-                                        {% endif %}
-                                        {% if data.dbip.longitude %}
-                                        <li class="info-item"><span class="info-label">经度:</span> {{ data.dbip.longitude }}</li>
-                                        {% endif %}
-                                    </ul>
-                                    {% endif %}
-                                </div>
-                                
-                                <!-- ip2location -->
-                                <div class="database-result">
-                                    <div class="database-name">3. ip2location</div>
-                                    {% if data.ip2location.error %}
-                                    <div class="error">{{ data.ip2location.error }}</div>
-                                    {% else %}
-                                    <ul class="info-list">
-                                        {% if data.ip2location.country %}
-                                        <li class="info-item"><span class="info-label">国家:</span> {{ data.ip2location.country }}</li>
-                                        {% endif %}
-                                        {% if data.ip2location.region %}
-                                        <li class="info-item"><span class="info-label">地区:</span> {{ data.ip2location.region }}</li>
-                                        {% endif %}
-                                        {% if data.ip2location.city %}
-                                        <li class="info-item"><span class="info-label">城市:</span> {{ data.ip2location.city }}</li>
-                                        {% endif %}
-                                        {% if data.ip2location.zipcode %}
-                                        <li class="info-item"><span class="info-label">邮编:</span> {{ data.ip2location.zipcode }}</li>
-                                        {% endif %}
-                                    </ul>
-                                    {% endif %}
-                                </div>
-                                
-                                <!-- ip2region -->
-                                <div class="database-result">
-                                    <div class="database-name">4. ip2region</div>
-                                    {% if data.ip2region.error %}
-                                    <div class="error">{{ data.ip2region.error }}</div>
-                                    {% else %}
-                                    <ul class="info-list">
-                                        {% if data.ip2region.country %}
-                                        <li class="info-item"><span class="info-label">国家:</span> {{ data.ip2region.country }}</li>
-                                        {% endif %}
-                                        {% if data.ip2region.region %}
-                                        <li class="info-item"><span class="info-label">地区:</span> {{ data.ip2region.region }}</li>
-                                        {% endif %}
-                                        {% if data.ip2region.city %}
-                                        <li class="info-item"><span class="info-label">城市:</span> {{ data.ip2region.city }}</li>
-                                        {% endif %}
-                                        {% if data.ip2region.isp %}
-                                        <li class="info-item"><span class="info-label">ISP:</span> {{ data.ip2region.isp }}</li>
-                                        {% endif %}
-                                    </ul>
-                                    {% endif %}
-                                </div>
-                                
-                                <!-- ipip.net -->
-                                <div class="database-result">
-                                    <div class="database-name">5. ipip.net</div>
-                                    {% if data.ipip.error %}
-                                    <div class="error">{{ data.ipip.error }}</div>
-                                    {% else %}
-                                    <ul class="info-list">
-                                        {% if data.ipip.country %}
-                                        <li class="info-item"><span class="info-label">国家:</span> {{ data.ipip.country }}</li>
-                                        {% endif %}
-                                        {% if data.ipip.region %}
-                                        <li class="info-item"><span class="info-label">地区:</span> {{ data.ipip.region }}</li>
-                                        {% endif %}
-                                        {% if data.ipip.city %}
-                                        <li class="info-item"><span class="info-label">城市:</span> {{ data.ipip.city }}</li>
-                                        {% endif %}
-                                        {% if data.ipip.isp %}
-                                        <li class="info-item"><span class="info-label">ISP:</span> {{ data.ipip.isp }}</li>
-                                        {% endif %}
-                                    </ul>
-                                    {% endif %}
-                                </div>
-                                
-                                <!-- qqwry -->
-                                <div class="database-result">
-                                    <div class="database-name">6. qqwry</div>
-                                    {% if data.qqwry.error %}
-                                    <div class="error">{{ data.qqwry.error }}</div>
-                                    {% else %}
-                                    <ul class="info-list">
-                                        {% if data.qqwry.country %}
-                                        <li class="info-item"><span class="info-label">国家:</span> {{ data.qqwry.country }}</li>
-                                        {% endif %}
-                                        {% if data.qqwry.region %}
-                                        <li class="info-item"><span class="info-label">地区:</span> {{ data.qqwry.region }}</li>
-                                        {% endif %}
-                                        {% if data.qqwry.city %}
-                                        <li class="info-item"><span class="info-label">城市:</span> {{ data.qqwry.city }}</li>
-                                        {% endif %}
-                                        {% if data.qqwry.district %}
-                                        <li class="info-item"><span class="info-label">区县:</span> {{ data.qqwry.district }}</li>
-                                        {% endif %}
-                                        {% if data.qqwry.isp %}
-                                        <li class="info-item"><span class="info-label">ISP:</span> {{ data.qqwry.isp }}</li>
-                                        {% endif %}
-                                    </ul>
-                                    {% endif %}
-                                </div>
-                                
-
-                            </div>
-                        </div>
-                        {% endfor %}
-                    </div>
-                    {% endif %}
-                </main>
-                
-                <footer>
-                    <div class="footer-content">
-                        <div class="footer-info">
-                            <p>Author：Timo & TRAE</p>
-                            <p>GitHub：<a href="https://github.com/timoseven/ip" target="_blank">https://github.com/timoseven/ip</a></p>
-                        </div>
-                    </div>
-                </footer>
-            </div>
-        </body>
-        </html>
-    ''', result=result)
-
-def query_geolite2(ip):
-    """使用GeoLite2查询IP信息，同时查询city、country、asn三个数据库"""
+    # 页面头部和表单先发出，查询结果按批查询、边查边输出
+    return stream_page(INDEX_TEMPLATE, ips=ips, results=_page_results(ips), user_ip=user_ip, max_ips=PAGE_MAX_IPS)
+
+def _need(fields, *names):
+    """fields为None表示需要全部字段，否则判断是否请求了names中的任一字段"""
+    return fields is None or any(name in fields for name in names)
+
+def _select_fields(result, fields):
+    """只保留请求的字段，错误信息原样返回"""
+    if fields is None or 'error' in result:
+        return result
+    selected = {k: v for k, v in result.items() if k in fields}
+    return selected if selected else {'error': '未找到信息'}
+
+def _memoized(pool, key, build):
+    """按记录位置缓存由记录得到的结果，同一条记录只解码和转换一次
+
+    缓存放在这一代读取器中，随这一代一起丢弃；结果被多个查询共享，调用方不应修改。
+    """
+    if IP_RECORD_MEMO_SIZE <= 0:
+        return build()
+    records = pool.records
+    value = records.get(key, _MISSING)
+    if value is _MISSING:
+        if len(records) >= IP_RECORD_MEMO_SIZE:
+            records.clear()
+        value = records[key] = build()
+    return value
+
+def _interned(result):
+    """结果中的字符串换成驻留的对象，大量记录中相同的国家、地区名只保存一份"""
+    if result:
+        for key, value in result.items():
+            if type(value) is str:
+                result[key] = sys.intern(value)
+    return result
+
+def _mmdb_record(pool, key, ip, convert):
+    """查询MMDB读取器，返回 (convert(记录), 前缀长度, 记录位置)，没有记录时结果为None
+
+    常驻内存读取器按记录位置缓存转换结果，没有记录时位置为0；maxminddb读取器每次解码，位置为None。
+    """
+    reader = pool[key]
+    if isinstance(reader, MemoryMMDB):
+        pointer, prefix_len = reader.find(ip)
+        if pointer is None:
+            return None, prefix_len, 0
+        return _memoized(pool, (key, pointer), lambda: _interned(convert(reader.get(ip)))), prefix_len, pointer
+    data, prefix_len = reader.get_with_prefix_len(ip)
+    return convert(data), prefix_len, None
+
+def _localized(names):
+    return names.get('zh-CN', names.get('en', ''))
+
+def _geolite2_city(data):
+    """GeoLite2 City记录中的国家、地区、城市和经纬度"""
+    if not data:
+        return None
+    result = {}
+    # 1. 处理国家信息
+    country_data = data.get('registered_country') or data.get('country')
+    if country_data and 'names' in country_data:
+        result['country'] = _localized(country_data['names'])
+    
+    # 2. 处理城市信息，优先从subdivisions获取，再从city获取
+    city_name = ''
+    
+    # 尝试从subdivisions获取地区信息（可能包含城市或省份）
+    if 'subdivisions' in data and data['subdivisions']:
+        result['region'] = _localized(data['subdivisions'][0]['names'])
+        # 使用地区信息作为城市名的备选
+        city_name = result['region']
+    
+    # 尝试从city字段获取城市信息
+    if 'city' in data and 'names' in data['city']:
+        city_from_city = _localized(data['city']['names'])
+        if city_from_city:
+            city_name = city_from_city
+    
+    # 3. 处理经纬度信息
+    if 'location' in data:
+        if 'latitude' in data['location']:
+            result['latitude'] = data['location']['latitude']
+        if 'longitude' in data['location']:
+            result['longitude'] = data['location']['longitude']
+    
+    # 4. 如果仍然没有城市信息，使用国家名作为城市名
+    if not city_name and 'country' in result:
+        city_name = result['country']
+    
+    # 添加城市信息
+    result['city'] = city_name
+    return result
+
+def _geolite2_asn(data):
+    """GeoLite2 ASN记录中的ASN和运营商"""
+    if not data:
+        return None
+    result = {}
+    if 'autonomous_system_number' in data:
+        result['asn'] = data['autonomous_system_number']
+    if 'autonomous_system_organization' in data:
+        result['isp'] = data['autonomous_system_organization']
+    return result
+
+def _geolite2_country(data):
+    """GeoLite2 Country记录中的国家名，没有时返回None"""
+    if not data:
+        return None
+    country_info = data.get('registered_country') or data.get('country')
+    if country_info and 'names' in country_info:
+        return {'country': _localized(country_info['names'])}
+    return None
+
+def _lookup_geolite2(ip, fields=None):
+    """使用GeoLite2查询IP信息，同时查询city、country、asn三个数据库
+
+    只查询能提供所请求字段的数据库，例如只要asn时不会读取city数据库。
+    返回 (结果, 前缀长度)，前缀长度取各数据库网段中最长的一个，即它们的交集。
+    各数据库的记录位置都已知时，按位置组合缓存最终结果，重复的记录组合不再合并。
+    """
     try:
-        result = {}
+        pool = readers
+        prefix_len = None
+        city = asn = country = None
+        # 各数据库的记录位置，没有查询的数据库为0
+        refs = [0, 0, 0]
         
         # 查询city数据库
-        if 'geolite2_city' in readers:
-            city_data = readers['geolite2_city'].get(ip)
-            if city_data:
-                # 1. 处理国家信息
-                country_data = city_data.get('registered_country') or city_data.get('country')
-                if country_data and 'names' in country_data:
-                    result['country'] = country_data['names'].get('zh-CN', country_data['names'].get('en', ''))
-                
-                # 2. 处理城市信息，优先从subdivisions获取，再从city获取
-                city_name = ''
-                
-                # 尝试从subdivisions获取地区信息（可能包含城市或省份）
-                if 'subdivisions' in city_data and city_data['subdivisions']:
-                    result['region'] = city_data['subdivisions'][0]['names'].get('zh-CN', city_data['subdivisions'][0]['names'].get('en', ''))
-                    # 使用地区信息作为城市名的备选
-                    city_name = result['region']
-                
-                # 尝试从city字段获取城市信息
-                if 'city' in city_data and 'names' in city_data['city']:
-                    city_from_city = city_data['city']['names'].get('zh-CN', city_data['city']['names'].get('en', ''))
-                    if city_from_city:
-                        city_name = city_from_city
-                
-                # 3. 处理经纬度信息
-                if 'location' in city_data:
-                    if 'latitude' in city_data['location']:
-                        result['latitude'] = city_data['location']['latitude']
-                    if 'longitude' in city_data['location']:
-                        result['longitude'] = city_data['location']['longitude']
-                
-                # 4. 如果仍然没有城市信息，使用国家名作为城市名
-                if not city_name and 'country' in result:
-                    city_name = result['country']
-                
-                # 添加城市信息
-                result['city'] = city_name
+        if 'geolite2_city' in pool and _need(fields, 'country', 'region', 'city', 'latitude', 'longitude'):
+            city, city_prefix, refs[0] = _mmdb_record(pool, 'geolite2_city', ip, _geolite2_city)
+            prefix_len = max(prefix_len or 0, city_prefix)
         
         # 查询asn数据库
-        if 'geolite2_asn' in readers:
-            asn_data = readers['geolite2_asn'].get(ip)
-            if asn_data:
-                if 'autonomous_system_number' in asn_data:
-                    result['asn'] = asn_data['autonomous_system_number']
-                if 'autonomous_system_organization' in asn_data:
-                    result['isp'] = asn_data['autonomous_system_organization']
+        if 'geolite2_asn' in pool and _need(fields, 'asn', 'isp'):
+            asn, asn_prefix, refs[1] = _mmdb_record(pool, 'geolite2_asn', ip, _geolite2_asn)
+            prefix_len = max(prefix_len or 0, asn_prefix)
         
         # 查询country数据库作为补充
-        if 'geolite2_country' in readers and 'country' not in result:
-            country_data = readers['geolite2_country'].get(ip)
-            if country_data:
-                country_info = country_data.get('registered_country') or country_data.get('country')
-                if country_info and 'names' in country_info:
-                    country_name = country_info['names'].get('zh-CN', country_info['names'].get('en', ''))
-                    result['country'] = country_name
-                    # 补充城市信息
-                    if 'city' not in result:
-                        result['city'] = country_name
+        if 'geolite2_country' in pool and not (city and 'country' in city) and _need(fields, 'country', 'city'):
+            country, country_prefix, refs[2] = _mmdb_record(pool, 'geolite2_country', ip, _geolite2_country)
+            prefix_len = max(prefix_len or 0, country_prefix)
+        
+        def combine():
+            result = {}
+            if city:
+                result.update(city)
+            if asn:
+                result.update(asn)
+            if country:
+                result.update(country)
+                # 补充城市信息
+                if 'city' not in result:
+                    result['city'] = country['country']
+            return _select_fields(result, fields) if result else {'error': '未找到信息'}
         
-        return result if result else {'error': '未找到信息'}
+        if None in refs:
+            return combine(), prefix_len
+        return _memoized(pool, ('geolite2', *refs, fields), combine), prefix_len
     except Exception as e:
-        return {'error': str(e)}
+        return {'error': str(e)}, None
 
-def query_dbip(ip):
-    """使用db-ip查询IP信息"""
+def _dbip_city(data):
+    """db-ip记录中的城市、国家、地区和经纬度"""
+    if not data:
+        return None
+    result = {}
+    if 'city' in data and 'names' in data['city']:
+        result['city'] = _localized(data['city']['names'])
+    
+    if 'country' in data and 'names' in data['country']:
+        result['country'] = _localized(data['country']['names'])
+    
+    if 'subdivisions' in data and data['subdivisions']:
+        result['region'] = _localized(data['subdivisions'][0]['names'])
+    
+    if 'location' in data:
+        if 'latitude' in data['location']:
+            result['latitude'] = data['location']['latitude']
+        if 'longitude' in data['location']:
+            result['longitude'] = data['location']['longitude']
+    return result
+
+def _lookup_dbip(ip, fields=None):
+    """使用db-ip查询IP信息，返回 (结果, 前缀长度)"""
     try:
-        if 'dbip_city' not in readers:
-            return {'error': 'db-ip数据库未加载'}
-        
-        data = readers['dbip_city'].get(ip)
-        if not data:
-            return {'error': '未找到信息'}
-        
-        result = {}
-        if 'city' in data and 'names' in data['city']:
-            result['city'] = data['city']['names'].get('zh-CN', data['city']['names'].get('en', ''))
-        
-        if 'country' in data and 'names' in data['country']:
-            result['country'] = data['country']['names'].get('zh-CN', data['country']['names'].get('en', ''))
-        
-        if 'subdivisions' in data and data['subdivisions']:
-            result['region'] = data['subdivisions'][0]['names'].get('zh-CN', data['subdivisions'][0]['names'].get('en', ''))
-        
-        if 'location' in data:
-            if 'latitude' in data['location']:
-                result['latitude'] = data['location']['latitude']
-            if 'longitude' in data['location']:
-                result['longitude'] = data['location']['longitude']
+        pool = readers
+        if 'dbip_city' not in pool:
+            return {'error': 'db-ip数据库未加载'}, None
         
-        return result
+        result, prefix_len, ref = _mmdb_record(pool, 'dbip_city', ip, _dbip_city)
+        if result is None:
+            return {'error': '未找到信息'}, prefix_len
+        if ref is None:
+            return _select_fields(result, fields), prefix_len
+        return _memoized(pool, ('dbip', ref, fields), lambda: _select_fields(result, fields)), prefix_len
     except Exception as e:
-        return {'error': str(e)}
+        return {'error': str(e)}, None
+
+# ip2location结果中可能出现的字段，与常驻内存读取器的列名一致
+IP2LOCATION_COLUMNS = ('country', 'region', 'city', 'isp', 'domain', 'zipcode')
+
+# ip2location结果的字段，按结果中的顺序
+IP2LOCATION_RESULT_FIELDS = ('city', 'country', 'region', 'isp', 'domain', 'zipcode')
 
-def query_ip2location(ip):
-    """使用ip2location查询IP信息"""
+def _is_ipv6_input(ip):
+    """判断查询IPv4库还是IPv6库（ip2location和ip2region）：inet_aton能解析的为IPv4，否则为IPv6地址时为IPv6，都不是返回None"""
     try:
-        # 判断IP类型
-        is_ipv6 = False
+        socket.inet_aton(ip)
+        return False
+    except socket.error:
         try:
-            socket.inet_aton(ip)
+            socket.inet_pton(socket.AF_INET6, ip)
+            return True
         except socket.error:
-            try:
-                socket.inet_pton(socket.AF_INET6, ip)
-                is_ipv6 = True
-            except socket.error:
-                return {'error': '无效的IP地址'}
+            return None
+
+def _lookup_ip2location(ip, fields=None):
+    """使用ip2location查询IP信息
+
+    常驻内存读取器只解码请求的列，并返回命中的区间用于网段缓存；
+    官方库不提供区间，返回的前缀长度为整个地址长度，即只缓存该IP本身。
+    """
+    try:
+        is_ipv6 = _is_ipv6_input(ip)
+        if is_ipv6 is None:
+            return {'error': '无效的IP地址'}, None
         
         # 选择对应的数据库
+        prefix_len = 128 if is_ipv6 else 32
         reader_key = 'ip2location_v6' if is_ipv6 else 'ip2location_v4'
         if reader_key not in readers:
-            return {'error': f'ip2location {"IPv6" if is_ipv6 else "IPv4"}数据库未加载'}
+            return {'error': f'ip2location {"IPv6" if is_ipv6 else "IPv4"}数据库未加载'}, None
         
-        rec = readers[reader_key].get_all(ip)
-        if not rec:
-            return {'error': '未找到信息'}
+        reader = readers[reader_key]
+        if isinstance(reader, MemoryIP2Location):
+            found = reader.lookup(ip, [c for c in IP2LOCATION_COLUMNS if _need(fields, c)])
+            if not found:
+                return {'error': '未找到信息'}, prefix_len
+            rec, first, last, row_version = found
+            if row_version == 0:
+                # 与官方库一样，库不接受的写法（例如 "127.1"）返回 INVALID IP ADDRESS，不缓存
+                prefix_len = None
+            # IPv4映射等地址命中的是IPv4区间，无法换算成查询地址的网段
+            elif row_version == (6 if is_ipv6 else 4):
+                prefix_len = range_prefix_len(int(ipaddress.ip_address(ip)), first, last, prefix_len)
+        else:
+            rec = reader.get_all(ip)
+            if not rec:
+                return {'error': '未找到信息'}, prefix_len
         
         result = {}
         if rec.city:
@@ -725,114 +523,1199 @@ def query_ip2location(ip):
         if rec.zipcode:
             result['zipcode'] = rec.zipcode
         
-        return result
+        return _select_fields(result, fields), prefix_len
     except Exception as e:
-        return {'error': str(e)}
+        return {'error': str(e)}, None
+
+def _lookup_ip2region(ip, fields=None):
+    """使用ip2region查询IP信息，返回更准确的结果
 
-def query_ip2region(ip):
-    """使用ip2region查询IP信息，返回更准确的结果"""
+    content模式下返回命中的段换算出的前缀长度，按网段缓存；
+    file/vectorIndex模式使用官方库，不提供命中的段，返回的前缀长度为整个地址长度，即只缓存该IP本身。
+    """
     try:
-        # 判断IP类型
-        is_ipv6 = False
-        try:
-            socket.inet_aton(ip)
-        except socket.error:
-            try:
-                socket.inet_pton(socket.AF_INET6, ip)
-                is_ipv6 = True
-            except socket.error:
-                return {'error': '无效的IP地址'}
+        is_ipv6 = _is_ipv6_input(ip)
+        if is_ipv6 is None:
+            return {'error': '无效的IP地址'}, None
         
         # 选择对应的数据库
+        prefix_len = 128 if is_ipv6 else 32
         reader_key = 'ip2region_v6' if is_ipv6 else 'ip2region_v4'
         if reader_key not in readers:
-            return {'error': f'ip2region {"IPv6" if is_ipv6 else "IPv4"}数据库未加载'}
-        
-        # 使用官方库查询
-        region_str = readers[reader_key].search(ip)
-        if not region_str:
-            return {'error': '未找到信息'}
-        
-        # 解析结果，格式为：国家|省份|城市|ISP
-        parts = region_str.split('|')
-        if len(parts) < 4:
-            return {'error': '未找到信息'}
+            return {'error': f'ip2region {"IPv6" if is_ipv6 else "IPv4"}数据库未加载'}, None
         
-        # 构建结果
-        result = {
-            'country': parts[0],
-            'region': parts[1],
-            'city': parts[2],
-            'isp': parts[3]
-        }
-        
-        return result
+        # 同一区域字符串只解析一次
+        reader = readers[reader_key]
+        if isinstance(reader, XdbFile):
+            region_str, first, last = reader.lookup(ip)
+            if first is not None:
+                prefix_len = range_prefix_len(int(ipaddress.ip_address(ip)), first, last, prefix_len)
+        else:
+            region_str = reader.search(ip)
+        return _memoized(readers, ('ip2region', region_str, fields),
+                         lambda: _parse_ip2region(region_str, fields)), prefix_len
     except Exception as e:
-        return {'error': str(e)}
+        return {'error': str(e)}, None
 
-def query_ipip(ip):
-    """使用ipip.net查询IP信息"""
+def _parse_ip2region(region_str, fields=None):
+    """解析ip2region的区域字符串，格式为：国家|省份|城市|ISP"""
+    if not region_str:
+        return {'error': '未找到信息'}
+    
+    parts = region_str.split('|')
+    if len(parts) < 4:
+        return {'error': '未找到信息'}
+    
+    # 构建结果
+    result = {
+        'country': parts[0],
+        'region': parts[1],
+        'city': parts[2],
+        'isp': parts[3]
+    }
+    
+    return _select_fields(result, fields)
+
+def _ip2region_bulk(version):
+    """当前一代ip2region数据库的批量查询器，第一次使用时载入段索引"""
+    gen = reader_manager.current
+    reader_key = f'ip2region_v{version}'
+    if reader_key not in gen.readers:
+        raise ValueError(f'ip2region IPv{version}数据库未加载')
+
+    def build():
+        xdb = XdbFile(gen.paths[reader_key])
+        try:
+            return XdbBulk(xdb)
+        finally:
+            xdb.close()
+
+    return gen.derived(f'{reader_key}_bulk', build)
+
+def _range_index(gen, key):
+    """一代IP库中key对应文件的区间索引，第一次用到时打开，随这一代一起关闭
+
+    文件在加载之后被替换时打开登记时保留的旧版本，被原地改写时抛出ValueError。
+    """
+    def build():
+        path = gen.source_path(key)
+        if path is None:
+            raise ValueError(f'{gen.paths[key]} was modified in place')
+        return RANGE_INDEXES[key](path)
+
+    return gen.derived(f'{key}_ranges', build)
+
+def pin_range_indexes(gen):
+    """打开一代IP库的区间索引，热加载时用于比较"""
+    for key in list(gen.readers):
+        # 文件在加载之后被原地改写的不再打开，否则打开的是改写后的内容
+        if key in RANGE_INDEXES and not gen.modified_in_place(key):
+            try:
+                _range_index(gen, key)
+            except Exception as e:
+                print(f"Error opening range index of {key}: {e}")
+
+def _old_version_missing(gen, key):
+    """读不到 gen 加载时 key 对应文件内容的原因，能读到时返回None
+
+    已打开的区间索引和登记时保留的文件描述符在文件被替换后仍指向旧版本，原地改写的文件无法读到旧版本。
+    """
+    if gen.modified_in_place(key):
+        return f'{gen.paths[key]} was modified in place'
+    if gen.has_derived(f'{key}_ranges') or gen.source_path(key) is not None:
+        return None
+    return f'old version of {gen.paths[key]} was not retained'
+
+def diff_generations(old, gen):
+    """比较两代之间发生变化的IP库文件，结果记在 gen.diffs 中，切换时只清除变化网段的缓存
+
+    比较失败的库不记录，切换时清空对应数据源的全部缓存。
+    """
+    for key in sorted(gen.changed_keys(old)):
+        if key not in RANGE_INDEXES or key not in gen.readers or key not in old.readers:
+            continue
+        missing = _old_version_missing(old, key)
+        if missing:
+            print(f"Skipping comparison of {key}: {missing}")
+            continue
+        pair = json.dumps([old.paths[key], old.signatures[key], gen.paths[key], gen.signatures[key]])
+        path = os.path.join(IP_DB_DIFF_DIR, f'{key}-{hashlib.sha1(pair.encode()).hexdigest()[:12]}.json')
+        try:
+            data = cached_report(path, lambda: compare_databases(
+                _range_index(old, key), _range_index(gen, key), old.paths[key], gen.paths[key]))
+            gen.diffs[key] = report_ranges(data)
+        except Exception as e:
+            print(f"Error comparing {key}: {e}")
+            continue
+        summary = ', '.join(f'IPv{version} {len(networks)} networks' for version, networks in data['changed'].items())
+        print(f"✓ {key} compared with generation {old.number} in {data['seconds']:.2f}s: {summary}")
+
+def bulk_query_ip2region(addresses, version=4, fields=None):
+    """用NumPy批量查询ip2region
+
+    addresses为uint32数组（IPv4）或16字节网络字节序数组（IPv6），可以用 pack_addresses() 从字符串转换。
+    返回 (下标数组, 结果表)：结果表[下标] 与 query_ip2region 对同一IP的结果相同。
+    """
+    bulk = _ip2region_bulk(version)
+    table = [_parse_ip2region(region, fields) for region in bulk.regions]
+    return bulk.lookup(addresses), table
+
+# ipdb记录中的列和对应的结果字段
+IPIP_COLUMNS = (('country_name', 'country'), ('region_name', 'region'), ('city_name', 'city'), ('isp_domain', 'isp'))
+QQWRY_COLUMNS = IPIP_COLUMNS + (('district_name', 'district'),)
+
+def _ipdb_result(data, columns, fields):
+    if not data:
+        return {'error': '未找到信息'}
+    # 构建结果
+    result = {name: data[column] for column, name in columns if data.get(column)}
+    # 如果没有提取到任何信息，返回错误
+    if not result:
+        return {'error': '未找到信息'}
+    return _interned(_select_fields(result, fields))
+
+def _lookup_ipdb(key, ip, columns, fields):
+    """查询ipdb读取器（ipip.net和qqwry），按搜索树的叶子节点缓存结果，同一条记录只解码一次
+
+    返回 (结果, 前缀长度)，前缀长度为叶子节点的深度。
+    """
+    pool = readers
+    reader = pool[key]
+    node, prefix_len = reader.find(ip)
+    # 查询中文结果
+    return _memoized(pool, (key, node, fields),
+                     lambda: _ipdb_result(reader.find_map(ip, 'CN'), columns, fields)), prefix_len
+
+def _lookup_ipip(ip, fields=None):
+    """使用ipip.net查询IP信息，按记录所在的网段缓存"""
     try:
         if 'ipip_free' not in readers:
-            return {'error': 'ipip.net数据库未加载'}
-        
-        # 查询IP信息，使用中文
-        data = readers['ipip_free'].find_map(ip, 'CN')
-        if not data:
-            return {'error': '未找到信息'}
-        
-        # 构建结果
-        result = {}
-        if data.get('country_name'):
-            result['country'] = data['country_name']
-        if data.get('region_name'):
-            result['region'] = data['region_name']
-        if data.get('city_name'):
-            result['city'] = data['city_name']
-        if data.get('isp_domain'):
-            result['isp'] = data['isp_domain']
-        
-        # 如果没有提取到任何信息，返回错误
-        if not result:
-            return {'error': '未找到信息'}
-        
-        return result
+            return {'error': 'ipip.net数据库未加载'}, None
+        return _lookup_ipdb('ipip_free', ip, IPIP_COLUMNS, fields)
     except Exception as e:
-        return {'error': f'查询错误: {str(e)}'}
+        return {'error': f'查询错误: {str(e)}'}, None
 
-def query_qqwry(ip):
-    """使用qqwry数据库查询IP信息"""
+def _lookup_qqwry(ip, fields=None):
+    """使用qqwry数据库查询IP信息，按记录所在的网段缓存"""
     try:
         if 'qqwry' not in readers:
-            return {'error': 'qqwry数据库未加载'}
-        
-        # 查询IP信息，使用中文
-        data = readers['qqwry'].find_map(ip, 'CN')
-        if not data:
-            return {'error': '未找到信息'}
-        
-        # 构建结果
-        result = {}
-        if data.get('country_name'):
-            result['country'] = data['country_name']
-        if data.get('region_name'):
-            result['region'] = data['region_name']
-        if data.get('city_name'):
-            result['city'] = data['city_name']
-        if data.get('isp_domain'):
-            result['isp'] = data['isp_domain']
-        if data.get('district_name'):
-            result['district'] = data['district_name']
-        
-        # 如果没有提取到任何信息，返回错误
-        if not result:
-            return {'error': '未找到信息'}
-        
-        return result
+            return {'error': 'qqwry数据库未加载'}, None
+        return _lookup_ipdb('qqwry', ip, QQWRY_COLUMNS, fields)
     except Exception as e:
-        return {'error': f'查询错误: {str(e)}'}
+        return {'error': f'查询错误: {str(e)}'}, None
+
+# 查询结果缓存，IP_CACHE_SIZE=0 时关闭
+result_cache = PrefixCache(maxsize=int(os.environ.get('IP_CACHE_SIZE', 100000)),
+                           ttl=int(os.environ.get('IP_CACHE_TTL', 3600)))
+
+# 多个worker进程共享的结果缓存（MB），0表示不使用；本进程的缓存未命中时再查找
+IP_SHARED_CACHE_MB = int(os.environ.get('IP_SHARED_CACHE_MB', 0))
+IP_SHARED_CACHE_PATH = os.environ.get('IP_SHARED_CACHE_PATH', '/dev/shm/ip-result-cache')
+
+def _open_shared_cache():
+    if IP_SHARED_CACHE_MB <= 0:
+        return None
+    try:
+        cache = SharedResultCache(IP_SHARED_CACHE_PATH, IP_SHARED_CACHE_MB << 20, ttl=result_cache.ttl)
+    except OSError as e:
+        print(f"Error opening shared result cache {IP_SHARED_CACHE_PATH}: {e}")
+        return None
+    print(f"✓ shared result cache {IP_SHARED_CACHE_PATH} mapped ({IP_SHARED_CACHE_MB}MB, {cache.slots} slots)")
+    return cache
+
+shared_cache = _open_shared_cache()
+
+def _shared_tag(pool, namespace):
+    """命名空间在共享缓存中的标记：由数据源、字段和这一代IP库文件的签名得出，各进程打开同一组文件时相同"""
+    tag = pool.shared_tags.get(namespace)
+    if tag is None:
+        name, fields = namespace
+        signatures = [pool.signatures.get(key) for key in PROVIDERS[name].reader_keys]
+        tag = pool.shared_tags[namespace] = make_tag(
+            repr((name, sorted(fields) if fields is not None else None, signatures)))
+    return tag
+
+def _cache_get(namespace, version, ip_int):
+    """依次查找本进程和多进程共享的结果缓存，返回 (结果或None, 写入缓存用的 (本进程缓存的epoch, 共享缓存的标记))
+
+    两者都在查询IP库之前按当前一代取得：查询期间换代时，旧一代的结果不会在清除缓存之后写入本进程的缓存，
+    也不会以新一代的标记写入共享缓存。
+    """
+    epoch = result_cache.epoch
+    result = result_cache.get(namespace, version, ip_int)
+    if result is not None or shared_cache is None:
+        return result, (epoch, None)
+    tag = _shared_tag(readers, namespace)
+    entry = shared_cache.get(tag, version, ip_int)
+    if entry is None:
+        return None, (epoch, tag)
+    prefix_len, result = entry
+    result = _interned(result)
+    result_cache.put(namespace, version, ip_int, prefix_len, result, epoch)
+    return result, (epoch, tag)
+
+def _cache_put(namespace, version, ip_int, prefix_len, result, stamp):
+    epoch, tag = stamp
+    result_cache.put(namespace, version, ip_int, prefix_len, result, epoch)
+    if tag is not None:
+        shared_cache.put(tag, version, ip_int, prefix_len, result)
+
+# 同时进行的相同查询（同一IP、数据源和字段）只由第一个请求查询IP库，其余请求等待并共享结果
+lookup_flights = SingleFlight()
+
+# 运行指标，GET /metrics 以Prometheus格式输出
+metrics_registry = Registry()
+REQUESTS = metrics_registry.counter(
+    'ip_http_requests_total', 'HTTP requests by endpoint, method and status', ['endpoint', 'method', 'status'])
+BATCH_SIZE = metrics_registry.histogram(
+    'ip_batch_size', 'Number of unique IPs per batch lookup request', ['endpoint'], SIZE_BUCKETS)
+# 按结果分类（ok、not_found、error），错误率和未找到的比例由各分类的 _count 得出，每次查询只记录一次
+LOOKUP_SECONDS = metrics_registry.histogram(
+    'ip_provider_lookup_seconds', 'Database lookup latency per IP by provider and outcome, excluding cache hits',
+    ['provider', 'outcome'])
+COALESCED = metrics_registry.counter(
+    'ip_lookups_coalesced_total', 'IP lookups served by waiting for an identical in-flight lookup')
+
+def _outcome(result):
+    error = result.get('error')
+    if error is None:
+        return 'ok'
+    return 'not_found' if error == '未找到信息' else 'error'
+
+def record_lookups(provider, seconds, results):
+    """记录一次或一批实际的IP库查询，一批查询按每个IP的平均耗时记入直方图"""
+    if not results:
+        return
+    if len(results) == 1:
+        LOOKUP_SECONDS.observe(seconds, (provider, _outcome(results[0])))
+        return
+    outcomes = {}
+    for result in results:
+        outcome = _outcome(result)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    for outcome, n in outcomes.items():
+        LOOKUP_SECONDS.observe(seconds / len(results), (provider, outcome), n)
+
+class Provider:
+    """IP库数据源：查询函数、能提供的字段以及依赖的读取器
+
+    lookup(ip, fields) 返回 (结果, 前缀长度)，前缀长度为None表示结果不可缓存。
+    """
+
+    def __init__(self, name, lookup, fields, reader_keys):
+        self.name = name
+        self.lookup = lookup
+        self.fields = frozenset(fields)
+        # 按注册时的顺序保存字段，用于CSV等需要固定列顺序的输出
+        self.field_names = tuple(fields)
+        self.reader_keys = tuple(reader_keys)
+
+    def _lookup(self, ip, fields):
+        """查询IP库并记录耗时和结果"""
+        started = time.perf_counter()
+        result, prefix_len = self.lookup(ip, fields)
+        record_lookups(self.name, time.perf_counter() - started, (result,))
+        return result, prefix_len
+
+    def supports(self, fields):
+        """fields为None或与本数据源的字段有交集时才需要查询"""
+        return fields is None or not self.fields.isdisjoint(fields)
+
+    def query(self, ip, fields=None):
+        """查询IP，优先使用网段缓存；返回的结果可能被缓存共享，调用方不应修改"""
+        if 'unified' in readers:
+            return _lookup_unified(ip, [self.name], fields)[self.name]
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return self._lookup(ip, fields)[0]
+        namespace = (self.name, fields)
+        ip_int = int(addr)
+        result, stamp = _cache_get(namespace, addr.version, ip_int)
+        if result is None:
+            result, prefix_len = self._lookup(ip, fields)
+            if prefix_len is not None:
+                _cache_put(namespace, addr.version, ip_int, prefix_len, result, stamp)
+        return result
+
+    def query_many(self, ips, fields=None):
+        """依次查询一组IP，ips按数值排序时，落在上一次查到的网段内的IP直接复用结果
+
+        实际查询IP库的耗时和结果整批记录一次指标。
+        """
+        if 'unified' in readers:
+            return [self.query(ip, fields) for ip in ips]
+        results = []
+        looked_up = []
+        elapsed = 0.0
+        # 上一次实际查询得到的 (IP版本, 主机位数, 网络号, 结果)
+        network = None
+        for ip in ips:
+            try:
+                addr = ipaddress.ip_address(ip)
+            except ValueError:
+                results.append(self.lookup(ip, fields)[0])
+                continue
+            ip_int = int(addr)
+            if network is not None and network[0] == addr.version and ip_int >> network[1] == network[2]:
+                results.append(network[3])
+                continue
+            namespace = (self.name, fields)
+            result, stamp = _cache_get(namespace, addr.version, ip_int)
+            if result is None:
+                started = time.perf_counter()
+                result, prefix_len = self.lookup(ip, fields)
+                elapsed += time.perf_counter() - started
+                looked_up.append(result)
+                if prefix_len is not None:
+                    _cache_put(namespace, addr.version, ip_int, prefix_len, result, stamp)
+                    host_bits = addr.max_prefixlen - prefix_len
+                    network = (addr.version, host_bits, ip_int >> host_bits, result)
+            results.append(result)
+        record_lookups(self.name, elapsed, looked_up)
+        return results
+
+def _unified_record(db, record, ip):
+    """合并库中结果为null（无法按区间编译）的数据源按对应的IPv4地址查询
+
+    只有ip2location的Teredo地址如此，官方库按最后32位取反得到的IPv4地址查询，这里取该IPv4地址在合并库中的结果。
+    """
+    if None not in record.values():
+        return record
+    version, ipnum = MemoryIP2Location.parse_address(ip)
+    alias = db.record(db.find(4, ipnum)[0]) if version == 4 else {}
+    return {name: alias.get(name, {'error': '未找到信息'}) if result is None else result
+            for name, result in record.items()}
+
+def _unified_find(pool, version, ip_int):
+    """在合并库中查询，返回 (记录, 区间起始地址, 区间结束地址)，记录按记录号缓存，同一条记录只解析一次JSON"""
+    db = pool['unified']
+    record_id, first, last = db.find(version, ip_int)
+    return _memoized(pool, ('unified', record_id), lambda: db.record(record_id)), first, last
+
+# 合并库中用MMDB读取器查询的数据源
+UNIFIED_MMDB_PROVIDERS = ('geolite2', 'dbip')
+
+def _unified_fallback(pool, ip, names, fields=None):
+    """ipaddress不接受的写法，按在线查询时各数据源的处理返回结果
+
+    geolite2和dbip与maxminddb一样接受 1.2.3、127.1 这类简写的IPv4地址，按解析出的地址在合并库中查询；
+    ip2location在inet_aton能解析时与官方库一样各字段返回 INVALID IP ADDRESS；
+    其余情况返回"无效的IP地址"（在线查询时各库的错误信息各不相同，这里不区分）。
+    """
+    try:
+        record = _unified_find(pool, *MemoryMMDB._parse(ip))[0]
+    except ValueError:
+        record = {}
+    results = {}
+    for name in names:
+        if name in UNIFIED_MMDB_PROVIDERS and name in record:
+            results[name] = _unified_result(record, [name], fields)[name]
+        elif name == 'ip2location' and name in pool['unified'].providers and _is_ipv6_input(ip) is not None:
+            results[name] = _select_fields(dict.fromkeys(IP2LOCATION_RESULT_FIELDS, INVALID_ADDRESS), fields)
+        else:
+            results[name] = {'error': '无效的IP地址'}
+    return results
+
+def _lookup_unified(ip, names, fields=None):
+    """在合并库中一次查出names中各数据源的结果"""
+    pool = readers
+    started = time.perf_counter()
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return _unified_fallback(pool, ip, names, fields)
+    record = _unified_find(pool, addr.version, int(addr))[0]
+    record = _unified_record(pool['unified'], record, ip)
+    record_lookups('unified', time.perf_counter() - started, (record,))
+    return _unified_result(record, names, fields)
+
+def _unified_result(record, names, fields=None):
+    return {name: _select_fields(record[name], fields) if name in record else {'error': f'{name}未编译进合并库'}
+            for name in names}
+
+def _lookup_unified_many(ips, names, fields=None):
+    """在合并库中依次查询一组有效的IP，按数值排序时同一区间内的IP复用上一次的结果"""
+    pool = readers
+    db = pool['unified']
+    results = []
+    records = []
+    last_range = None
+    started = time.perf_counter()
+    for ip in ips:
+        addr = ipaddress.ip_address(ip)
+        ip_int = int(addr)
+        if last_range is None or last_range[0] != addr.version or not last_range[1] <= ip_int <= last_range[2]:
+            record, first, last = _unified_find(pool, addr.version, ip_int)
+            records.append(record)
+            if None in record.values():
+                # 区间内各地址的结果不同，不复用
+                results.append(_unified_result(_unified_record(db, record, ip), names, fields))
+                last_range = None
+                continue
+            last_range = (addr.version, first, last, _unified_result(record, names, fields))
+        results.append(last_range[3])
+    record_lookups('unified', time.perf_counter() - started, records)
+    return results
+
+# 已注册的数据源，顺序即结果中的展示顺序
+PROVIDERS = {}
+
+def register_provider(name, lookup, fields, reader_keys):
+    PROVIDERS[name] = Provider(name, lookup, fields, reader_keys)
+    return PROVIDERS[name]
+
+register_provider('geolite2', _lookup_geolite2,
+                  ['country', 'region', 'city', 'latitude', 'longitude', 'asn', 'isp'],
+                  ['geolite2_city', 'geolite2_asn', 'geolite2_country'])
+register_provider('dbip', _lookup_dbip,
+                  ['country', 'region', 'city', 'latitude', 'longitude'],
+                  ['dbip_city'])
+register_provider('ip2location', _lookup_ip2location,
+                  ['country', 'region', 'city', 'isp', 'domain', 'zipcode'],
+                  ['ip2location_v4', 'ip2location_v6'])
+register_provider('ip2region', _lookup_ip2region,
+                  ['country', 'region', 'city', 'isp'],
+                  ['ip2region_v4', 'ip2region_v6'])
+register_provider('ipip', _lookup_ipip,
+                  ['country', 'region', 'city', 'isp'],
+                  ['ipip_free'])
+register_provider('qqwry', _lookup_qqwry,
+                  ['country', 'region', 'city', 'isp', 'district'],
+                  ['qqwry'])
+
+ALL_FIELDS = frozenset().union(*(p.fields for p in PROVIDERS.values()))
+
+def _activate_generation(gen, old):
+    """切换到新一代读取器，并清除文件发生变化的数据源的缓存
+
+    变化的库都比较过时（见 diff_generations）只清除记录变化的网段，否则清空该数据源的全部缓存。
+    """
+    global readers
+    readers = gen.readers
+    if IP_DB_WATCH_INTERVAL <= 0:
+        # 没有自动热加载时由缓存自己检查文件；自动热加载时由切换负责清除，避免文件一变化就清空全部缓存
+        for provider in PROVIDERS.values():
+            result_cache.watch_files(provider.name, [gen.paths[key] for key in provider.reader_keys if key in gen.paths])
+    if old is None:
+        return
+    changed = gen.changed_keys(old)
+    for provider in PROVIDERS.values():
+        keys = changed.intersection(provider.reader_keys)
+        if not keys:
+            continue
+        if keys.issubset(gen.diffs):
+            ranges = {}
+            for key in keys:
+                for version, items in gen.diffs[key].items():
+                    ranges.setdefault(version, []).extend(items)
+            ranges = {version: merge_ranges(items) for version, items in ranges.items()}
+            result_cache.invalidate_ranges(lambda namespace, name=provider.name: namespace[0] == name, ranges)
+        else:
+            result_cache.invalidate(lambda namespace, name=provider.name: namespace[0] == name)
+
+# IP库文件检查间隔（秒），0表示不自动检查
+IP_DB_WATCH_INTERVAL = int(os.environ.get('IP_DB_WATCH_INTERVAL', 60))
+
+reader_manager = GenerationManager(load_readers, on_swap=_activate_generation)
+reader_manager.load(READER_PATHS)
+
+def reopen_file_readers():
+    """fork之后在子进程中重新打开按文件偏移读取的读取器
+
+    ip2region的file/vectorIndex模式和ip2location官方库通过seek+read读文件，
+    fork出的进程共用同一个文件偏移，并发查询会互相干扰；mmap和全部读入内存的读取器可以直接继承。
+    """
+    reader_manager.current.readers.reopen()
+
+def open_readers(providers=None, fields=None):
+    """同时打开所选数据源用到的、还没有打开的读取器；在fork子进程之前调用，子进程直接继承打开的IP库"""
+    keys = None if IP_DB_ENGINE == 'unified' else [
+        key for provider in select_providers(providers, fields) for key in provider.reader_keys]
+    reader_manager.current.readers.open_all(keys)
+
+def compile_unified_db(output=UNIFIED_DB_PATH):
+    """遍历当前一代的全部IP库，把已加载的数据源编译成合并库"""
+    gen = reader_manager.acquire()
+    try:
+        providers = []
+        for provider in PROVIDERS.values():
+            keys = [key for key in provider.reader_keys if key in gen.readers]
+            if not keys:
+                print(f"Skipping {provider.name}: no database loaded")
+                continue
+            providers.append((
+                provider.name,
+                lambda ip, provider=provider: provider.lookup(ip)[0],
+                lambda version, keys=keys: [_range_index(gen, key).ranges(version) for key in keys],
+                lambda version, keys=keys: [span for key in keys if hasattr(_range_index(gen, key), 'unresolved')
+                                            for span in _range_index(gen, key).unresolved(version)],
+            ))
+        compile_unified(output, providers, sources={key: gen.paths[key] for key in gen.readers})
+    finally:
+        reader_manager.release(gen)
+
+def start_background_threads():
+    """启动在后台打开IP库、检查IP库文件和跟踪访问日志的线程，每个进程只启动一次
+
+    在处理请求的进程中调用，gunicorn预加载时fork出的worker也会各自启动。
+    """
+    if IP_DB_OPEN == 'background':
+        reader_manager.current.readers.open_in_background()
+        pin_range_indexes(reader_manager.current)
+    if IP_DB_WATCH_INTERVAL > 0:
+        reader_manager.start_watcher(READER_PATHS, IP_DB_WATCH_INTERVAL)
+    if access_log_stats is not None:
+        start_tail(IP_ACCESS_LOG, access_log_stats)
+
+@app.before_request
+def _acquire_readers():
+    """请求开始时登记所用的一代读取器，旧一代在这些请求结束后才关闭"""
+    start_background_threads()
+    g.generation = reader_manager.acquire()
+
+@app.after_request
+def _generation_header(response):
+    generation = g.get('generation')
+    if generation is not None:
+        response.headers['X-IP-DB-Generation'] = str(generation.number)
+    return response
+
+@app.after_request
+def _count_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+    return response
+
+@app.teardown_request
+def _release_readers(exc):
+    generation = g.pop('generation', None)
+    if generation is not None:
+        reader_manager.release(generation)
+
+def query_geolite2(ip, fields=None):
+    """使用GeoLite2查询IP信息，结果经过网段缓存"""
+    return PROVIDERS['geolite2'].query(ip, fields)
+
+def query_dbip(ip, fields=None):
+    """使用db-ip查询IP信息，结果经过网段缓存"""
+    return PROVIDERS['dbip'].query(ip, fields)
+
+def query_ip2location(ip, fields=None):
+    """使用ip2location查询IP信息，结果经过网段缓存"""
+    return PROVIDERS['ip2location'].query(ip, fields)
+
+def query_ip2region(ip, fields=None):
+    """使用ip2region查询IP信息，结果经过网段缓存"""
+    return PROVIDERS['ip2region'].query(ip, fields)
+
+def query_ipip(ip, fields=None):
+    """使用ipip.net查询IP信息，结果经过网段缓存"""
+    return PROVIDERS['ipip'].query(ip, fields)
+
+def query_qqwry(ip, fields=None):
+    """使用qqwry查询IP信息，结果经过网段缓存"""
+    return PROVIDERS['qqwry'].query(ip, fields)
+
+def select_providers(providers=None, fields=None):
+    """根据请求的数据源和字段选出需要查询的数据源，无法提供所需字段的数据源会被跳过"""
+    names = list(PROVIDERS) if providers is None else providers
+    return [PROVIDERS[name] for name in names if PROVIDERS[name].supports(fields)]
+
+def result_columns(providers=None, fields=None):
+    """按列输出批量结果时的列：[(数据源, (字段, ...)), ...]"""
+    return [(p.name, tuple(f for f in p.field_names if fields is None or f in fields))
+            for p in select_providers(providers, fields)]
+
+def parse_selection(providers=None, fields=None):
+    """解析逗号分隔（或字符串列表形式）的providers/fields参数，类型不对或未知名称抛出ValueError"""
+    def split(value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            items = value.split(',')
+        elif isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value):
+            items = value
+        else:
+            # JSON请求体中可能是数字、布尔值或对象
+            raise ValueError('providers/fields必须是字符串或数组')
+        return [item.strip() for item in items if item.strip()] or None
+
+    providers = split(providers)
+    fields = split(fields)
+    if providers is not None:
+        unknown = [name for name in providers if name not in PROVIDERS]
+        if unknown:
+            raise ValueError(f'未知的IP库: {", ".join(unknown)}')
+        providers = list(dict.fromkeys(providers))
+    if fields is not None:
+        unknown = [name for name in fields if name not in ALL_FIELDS]
+        if unknown:
+            raise ValueError(f'未知的字段: {", ".join(unknown)}')
+        fields = frozenset(fields)
+    return providers, fields
+
+# 一批最多这么多个IP时才让其他请求等待这一批的结果；整批结果一起就绪，大的批次查询时间长，
+# 其他请求等它不如自己查询，大的批次只等待其他请求正在查询的IP
+FLIGHT_MAX_LEAD = 4
+
+def _flight_key(ip, selected, fields):
+    # 换代后的查询不会等待旧一代读取器上的查询
+    return ip, tuple(p.name for p in selected), fields, id(readers)
+
+def lookup_ip(ip, providers=None, fields=None):
+    """查询单个IP，默认使用全部IP库并返回全部字段
+
+    并发的相同查询只执行一次，结果可能与其他请求共享，调用方不应修改。
+    """
+    selected = select_providers(providers, fields)
+
+    def query():
+        if 'unified' in readers:
+            return _lookup_unified(ip, [p.name for p in selected], fields)
+        return {p.name: p.query(ip, fields) for p in selected}
+
+    result, shared = lookup_flights.do(_flight_key(ip, selected, fields), query)
+    if shared:
+        COALESCED.inc()
+    return result
+
+# 一批中至少有这么多IP时ip2region才用NumPy批量查询，段索引在第一次批量查询时才载入
+BULK_MIN_BATCH = 64
+
+def _query_many(name, ips, fields=None):
+    """用一个数据源依次查询一组IP，返回与ips对应的结果列表
+
+    ip2region在未使用合并库且IP较多时用NumPy批量查询，每个不同的区域字符串只解析一次。
+    """
+    if name == 'ip2region' and 'unified' not in readers and len(ips) >= BULK_MIN_BATCH:
+        try:
+            results = [None] * len(ips)
+            for version in (4, 6):
+                positions = [i for i, ip in enumerate(ips) if (':' in ip) == (version == 6)]
+                if not positions:
+                    continue
+                started = time.perf_counter()
+                bulk = _ip2region_bulk(version)
+                indices = bulk.lookup(pack_addresses([ips[i] for i in positions], version))
+                parsed = {}
+                for i, index in zip(positions, indices.tolist()):
+                    if index not in parsed:
+                        parsed[index] = _parse_ip2region(bulk.regions[index], fields)
+                    results[i] = parsed[index]
+                record_lookups('ip2region', time.perf_counter() - started, [results[i] for i in positions])
+            return results
+        except (ImportError, ValueError):
+            # 没有安装numpy或数据库未加载时逐个查询
+            pass
+    return PROVIDERS[name].query_many(ips, fields)
+
+def lookup_batch(ips, providers=None, fields=None):
+    """批量查询一组IP，返回与ips顺序对应的结果，每项与 lookup_ip() 相同
+
+    IP先去重（同一地址的不同写法也合并）并按数值排序，再按数据源逐个查询整组IP：相邻的IP在同一个IP库中
+    经过相同的树节点和页面，网段缓存也连续命中，比逐个IP轮流查询各IP库快。无效的IP按 lookup_ip() 单独处理。
+    其他请求正在查询的IP不再查询，等待并共享其结果。
+    """
+    selected = select_providers(providers, fields)
+    addresses = {}
+    for ip in ips:
+        if ip not in addresses:
+            try:
+                addresses[ip] = ipaddress.ip_address(ip)
+            except ValueError:
+                addresses[ip] = None
+    ordered = sorted({addr for addr in addresses.values() if addr is not None}, key=lambda a: (a.version, int(a)))
+    ordered = [str(addr) for addr in ordered]
+
+    def query(keys):
+        batch = [key[0] for key in keys]
+        if 'unified' in readers:
+            return _lookup_unified_many(batch, [p.name for p in selected], fields)
+        rows = [{} for _ in batch]
+        for provider in selected:
+            for row, result in zip(rows, _query_many(provider.name, batch, fields)):
+                row[provider.name] = result
+        return rows
+
+    keys = [_flight_key(ip, selected, fields) for ip in ordered]
+    rows, shared = lookup_flights.do_many(keys, query, lead=len(keys) <= FLIGHT_MAX_LEAD)
+    if shared:
+        COALESCED.inc((), shared)
+    by_ip = dict(zip(ordered, rows))
+    # 重复的无效输入也只查询一次
+    by_ip.update((ip, lookup_ip(ip, providers, fields)) for ip, addr in addresses.items() if addr is None)
+    return [by_ip[ip if addresses[ip] is None else str(addresses[ip])] for ip in ips]
+
+# 批量查询接口去重时记住的IP数，超过后忘掉最久没有出现的IP，它再次出现时会重复输出一行
+IP_API_DEDUP_SIZE = int(os.environ.get('IP_API_DEDUP_SIZE', 100000))
+
+def iter_unique_ips(lines, seen=None, max_seen=None):
+    """逐行解析IP并去重，返回 (原始输入, 规范化IP或None) 的迭代器
+
+    输入本身按流处理，只记住最近出现过的至多max_seen（默认 IP_API_DEDUP_SIZE）个规范化IP，
+    内存不随请求中不同IP的数量增长；相同IP之间隔着更多不同IP时不再去重。
+    分多次处理同一输入时传入同一个seen（OrderedDict）。
+    """
+    seen = OrderedDict() if seen is None else seen
+    max_seen = IP_API_DEDUP_SIZE if max_seen is None else max_seen
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        raw = str(line).strip()
+        if not raw:
+            continue
+        try:
+            ip = str(ipaddress.ip_address(raw))
+        except ValueError:
+            yield raw, None
+            continue
+        if ip in seen:
+            seen.move_to_end(ip)
+            continue
+        seen[ip] = None
+        if len(seen) > max_seen:
+            seen.popitem(last=False)
+        yield raw, ip
+
+# 访问日志统计的维度：维度 -> (数据源, 字段)
+LOG_DIMENSIONS = {
+    'country': ('ip2region', 'country'),
+    'region': ('ip2region', 'region'),
+    'isp': ('ip2region', 'isp'),
+    'asn': ('geolite2', 'asn'),
+}
+
+def resolve_log_ips(ips, dimensions=LOG_DIMENSIONS):
+    """访问日志统计的查询函数：每个数据源只查询一次统计维度需要的字段，返回 {维度: 取值} 列表"""
+    gen = reader_manager.acquire()
+    try:
+        results = [{} for _ in ips]
+        wanted = {}
+        for dim, (name, field) in dimensions.items():
+            wanted.setdefault(name, []).append((dim, field))
+        for name, pairs in wanted.items():
+            fields = frozenset(field for _, field in pairs)
+            for result, value in zip(results, _query_many(name, ips, fields)):
+                for dim, field in pairs:
+                    if field in value:
+                        result[dim] = value[field]
+        return results
+    finally:
+        reader_manager.release(gen)
+
+# 要跟踪的nginx访问日志，不设置时不统计
+IP_ACCESS_LOG = os.environ.get('IP_ACCESS_LOG')
+access_log_stats = LogAggregator(
+    resolve_log_ips, LOG_DIMENSIONS,
+    window=int(os.environ.get('IP_ACCESS_LOG_WINDOW', 60)),
+    windows=int(os.environ.get('IP_ACCESS_LOG_WINDOWS', 60)),
+) if IP_ACCESS_LOG else None
+
+def parse_json_input(data, providers=None, fields=None):
+    """解析JSON请求体：IP数组、{"ips": [...], "providers": ..., "fields": ...} 或换行分隔的字符串
+
+    请求体中的providers/fields优先于查询参数，返回 (IP列表, providers, fields)；ips不是数组或字符串时抛出ValueError。
+    """
+    if isinstance(data, dict):
+        providers = data.get('providers', providers)
+        fields = data.get('fields', fields)
+        data = data.get('ips')
+    if isinstance(data, str):
+        data = data.split('\n')
+    if not isinstance(data, list):
+        raise ValueError('ips必须是数组或字符串')
+    return data, providers, fields
+
+# 批量查询接口每次一起查询的IP数
+API_BATCH_SIZE = 256
+
+def lookup_items(items, providers=None, fields=None):
+    """查询 iter_unique_ips() 返回的一组 (原始输入, 规范化IP或None)，返回批量查询结果中的各项"""
+    results = iter(lookup_batch([ip for _, ip in items if ip is not None], providers, fields))
+    out = []
+    for raw, ip in items:
+        if ip is None:
+            out.append({'ip': raw, 'error': '无效的IP地址'})
+        else:
+            item = {'ip': ip}
+            item.update(next(results))
+            out.append(item)
+    return out
+
+def _api_request_input():
+    """从请求中取出IP输入和数据源/字段选择
+
+    IP支持JSON数组、{"ips": [...]}、换行分隔文本或查询参数ip；
+    providers/fields可以放在查询参数中，JSON对象请求也可以放在请求体中。
+    返回 (IP行迭代器, providers, fields)，缺少ip参数或JSON请求体无效时抛出ValueError。
+    """
+    providers = request.args.get('providers')
+    fields = request.args.get('fields')
+    if request.method == 'GET':
+        if 'ip' not in request.args:
+            raise ValueError('缺少ip参数')
+        return request.args.getlist('ip'), providers, fields
+    if request.is_json:
+        try:
+            data = request.get_json()
+        except BadRequest:
+            raise ValueError('请求体不是有效的JSON')
+        return parse_json_input(data, providers, fields)
+    if request.mimetype == 'application/x-www-form-urlencoded':
+        return request.form.get('ips', '').split('\n'), providers, fields
+    # 纯文本按行读取请求体，不把整个请求体读入内存
+    return request.stream, providers, fields
+
+def _json_error(message, status=400):
+    return Response(json.dumps({'error': message}, ensure_ascii=False) + '\n',
+                    status=status, mimetype='application/json')
+
+@app.route('/ip/api/lookup', methods=['GET', 'POST'])
+def api_lookup():
+    """批量查询接口，逐个IP流式返回结果
+
+    可通过providers=ip2region,geolite2和fields=country,asn只查询需要的数据源和字段。
+    默认为NDJSON格式，Accept头可以选择MessagePack或Arrow IPC流（见 api_formats）。
+    """
+    mimetype = api_formats.negotiate(request.accept_mimetypes)
+    missing = api_formats.missing_dependency(mimetype)
+    if missing:
+        return _json_error(f'{mimetype}格式需要安装{missing}', 406)
+    try:
+        lines, providers, fields = _api_request_input()
+        providers, fields = parse_selection(providers, fields)
+    except ValueError as e:
+        return _json_error(str(e))
+    encoder = api_formats.ENCODERS[mimetype](result_columns(providers, fields))
+
+    def generate():
+        items = iter_unique_ips(lines)
+        total = 0
+        while True:
+            batch = list(islice(items, API_BATCH_SIZE))
+            if not batch:
+                break
+            total += len(batch)
+            data = encoder.write(lookup_items(batch, providers, fields))
+            if data:
+                yield data
+        data = encoder.close()
+        if data:
+            yield data
+        BATCH_SIZE.observe(total, ('/ip/api/lookup',))
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+# 网段查询每个数据源最多返回的区间数，请求的limit参数不能超过这个值
+IP_RANGE_MAX_BLOCKS = int(os.environ.get('IP_RANGE_MAX_BLOCKS', 10000))
+
+def _unified_blocks(name, version, first, last):
+    db = readers['unified']
+    while first <= last:
+        record_id, _, block_last = db.find(version, first)
+        yield first, min(block_last, last), db.record(record_id).get(name, {}) is None
+        first = block_last + 1
+
+def _range_blocks(provider, version, first, last):
+    """数据源的IP库在 [first, last] 内的区间，返回 (起始地址, 结束地址, 是否无法按结果划分)
+
+    同一区间内的地址查询结果相同；无法划分的区间（ip2location跨越多个/96的Teredo地址）内各地址的结果不同。
+    """
+    if 'unified' in readers:
+        yield from _unified_blocks(provider.name, version, first, last)
+        return
+    gen = reader_manager.current
+    indexes = []
+    for key in provider.reader_keys:
+        if key not in gen.readers:
+            continue
+        try:
+            indexes.append(_range_index(gen, key))
+        except Exception as e:
+            # 打不开的库查询时同样报错，不再细分
+            print(f"Error opening range index {key}: {e}")
+    unresolved = [span for index in indexes if hasattr(index, 'unresolved')
+                  for span in index.unresolved(version, first, last)]
+    streams = [index.ranges(version, first, last) for index in indexes] + [unresolved]
+    for block_first, block_last in partition(streams, version, first, last):
+        yield block_first, block_last, any(low <= block_first and block_last <= high for low, high in unresolved)
+
+def lookup_range(network, name, fields=None, start=None):
+    """把网段按数据源的IP库划分为查询结果相同的连续区间，从start（默认网段起始地址）开始
+
+    返回 (起始地址, 结束地址, 结果) 的迭代器，地址为整数，相邻且结果相同的区间合并为一个。
+    区间取自IP库的搜索树和区间索引，每个区间只查询起始地址，耗时与区间数有关，与网段大小无关。
+    区间内各地址结果不同、无法划分时（见 _range_blocks）结果为None。
+    """
+    provider = PROVIDERS[name]
+    if 'unified' in readers:
+        query = lambda ip: _lookup_unified(ip, [name], fields)[name]
+    else:
+        # 每个区间只查询一次，不放入网段缓存，遍历大网段时不会挤掉缓存中的热点
+        query = lambda ip: provider._lookup(ip, fields)[0]
+    address = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+    first = int(network.network_address) if start is None else int(start)
+    current = None
+    for block_first, block_last, mixed in _range_blocks(provider, network.version, first,
+                                                        int(network.broadcast_address)):
+        result = None if mixed else query(str(address(block_first)))
+        if current is not None and current[2] == result:
+            current[1] = block_last
+            continue
+        if current is not None:
+            yield tuple(current)
+        current = [block_first, block_last, result]
+    if current is not None:
+        yield tuple(current)
+
+def _range_request_input():
+    """解析网段查询的参数，返回 (网段, 起始地址或None, providers, fields, limit)，无效时抛出ValueError"""
+    try:
+        # 主机位不为0时按所在网段处理，单个IP即/32或/128
+        network = ipaddress.ip_network(request.args.get('cidr', '').strip(), strict=False)
+    except ValueError:
+        raise ValueError('无效的网段')
+    start = request.args.get('start')
+    if start is not None:
+        try:
+            start = ipaddress.ip_address(start.strip())
+        except ValueError:
+            raise ValueError('无效的起始地址')
+        if start not in network:
+            raise ValueError('起始地址不在网段内')
+    try:
+        limit = int(request.args.get('limit', IP_RANGE_MAX_BLOCKS))
+    except ValueError:
+        raise ValueError('无效的limit')
+    providers, fields = parse_selection(request.args.get('providers'), request.args.get('fields'))
+    return network, start, providers, fields, max(1, min(limit, IP_RANGE_MAX_BLOCKS))
+
+@app.route('/ip/api/range')
+def api_range():
+    """网段查询接口，以NDJSON格式逐个区间返回各数据源在网段内的划分
+
+    每行为 {"provider", "first", "last", "networks", "result"}；某个数据源的区间数超过limit时，
+    它的最后一行为 {"provider", "truncated": true, "next"}，带上start=next再次请求可以继续。
+    区间内各地址的结果不同、无法划分时result为null，并带有 "mixed": true。
+    """
+    try:
+        network, start, providers, fields, limit = _range_request_input()
+    except ValueError as e:
+        return _json_error(str(e))
+    address = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+
+    def generate():
+        lines = []
+        for provider in select_providers(providers, fields):
+            for count, (first, last, result) in enumerate(lookup_range(network, provider.name, fields, start)):
+                if count == limit:
+                    lines.append({'provider': provider.name, 'truncated': True, 'next': str(address(first))})
+                    break
+                line = {
+                    'provider': provider.name,
+                    'first': str(address(first)),
+                    'last': str(address(last)),
+                    'networks': [str(n) for n in ipaddress.summarize_address_range(address(first), address(last))],
+                    'result': result,
+                }
+                if result is None:
+                    line['mixed'] = True
+                lines.append(line)
+                if len(lines) >= API_BATCH_SIZE:
+                    yield ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+                    lines = []
+        if lines:
+            yield ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# 反向索引：数据源 -> 建立索引的字段
+REVERSE_DIMENSIONS = {
+    'geolite2': ('country', 'region', 'asn'),
+    'ip2region': ('country', 'region'),
+}
+REVERSE_INDEX_PATH = os.environ.get('IP_REVERSE_INDEX_PATH', './db/reverse/reverse_index.json')
+
+def _reverse_index_sources(gen):
+    """反向索引依赖的IP库文件签名，任何一个变化都需要重新生成"""
+    keys = {'unified'}.union(*(PROVIDERS[name].reader_keys for name in REVERSE_DIMENSIONS))
+    return {key: list(gen.signatures[key]) if gen.signatures[key] else None
+            for key in sorted(keys) if key in gen.signatures}
+
+def _reverse_blocks(name, fields):
+    for network in search_networks():
+        for first, last, result in lookup_range(network, name, fields):
+            if result is not None:
+                yield network.version, first, last, result
+
+def build_reverse_index(output=REVERSE_INDEX_PATH):
+    """遍历当前一代的IP库生成反向索引并保存到output"""
+    gen = reader_manager.acquire()
+    try:
+        index = ReverseIndex(build_reverse(REVERSE_DIMENSIONS, _reverse_blocks), _reverse_index_sources(gen),
+                             time.strftime('%Y-%m-%dT%H:%M:%S%z'))
+    finally:
+        reader_manager.release(gen)
+    index.save(output)
+    return index
+
+def reverse_index():
+    """当前一代的反向索引，第一次使用时在后台载入（源文件没有变化时）或重新生成，完成前返回None"""
+    gen = reader_manager.current
+
+    def load():
+        index = ReverseIndex.load(REVERSE_INDEX_PATH, _reverse_index_sources(gen))
+        if index is None:
+            started = time.perf_counter()
+            index = build_reverse_index()
+            print(f"✓ reverse index built in {time.perf_counter() - started:.1f}s (generation {gen.number})")
+        return index
+
+    return gen.derived('reverse_index', lambda: BackgroundIndex(load)).get()
+
+@app.route('/ip/api/prefixes')
+def api_prefixes():
+    """反向查询接口：返回国家、地区或ASN在数据源中的全部网段
+
+    例如 ?asn=13335、?country=中国&provider=ip2region；list=country 返回该字段的全部取值及网段数。
+    """
+    listing = request.args.get('list')
+    field = listing or next((f for f in ('asn', 'country', 'region') if f in request.args), None)
+    if field is None:
+        return _json_error('需要指定asn、country、region或list参数')
+    provider = request.args.get('provider') or next(
+        (name for name, fields in REVERSE_DIMENSIONS.items() if field in fields), None)
+    if field not in REVERSE_DIMENSIONS.get(provider, ()):
+        return _json_error(f'{provider or ""}没有{field}的反向索引')
+    try:
+        index = reverse_index()
+    except RuntimeError as e:
+        return _json_error(f'反向索引生成失败: {e}', 500)
+    if index is None:
+        response = _json_error('反向索引正在生成，请稍后重试', 503)
+        response.headers['Retry-After'] = '5'
+        return response
+    if listing:
+        body = index.encoded(('list', provider, field), lambda: json.dumps(
+            index.values(provider, field), ensure_ascii=False) + '\n')
+        return Response(body, mimetype='application/json')
+
+    value = request.args.get(field, '').strip()
+    networks = index.networks(provider, field, value)
+    if networks is None:
+        return _json_error(f'未找到{field}为{value}的网段', 404)
+    version = request.args.get('version')
+    version = version if version in ('4', '6') else None
+    text = request.args.get('format') == 'text'
+
+    def encode():
+        selected = networks if version is None else [n for n in networks if (':' in n) == (version == '6')]
+        if text:
+            return ''.join(n + '\n' for n in selected)
+        return json.dumps({'provider': provider, field: value, 'networks': selected}, ensure_ascii=False) + '\n'
+
+    body = index.encoded((provider, field, value, version, text), encode)
+    return Response(body, mimetype='text/plain' if text else 'application/json')
+
+@app.route('/ip/api/cache', methods=['GET', 'DELETE'])
+def api_cache():
+    """查看结果缓存的命中统计和合并的并发查询数；DELETE请求清空缓存（包括多进程共享的缓存）"""
+    if request.method == 'DELETE':
+        result_cache.invalidate()
+        if shared_cache is not None:
+            shared_cache.clear()
+    stats = result_cache.stats()
+    stats['single_flight'] = lookup_flights.stats()
+    if shared_cache is not None:
+        stats['shared'] = shared_cache.stats()
+    return Response(json.dumps(stats) + '\n', mimetype='application/json')
+
+@metrics_registry.collector
+def _reader_metrics():
+    """当前一代读取器和结果缓存的状态，在采集时读取"""
+    current = reader_manager.current
+    status = reader_manager.status()
+    cache = result_cache.stats()
+    shared = shared_cache.stats() if shared_cache is not None else {'hits': 0, 'misses': 0, 'writes': 0}
+    return [
+        ('ip_reader_generation', 'gauge', 'Number of the reader generation in use', [({}, current.number)]),
+        ('ip_reader_load_seconds', 'gauge', 'Time taken to open and warm the current generation',
+         [({}, current.load_seconds or 0)]),
+        ('ip_reader_loaded_timestamp_seconds', 'gauge', 'Unix time the current generation was loaded',
+         [({}, current.loaded_at or 0)]),
+        ('ip_reader_load_errors', 'gauge', 'Databases that failed to open in the current generation',
+         [({}, len(current.errors))]),
+        ('ip_reader_retired_generations', 'gauge', 'Replaced generations waiting for in-flight requests',
+         [({}, len(status['retired']))]),
+        ('ip_cache_entries', 'gauge', 'Entries in the result cache', [({}, cache['size'])]),
+        ('ip_cache_hits_total', 'counter', 'Result cache hits', [({}, cache['hits'])]),
+        ('ip_cache_misses_total', 'counter', 'Result cache misses', [({}, cache['misses'])]),
+        ('ip_cache_evictions_total', 'counter', 'Result cache evictions', [({}, cache['evictions'])]),
+        ('ip_shared_cache_hits_total', 'counter', 'Shared result cache hits in this process',
+         [({}, shared['hits'])]),
+        ('ip_shared_cache_misses_total', 'counter', 'Shared result cache misses in this process',
+         [({}, shared['misses'])]),
+        ('ip_shared_cache_writes_total', 'counter', 'Entries this process wrote to the shared result cache',
+         [({}, shared['writes'])]),
+    ]
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式的运行指标"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _admin_allowed():
+    """设置了IP_ADMIN_TOKEN时校验X-Admin-Token请求头，否则只允许本机访问"""
+    token = os.environ.get('IP_ADMIN_TOKEN')
+    if token:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/ip/admin/reload', methods=['POST'])
+def admin_reload():
+    """重新加载IP库：默认在后台加载并返回202，wait=1时等加载完成后返回新一代的信息"""
+    if not _admin_allowed():
+        return _json_error('没有权限', 403)
+    if request.args.get('wait') in ('1', 'true'):
+        try:
+            reader_manager.load(READER_PATHS)
+        except Exception as e:
+            return _json_error(f'重新加载失败: {e}', 500)
+        return Response(json.dumps(reader_manager.status(), ensure_ascii=False) + '\n', mimetype='application/json')
+    status = 202 if reader_manager.reload_async(READER_PATHS) else 409
+    return Response(json.dumps(reader_manager.status(), ensure_ascii=False) + '\n',
+                    status=status, mimetype='application/json')
+
+@app.route('/ip/admin/status')
+def admin_status():
+    """当前一代读取器的编号、加载耗时、文件路径，以及等待关闭的旧代"""
+    if not _admin_allowed():
+        return _json_error('没有权限', 403)
+    return Response(json.dumps(reader_manager.status(), ensure_ascii=False) + '\n', mimetype='application/json')
 
+@app.route('/ip/admin/logstats')
+def admin_logstats():
+    """访问日志最近各时间窗口按国家、地区、ISP、ASN的请求数，top指定每个维度返回的个数"""
+    if not _admin_allowed():
+        return _json_error('没有权限', 403)
+    if access_log_stats is None:
+        return _json_error('未配置访问日志（IP_ACCESS_LOG）', 404)
+    top = request.args.get('top', 20, type=int)
+    return Response(json.dumps(access_log_stats.snapshot(top), ensure_ascii=False) + '\n',
+                    mimetype='application/json')
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'enrich':
+        # python app.py enrich ips.txt --format csv，批量查询后退出
+        from enrich import main as enrich_main
+        sys.exit(enrich_main(sys.argv[2:], sys.modules[__name__]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'logs':
+        # python app.py logs access.log，统计访问日志
+        from access_log import main as logs_main
+        sys.exit(logs_main(sys.argv[2:], sys.modules[__name__]))
+    if hasattr(signal, 'SIGHUP'):
+        # kill -HUP <pid> 触发后台重新加载
+        signal.signal(signal.SIGHUP, lambda signum, frame: reader_manager.reload_async(READER_PATHS))
     app.run(debug=True, host='0.0.0.0', port=5002)
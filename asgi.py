@@ -0,0 +1,309 @@
+"""ASGI入口
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5002 --workers 4
+
+批量查询接口 /ip/api/lookup 直接在事件循环中处理：边读请求体边按块把IP交给有上限的线程池查询，
+结果按输入顺序流式返回，响应格式与Flask版相同由Accept头选择。等待查询和网络IO时不占用线程，一个进程可以同时保持大量连接。
+其他页面和接口仍由Flask处理，整个请求放到同一个线程池中执行，响应体逐块转发。
+
+线程池的任务数有上限：已满时新请求直接返回503并带上Retry-After；已经开始的请求等待空闲后继续，
+同时暂停读取请求体，由TCP流量控制让客户端放慢发送。查询是纯Python计算，线程池只解决连接占用的问题，
+要利用多核仍需用 --workers 启动多个进程。
+"""
+import asyncio
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import app as ip_app
+import api_formats
+
+# 查询线程数
+ASGI_THREADS = int(os.environ.get('IP_ASGI_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+# 线程池中排队等待的任务上限，与线程数之和达到上限后新请求返回503；
+# 排队的任务只占少量内存，上限决定的是满载时最长的排队时间
+ASGI_MAX_PENDING = int(os.environ.get('IP_ASGI_MAX_PENDING', 1024))
+# 每个任务查询的IP数
+CHUNK_SIZE = ip_app.API_BATCH_SIZE
+# 在事件循环中直接处理的批量查询接口
+LOOKUP_PATH = '/ip/api/lookup'
+# 单个请求同时提交的任务数，避免一个大请求占满线程池
+REQUEST_MAX_INFLIGHT = 4
+# 转发Flask响应时缓冲的块数
+FLASK_MAX_BUFFERED = 8
+
+executor = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix='ip-lookup')
+_slots = asyncio.Semaphore(ASGI_THREADS + ASGI_MAX_PENDING)
+
+
+async def _submit(func, *args):
+    """在线程池中执行func，任务数达到上限时等待"""
+    async with _slots:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def _send_json(send, status, data, headers=()):
+    body = (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _body_lines(receive):
+    """按收到的顺序逐批返回请求体中的行，不把整个请求体读入内存"""
+    buffer = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        buffer += message.get('body', b'')
+        *lines, buffer = buffer.split(b'\n')
+        if lines:
+            yield lines
+        if not message.get('more_body'):
+            break
+    if buffer:
+        yield [buffer]
+
+
+async def _request_input(scope, receive):
+    """与Flask版的 _api_request_input 相同的输入格式，返回 (行的批次迭代器, providers, fields)，输入无效时抛出ValueError"""
+    query = parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+    providers = query.get('providers', [None])[0]
+    fields = query.get('fields', [None])[0]
+
+    async def single(lines):
+        yield lines
+
+    if scope['method'] == 'GET':
+        if 'ip' not in query:
+            raise ValueError('缺少ip参数')
+        return single(query['ip']), providers, fields
+    mimetype = _header(scope, b'content-type').split(';')[0].strip().lower()
+    if mimetype == 'application/json' or mimetype.endswith('+json'):
+        try:
+            data = json.loads(await _read_body(receive))
+        except ValueError:
+            raise ValueError('请求体不是有效的JSON')
+        lines, providers, fields = ip_app.parse_json_input(data, providers, fields)
+        return single(lines), providers, fields
+    if mimetype == 'application/x-www-form-urlencoded':
+        form = parse_qs((await _read_body(receive)).decode('utf-8', 'replace'))
+        return single(form.get('ips', [''])[0].split('\n')), providers, fields
+    return _body_lines(receive), providers, fields
+
+
+async def _api_lookup(scope, receive, send):
+    mimetype = api_formats.negotiate(parse_accept_header(_header(scope, b'accept'), MIMEAccept))
+    missing = api_formats.missing_dependency(mimetype)
+    if missing:
+        ip_app.REQUESTS.inc((LOOKUP_PATH, scope['method'], '406'))
+        await _send_json(send, 406, {'error': f'{mimetype}格式需要安装{missing}'})
+        return
+    try:
+        batches, providers, fields = await _request_input(scope, receive)
+        providers, fields = ip_app.parse_selection(providers, fields)
+    except ValueError as e:
+        ip_app.REQUESTS.inc((LOOKUP_PATH, scope['method'], '400'))
+        await _send_json(send, 400, {'error': str(e)})
+        return
+    ip_app.REQUESTS.inc((LOOKUP_PATH, scope['method'], '200'))
+    encoder = api_formats.ENCODERS[mimetype](ip_app.result_columns(providers, fields))
+
+    async def encode(task):
+        # 各块并行查询，编码按输入顺序逐块进行（Arrow格式要把多块攒成一个批次）
+        return await _submit(encoder.write, await task)
+
+    ip_app.start_background_threads()
+    gen = ip_app.reader_manager.acquire()
+    pending = deque()
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', mimetype.encode()),
+            (b'x-ip-db-generation', str(gen.number).encode()),
+        ]})
+        seen = OrderedDict()
+        chunk = []
+        total = 0
+        async for lines in batches:
+            for item in ip_app.iter_unique_ips(lines, seen):
+                total += 1
+                chunk.append(item)
+                if len(chunk) < CHUNK_SIZE:
+                    continue
+                pending.append(asyncio.ensure_future(_submit(ip_app.lookup_items, chunk, providers, fields)))
+                chunk = []
+                if len(pending) >= REQUEST_MAX_INFLIGHT:
+                    # 等待最早的一块查询完成，期间不再读取请求体
+                    await send({'type': 'http.response.body', 'body': await encode(pending.popleft()),
+                                'more_body': True})
+        if chunk:
+            pending.append(asyncio.ensure_future(_submit(ip_app.lookup_items, chunk, providers, fields)))
+        while pending:
+            await send({'type': 'http.response.body', 'body': await encode(pending.popleft()), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': await _submit(encoder.close)})
+        ip_app.BATCH_SIZE.observe(total, (LOOKUP_PATH,))
+    finally:
+        # 已经提交的查询无法中止，等它们结束后才能释放这一代读取器
+        await asyncio.gather(*pending, return_exceptions=True)
+        ip_app.reader_manager.release(gen)
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ, emit):
+    """在线程中执行Flask应用，依次 emit((状态码, 响应头))、emit(响应体的每一块)，最后 emit(None)
+
+    出错时 emit(异常)；emit返回False（客户端已断开）时停止。整个响应在同一个线程中生成，
+    stream_with_context 等依赖请求上下文的生成器不会跨线程执行。
+    """
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [int(status.split(' ', 1)[0]), headers]
+
+    try:
+        result = ip_app.app(environ, start_response)
+        try:
+            if not emit(tuple(response)):
+                return
+            for data in result:
+                if data and not emit(data):
+                    return
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    except Exception as e:
+        emit(e)
+        return
+    emit(None)
+
+
+async def _flask(scope, receive, send):
+    """逐块转发Flask的响应体，流式生成的页面（/ip）边生成边发送"""
+    environ = _wsgi_environ(scope, await _read_body(receive))
+    loop = asyncio.get_running_loop()
+    # 已生成、还没有发出的块数上限，客户端接收慢时生成线程等待
+    chunks = asyncio.Queue(FLASK_MAX_BUFFERED)
+    closed = threading.Event()
+
+    def emit(item):
+        future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+        while not closed.is_set():
+            try:
+                future.result(timeout=1)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    task = asyncio.ensure_future(_submit(_call_wsgi, environ, emit))
+    try:
+        item = await chunks.get()
+        if isinstance(item, Exception):
+            raise item
+        status, headers = item
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        while True:
+            item = await chunks.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # 客户端断开或出错时通知生成线程停止，等它关闭响应后再结束
+        closed.set()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # 启动后就开始在后台打开IP库，不等第一个请求
+            ip_app.start_background_threads()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if _slots.locked():
+        # 线程池已满，不再接受新请求
+        ip_app.REQUESTS.inc(('overloaded', scope['method'], '503'))
+        await _send_json(send, 503, {'error': '服务繁忙，请稍后重试'}, [(b'retry-after', b'1')])
+        return
+    if scope['path'] == LOOKUP_PATH and scope['method'] in ('GET', 'POST'):
+        await _api_lookup(scope, receive, send)
+    else:
+        await _flask(scope, receive, send)
@@ -0,0 +1,553 @@
+"""在本地生成合成的IP库文件（MMDB、xdb、IP2Location BIN、ipdb），无需联网
+
+    python bench/fixtures.py /tmp/ipbench/db
+
+输出目录的结构与 app.py 中 DB_PATH 约定的 ./db 一致，在它的上一级目录中启动应用即可使用。
+地址和地点由种子决定，同样的参数每次生成的内容相同（构建时间除外）。
+"""
+import argparse
+import ipaddress
+import json
+import os
+import random
+import struct
+import time
+
+# 合成地点表：(国家代码, 国家英文, 国家中文, 地区英文, 地区中文, 城市英文, 城市中文, 纬度, 经度, ISP, ASN)
+_COUNTRIES = [
+    ('CN', 'China', '中国', [('Guangdong', '广东省', ['Shenzhen', 'Guangzhou'], ['深圳市', '广州市']),
+                            ('Beijing', '北京市', ['Beijing'], ['北京市']),
+                            ('Zhejiang', '浙江省', ['Hangzhou', 'Ningbo'], ['杭州市', '宁波市'])]),
+    ('US', 'United States', '美国', [('California', '加利福尼亚州', ['Los Angeles', 'San Jose'], ['洛杉矶', '圣何塞']),
+                                    ('Virginia', '弗吉尼亚州', ['Ashburn'], ['阿什本'])]),
+    ('JP', 'Japan', '日本', [('Tokyo', '东京都', ['Tokyo'], ['东京'])]),
+    ('DE', 'Germany', '德国', [('Hesse', '黑森州', ['Frankfurt'], ['法兰克福'])]),
+    ('SG', 'Singapore', '新加坡', [('Singapore', '新加坡', ['Singapore'], ['新加坡'])]),
+]
+_ISPS = [('China Telecom', '电信', 4134), ('China Unicom', '联通', 4837), ('China Mobile', '移动', 9808),
+         ('Cloudflare', 'Cloudflare', 13335), ('Amazon', '亚马逊', 16509), ('Google', '谷歌', 15169)]
+_EMPTY_PLACE = {'iso': '-', 'country_en': '-', 'region_en': '-', 'city_en': '-',
+                'latitude': 0.0, 'longitude': 0.0, 'asn': 0}
+_LANGUAGES = ['de', 'en', 'es', 'fr', 'ja', 'pt-BR', 'ru', 'zh-CN']
+
+
+def _places():
+    places = []
+    for iso, c_en, c_zh, regions in _COUNTRIES:
+        for r_en, r_zh, cities_en, cities_zh in regions:
+            for city_en, city_zh in zip(cities_en, cities_zh):
+                for isp_en, isp_zh, asn in _ISPS:
+                    places.append({
+                        'iso': iso, 'country_en': c_en, 'country_zh': c_zh,
+                        'region_en': r_en, 'region_zh': r_zh,
+                        'city_en': city_en, 'city_zh': city_zh,
+                        'latitude': round(20 + len(places) * 0.37, 4),
+                        'longitude': round(100 + len(places) * 0.53, 4),
+                        'isp_en': isp_en, 'isp_zh': isp_zh, 'asn': asn,
+                    })
+    return places
+
+
+def _tile(root, min_len, max_len, count, rng):
+    """把root网段随机切分为约count个互不重叠、完整覆盖的子网，前缀长度在[min_len, max_len]内"""
+    leaves = list(root.subnets(new_prefix=min_len)) if root.prefixlen < min_len else [root]
+    splittable = [i for i, n in enumerate(leaves) if n.prefixlen < max_len]
+    while len(leaves) < count and splittable:
+        pos = rng.randrange(len(splittable))
+        idx = splittable[pos]
+        left, right = leaves[idx].subnets()
+        leaves[idx] = left
+        leaves.append(right)
+        if left.prefixlen >= max_len:
+            splittable[pos] = splittable[-1]
+            splittable.pop()
+        else:
+            splittable.append(len(leaves) - 1)
+    leaves.sort(key=lambda n: int(n.network_address))
+    return leaves
+
+
+def _assign(networks, places, rng):
+    return [(net, rng.randrange(len(places))) for net in networks]
+
+
+# ---------------------------------------------------------------------------
+# MMDB
+# ---------------------------------------------------------------------------
+
+class _Uint:
+    """显式指定MMDB整数类型（libmaxminddb对元数据字段类型有严格要求）"""
+
+    def __init__(self, value, type_id):
+        self.value = value
+        self.type_id = type_id
+
+
+class _MMDBEncoder:
+    """MaxMind DB数据段编码器，对相同的值去重"""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self._cache = {}
+
+    def _ctrl(self, type_id, size):
+        if type_id <= 7:
+            first = type_id << 5
+            extended = b''
+        else:
+            first = 0
+            extended = bytes([type_id - 7])
+        if size < 29:
+            return bytes([first | size]) + extended
+        if size < 285:
+            return bytes([first | 29]) + extended + bytes([size - 29])
+        if size < 65821:
+            return bytes([first | 30]) + extended + (size - 285).to_bytes(2, 'big')
+        return bytes([first | 31]) + extended + (size - 65821).to_bytes(3, 'big')
+
+    def _encode(self, value):
+        if isinstance(value, _Uint):
+            data = value.value.to_bytes((value.value.bit_length() + 7) // 8, 'big') if value.value else b''
+            return self._ctrl(value.type_id, len(data)) + data
+        if isinstance(value, bool):
+            return self._ctrl(14, int(value))
+        if isinstance(value, str):
+            data = value.encode('utf-8')
+            return self._ctrl(2, len(data)) + data
+        if isinstance(value, float):
+            return self._ctrl(3, 8) + struct.pack('>d', value)
+        if isinstance(value, int):
+            if value < 0:
+                return self._ctrl(8, 4) + struct.pack('>i', value)
+            type_id = 5 if value < 1 << 16 else 6 if value < 1 << 32 else 9
+            data = value.to_bytes((value.bit_length() + 7) // 8, 'big') if value else b''
+            return self._ctrl(type_id, len(data)) + data
+        if isinstance(value, dict):
+            out = self._ctrl(7, len(value))
+            for k, v in value.items():
+                out += self._encode(k) + self._encode(v)
+            return out
+        if isinstance(value, (list, tuple)):
+            out = self._ctrl(11, len(value))
+            for v in value:
+                out += self._encode(v)
+            return out
+        raise TypeError(f'不支持的类型: {type(value)!r}')
+
+    def add(self, value):
+        data = self._encode(value)
+        offset = self._cache.get(data)
+        if offset is None:
+            offset = len(self.buf)
+            self.buf += data
+            self._cache[data] = offset
+        return offset
+
+
+def write_mmdb(path, entries, database_type, description):
+    """写出record_size为32的IPv6结构MMDB文件，IPv4网段挂在::/96下
+
+    entries为(ipaddress网段, 记录dict)列表，网段之间不能重叠。
+    """
+    encoder = _MMDBEncoder()
+    root = [None, None]
+    for net, record in entries:
+        offset = encoder.add(record)
+        value = int(net.network_address)
+        length = net.prefixlen + (96 if net.version == 4 else 0)
+        node = root
+        for depth in range(length):
+            bit = (value >> (127 - depth)) & 1
+            if depth == length - 1:
+                node[bit] = ('data', offset)
+            else:
+                if not isinstance(node[bit], list):
+                    node[bit] = [None, None]
+                node = node[bit]
+
+    # 按广度优先为内部节点编号
+    nodes = [root]
+    index = {id(root): 0}
+    i = 0
+    while i < len(nodes):
+        for child in nodes[i]:
+            if isinstance(child, list):
+                index[id(child)] = len(nodes)
+                nodes.append(child)
+        i += 1
+    node_count = len(nodes)
+
+    tree = bytearray()
+    for node in nodes:
+        for child in node:
+            if child is None:
+                value = node_count
+            elif isinstance(child, list):
+                value = index[id(child)]
+            else:
+                value = node_count + 16 + child[1]
+            tree += struct.pack('>I', value)
+
+    meta = _MMDBEncoder()
+    meta.add({
+        'binary_format_major_version': _Uint(2, 5),
+        'binary_format_minor_version': _Uint(0, 5),
+        'build_epoch': _Uint(int(time.time()), 9),
+        'database_type': database_type,
+        'description': {'en': description},
+        'ip_version': _Uint(6, 5),
+        'languages': list(_LANGUAGES),
+        'node_count': _Uint(node_count, 6),
+        'record_size': _Uint(32, 5),
+    })
+    with open(path, 'wb') as f:
+        f.write(tree)
+        f.write(b'\x00' * 16)
+        f.write(encoder.buf)
+        f.write(b'\xab\xcd\xefMaxMind.com')
+        f.write(meta.buf)
+
+
+def _names(en, zh):
+    names = {lang: en for lang in _LANGUAGES}
+    names['zh-CN'] = zh
+    return names
+
+
+def _city_record(place, idx):
+    country = {'geoname_id': 1000 + idx % 97, 'iso_code': place['iso'],
+               'names': _names(place['country_en'], place['country_zh'])}
+    return {
+        'city': {'geoname_id': 5000 + idx, 'names': _names(place['city_en'], place['city_zh'])},
+        'continent': {'code': 'AS', 'geoname_id': 6255147, 'names': _names('Asia', '亚洲')},
+        'country': country,
+        'location': {'accuracy_radius': 50, 'latitude': place['latitude'],
+                     'longitude': place['longitude'], 'time_zone': 'Asia/Shanghai'},
+        'registered_country': country,
+        'subdivisions': [{'geoname_id': 3000 + idx % 31, 'iso_code': 'XX',
+                          'names': _names(place['region_en'], place['region_zh'])}],
+    }
+
+
+def _country_record(place):
+    country = {'geoname_id': 1000, 'iso_code': place['iso'],
+               'names': _names(place['country_en'], place['country_zh'])}
+    return {'continent': {'code': 'AS', 'names': _names('Asia', '亚洲')},
+            'country': country, 'registered_country': country}
+
+
+def _asn_record(place):
+    return {'autonomous_system_number': place['asn'],
+            'autonomous_system_organization': place['isp_en']}
+
+
+def _dbip_record(place):
+    return {
+        'city': {'names': {'en': place['city_en']}},
+        'continent': {'code': 'AS', 'names': _names('Asia', '亚洲')},
+        'country': {'iso_code': place['iso'], 'names': _names(place['country_en'], place['country_zh'])},
+        'location': {'latitude': place['latitude'], 'longitude': place['longitude']},
+        'subdivisions': [{'names': {'en': place['region_en']}}],
+    }
+
+
+# ---------------------------------------------------------------------------
+# ip2region xdb
+# ---------------------------------------------------------------------------
+
+def write_xdb(path, entries, ip_version):
+    """写出ip2region xdb（3.0格式）；段在前两个字节边界处切分以匹配向量索引
+
+    entries为(起始整数, 结束整数, 区域字符串)列表，要求按起始地址排序。
+    """
+    nbytes = 4 if ip_version == 4 else 16
+    shift = nbytes * 8 - 16
+    segments = []
+    for start, end, region in entries:
+        while start <= end:
+            block_end = ((start >> shift) << shift) | ((1 << shift) - 1)
+            seg_end = min(end, block_end)
+            segments.append((start, seg_end, region))
+            start = seg_end + 1
+
+    header_len = 256
+    vector_len = 256 * 256 * 8
+    data = bytearray()
+    data_ptr = {}
+    base = header_len + vector_len
+    for _, _, region in segments:
+        if region not in data_ptr:
+            data_ptr[region] = base + len(data)
+            data += region.encode('utf-8')
+
+    seg_size = 14 if ip_version == 4 else 38
+    index_start = base + len(data)
+    index = bytearray()
+    vector = {}
+    for i, (start, end, region) in enumerate(segments):
+        ptr = index_start + i * seg_size
+        key = start >> shift
+        if key not in vector:
+            vector[key] = [ptr, ptr]
+        vector[key][1] = ptr
+        encoded = region.encode('utf-8')
+        if ip_version == 4:
+            index += struct.pack('<IIHI', start, end, len(encoded), data_ptr[region])
+        else:
+            index += start.to_bytes(16, 'big') + end.to_bytes(16, 'big')
+            index += struct.pack('<HI', len(encoded), data_ptr[region])
+
+    header = struct.pack('<HHIIIHH', 3, 1, int(time.time()), index_start,
+                         index_start + len(index) - seg_size, ip_version, 4)
+    vector_buf = bytearray(vector_len)
+    for key, (s_ptr, e_ptr) in vector.items():
+        struct.pack_into('<II', vector_buf, key * 8, s_ptr, e_ptr)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(header_len, b'\x00'))
+        f.write(vector_buf)
+        f.write(data)
+        f.write(index)
+
+
+# ---------------------------------------------------------------------------
+# IP2Location BIN（DB11：国家、地区、城市、纬度、经度、邮编、时区）
+# ---------------------------------------------------------------------------
+
+_IP2LOCATION_DB11_COLUMNS = 8
+
+
+def write_ip2location_bin(path, v4_entries, v6_entries):
+    """写出DB11格式的IP2Location BIN；entries为(起始整数, 结束整数, 地点dict)列表"""
+    columns = _IP2LOCATION_DB11_COLUMNS
+    v4_width = columns * 4
+    v6_width = columns * 4 + 12
+    header_len = 64
+    v4_rows = len(v4_entries) + 1
+    v6_rows = len(v6_entries) + 1 if v6_entries else 0
+    v4_index_addr = header_len + 1
+    v6_index_addr = v4_index_addr + 65536 * 8 if v6_entries else 0
+    v4_addr = (v6_index_addr or v4_index_addr) + 65536 * 8
+    v6_addr = v4_addr + v4_rows * v4_width if v6_entries else 0
+    strings_base = v4_addr - 1 + v4_rows * v4_width + v6_rows * v6_width
+
+    strings = bytearray()
+    string_ptr = {}
+
+    def add_string(value):
+        if value not in string_ptr:
+            string_ptr[value] = strings_base + len(strings)
+            data = value.encode('latin-1', 'replace')
+            strings.extend(bytes([len(data)]) + data)
+        return string_ptr[value]
+
+    def add_country(iso, name):
+        key = ('country', iso, name)
+        if key not in string_ptr:
+            string_ptr[key] = strings_base + len(strings)
+            # 国家简称固定占3字节，库按 偏移+3 读取国家全称
+            strings.extend(bytes([len(iso)]) + iso.ljust(2).encode('ascii'))
+            data = name.encode('latin-1', 'replace')
+            strings.extend(bytes([len(data)]) + data)
+        return string_ptr[key]
+
+    def row_columns(place):
+        return [
+            add_country(place['iso'], place['country_en']),
+            add_string(place['region_en']),
+            add_string(place['city_en']),
+            struct.unpack('<I', struct.pack('<f', place['latitude']))[0],
+            struct.unpack('<I', struct.pack('<f', place['longitude']))[0],
+            add_string('%05d' % (place['asn'] % 100000)),
+            add_string('+08:00'),
+        ]
+
+    def build(entries, width, nbytes, max_value):
+        rows = bytearray()
+        for start, _, place in entries:
+            rows += start.to_bytes(nbytes, 'little') + struct.pack('<7I', *row_columns(place))
+        rows += max_value.to_bytes(nbytes, 'little') + b'\x00' * (width - nbytes)
+        return rows
+
+    def build_index(entries, shift):
+        index = bytearray(65536 * 8)
+        row = 0
+        for key in range(65536):
+            lo_ip = key << shift
+            hi_ip = ((key + 1) << shift) - 1
+            while row < len(entries) - 1 and entries[row][1] < lo_ip:
+                row += 1
+            end_row = row
+            while end_row < len(entries) - 1 and entries[end_row][1] < hi_ip:
+                end_row += 1
+            struct.pack_into('<II', index, key * 8, row, end_row + 1)
+        return index
+
+    v4_rows_buf = build(v4_entries, v4_width, 4, (1 << 32) - 1)
+    v6_rows_buf = build(v6_entries, v6_width, 16, (1 << 128) - 1) if v6_entries else b''
+    header = struct.pack('<BBBBBIIIIIIBBB', 11, columns, 25, 12, 1,
+                         len(v4_entries), v4_addr, len(v6_entries), v6_addr,
+                         v4_index_addr, v6_index_addr, 1, 1, 0)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(header_len, b'\x00'))
+        f.write(build_index(v4_entries, 16))
+        if v6_entries:
+            f.write(build_index(v6_entries, 112))
+        f.write(v4_rows_buf)
+        f.write(v6_rows_buf)
+        f.write(strings)
+
+
+# ---------------------------------------------------------------------------
+# ipdb（ipip.net / qqwry）
+# ---------------------------------------------------------------------------
+
+def write_ipdb(path, entries, fields):
+    """写出仅含IPv4的ipdb文件；entries为(ipaddress网段, 字段值列表)列表"""
+    data = bytearray(b'\x00' * 16)
+    data_ptr = {}
+    empty = '\t'.join([''] * len(fields))
+
+    def add(text):
+        if text not in data_ptr:
+            encoded = text.encode('utf-8')
+            data_ptr[text] = len(data)
+            data.extend(struct.pack('>H', len(encoded)) + encoded)
+        return data_ptr[text]
+
+    add(empty)
+    root = [None, None]
+    for net, values in entries:
+        offset = add('\t'.join(values))
+        bits = (0xFFFF << 32) | int(net.network_address)
+        length = 96 + net.prefixlen
+        node = root
+        for depth in range(length):
+            bit = (bits >> (127 - depth)) & 1
+            if depth == length - 1:
+                node[bit] = ('data', offset)
+            else:
+                if not isinstance(node[bit], list):
+                    node[bit] = [None, None]
+                node = node[bit]
+
+    nodes = [root]
+    index = {id(root): 0}
+    i = 0
+    while i < len(nodes):
+        for child in nodes[i]:
+            if isinstance(child, list):
+                index[id(child)] = len(nodes)
+                nodes.append(child)
+        i += 1
+    node_count = len(nodes)
+
+    tree = bytearray()
+    for node in nodes:
+        for child in node:
+            if child is None:
+                value = node_count + data_ptr[empty]
+            elif isinstance(child, list):
+                value = index[id(child)]
+            else:
+                value = node_count + child[1]
+            tree += struct.pack('>I', value)
+
+    meta = json.dumps({
+        'build': int(time.time()),
+        'ip_version': 1,
+        'languages': {'CN': 0},
+        'node_count': node_count,
+        'total_size': len(tree) + len(data),
+        'fields': fields,
+    }).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(struct.pack('>I', len(meta)))
+        f.write(meta)
+        f.write(tree)
+        f.write(data)
+
+
+# ---------------------------------------------------------------------------
+
+def build_fixtures(out_dir, seed=20240601, v4_networks=20000, v6_networks=5000):
+    """生成全部合成IP库文件，返回 {DB_PATH键: 文件路径}"""
+    rng = random.Random(seed)
+    places = _places()
+    v4 = _assign(_tile(ipaddress.ip_network('0.0.0.0/0'), 8, 28, v4_networks, rng), places, rng)
+    v6 = _assign(_tile(ipaddress.ip_network('2400::/12'), 16, 64, v6_networks, rng), places, rng)
+
+    def ranges(entries):
+        return [(int(net.network_address), int(net.broadcast_address), places[i]) for net, i in entries]
+
+    def full_ranges(entries, max_value):
+        # IP2Location的BIN文件要求区间完整覆盖整个地址空间
+        filled = []
+        cursor = 0
+        for start, end, place in ranges(entries):
+            if start > cursor:
+                filled.append((cursor, start - 1, _EMPTY_PLACE))
+            filled.append((start, end, place))
+            cursor = end + 1
+        if cursor <= max_value:
+            filled.append((cursor, max_value, _EMPTY_PLACE))
+        return filled
+
+    paths = {
+        'geolite2_city': os.path.join(out_dir, 'GeoLite2', 'GeoLite2-City.mmdb'),
+        'geolite2_country': os.path.join(out_dir, 'GeoLite2', 'GeoLite2-Country.mmdb'),
+        'geolite2_asn': os.path.join(out_dir, 'GeoLite2', 'GeoLite2-ASN.mmdb'),
+        'dbip_city': os.path.join(out_dir, 'db-ip', 'dbip-city-lite-2025-12.mmdb'),
+        'ip2location_v4': os.path.join(out_dir, 'ip2location', 'IP2LOCATION-LITE-DB11.BIN'),
+        'ip2location_v6': os.path.join(out_dir, 'ip2location', 'IP2LOCATION-LITE-DB11.IPV6.BIN'),
+        'ip2region_v4': os.path.join(out_dir, 'ip2region', 'ip2region_v4.xdb'),
+        'ip2region_v6': os.path.join(out_dir, 'ip2region', 'ip2region_v6.xdb'),
+        'ipip_free': os.path.join(out_dir, 'ipip', 'ipipfree.ipdb'),
+        'qqwry': os.path.join(out_dir, 'qqwry', 'qqwry.ipdb'),
+    }
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    both = v4 + v6
+    write_mmdb(paths['geolite2_city'], [(n, _city_record(places[i], i)) for n, i in both],
+               'GeoLite2-City', 'Synthetic GeoLite2 City')
+    write_mmdb(paths['geolite2_country'], [(n, _country_record(places[i])) for n, i in both],
+               'GeoLite2-Country', 'Synthetic GeoLite2 Country')
+    write_mmdb(paths['geolite2_asn'], [(n, _asn_record(places[i])) for n, i in both],
+               'GeoLite2-ASN', 'Synthetic GeoLite2 ASN')
+    write_mmdb(paths['dbip_city'], [(n, _dbip_record(places[i])) for n, i in both],
+               'DBIP-City-Lite', 'Synthetic db-ip city lite')
+
+    write_ip2location_bin(paths['ip2location_v4'], ranges(v4), [])
+    write_ip2location_bin(paths['ip2location_v6'], ranges(v4), full_ranges(v6, (1 << 128) - 1))
+
+    def region(place):
+        return '|'.join([place['country_zh'], place['region_zh'], place['city_zh'], place['isp_zh'], place['iso']])
+
+    write_xdb(paths['ip2region_v4'], [(s, e, region(p)) for s, e, p in ranges(v4)], 4)
+    write_xdb(paths['ip2region_v6'], [(s, e, region(p)) for s, e, p in ranges(v6)], 6)
+
+    ipip_fields = ['country_name', 'region_name', 'city_name', 'owner_domain', 'isp_domain']
+    write_ipdb(paths['ipip_free'], [(n, [places[i]['country_zh'], places[i]['region_zh'], places[i]['city_zh'],
+                                         '', places[i]['isp_zh']]) for n, i in v4], ipip_fields)
+    qqwry_fields = ipip_fields + ['district_name']
+    write_ipdb(paths['qqwry'], [(n, [places[i]['country_zh'], places[i]['region_zh'], places[i]['city_zh'],
+                                     '', places[i]['isp_zh'], '']) for n, i in v4], qqwry_fields)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成合成IP库文件')
+    parser.add_argument('out_dir', help='输出目录，结构与 ./db 一致')
+    parser.add_argument('--seed', type=int, default=20240601)
+    parser.add_argument('--v4-networks', type=int, default=20000)
+    parser.add_argument('--v6-networks', type=int, default=5000)
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    paths = build_fixtures(args.out_dir, args.seed, args.v4_networks, args.v6_networks)
+    for key, path in paths.items():
+        print(f'{key:18s} {os.path.getsize(path):>12,d}  {path}')
+    print(f'✓ fixtures written to {args.out_dir} in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""性能测试：用本地生成的合成IP库测量各查询函数和 /ip 接口的吞吐量
+
+    python bench/run.py -o results.json
+    python bench/run.py -o new.json --compare results.json --tolerance 0.15
+
+先用 fixtures.py 按固定种子生成IP库（--db-dir 指定的目录已有同样参数生成的库时直接使用），
+在该目录中导入app，再用同一组随机IP逐项计时。每项重复 --repeat 次取最快的一次，结果以JSON写出；
+指定 --compare 时与之前的结果比较，吞吐量下降超过 --tolerance 的项目视为性能退化，以退出码1结束。
+
+默认关闭结果缓存（IP_CACHE_SIZE=0），测量的是实际查询IP库的速度。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixtures import build_fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 生成参数相同的库可以复用，参数记录在库目录中的这个文件里
+STAMP_FILE = 'fixtures.json'
+
+
+def prepare_db(db_dir, seed, v4_networks, v6_networks):
+    """在db_dir/db中生成合成IP库，已有同样参数生成的库时跳过"""
+    params = {'seed': seed, 'v4_networks': v4_networks, 'v6_networks': v6_networks}
+    out_dir = os.path.join(db_dir, 'db')
+    stamp = os.path.join(out_dir, STAMP_FILE)
+    try:
+        with open(stamp, encoding='utf-8') as f:
+            if json.load(f) == params:
+                return
+    except (OSError, ValueError):
+        pass
+    started = time.perf_counter()
+    build_fixtures(out_dir, seed, v4_networks, v6_networks)
+    with open(stamp, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    print(f"✓ fixtures generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def sample_ips(count, seed, v6_ratio=0.2):
+    """固定种子的随机IP：IPv4取自全部公网单播段，IPv6取自合成库覆盖的 2400::/12"""
+    rng = random.Random(seed)
+    ips = []
+    for _ in range(count):
+        if rng.random() < v6_ratio:
+            value = (0x240 << 116) | rng.getrandbits(116)
+            ips.append(':'.join(f'{(value >> shift) & 0xffff:x}' for shift in range(112, -1, -16)))
+        else:
+            ips.append(f'{rng.randint(1, 223)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}')
+    return ips
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def timed(func, repeat):
+    """执行repeat次func，返回每次的耗时（秒）"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def benchmarks(app, ips):
+    """返回 [(名称, 单位, 数量, 函数), ...]，数量为函数每执行一次处理的IP数或请求数"""
+    cases = []
+    batches = _chunks(ips, app.API_BATCH_SIZE)
+    for name in app.PROVIDERS:
+        query = getattr(app, f'query_{name}', None)
+        if query is not None:
+            cases.append((f'query_{name}', 'ip', len(ips), lambda q=query: [q(ip) for ip in ips]))
+    for name in app.PROVIDERS:
+        cases.append((f'batch_{name}', 'ip', len(ips),
+                      lambda n=[name]: [app.lookup_batch(batch, n) for batch in batches]))
+    cases.append(('lookup_ip', 'ip', len(ips), lambda: [app.lookup_ip(ip) for ip in ips]))
+    cases.append(('lookup_batch', 'ip', len(ips), lambda: [app.lookup_batch(batch) for batch in batches]))
+
+    client = app.app.test_client()
+    # 页面每次请求查询一个IP（GET，取X-Real-IP）或最多10个IP（POST表单）
+    page_ips = ips[:max(1, len(ips) // 50)]
+    cases.append(('http_ip_get', 'request', len(page_ips), lambda: [
+        client.get('/ip', headers={'X-Real-IP': ip}).get_data() for ip in page_ips]))
+    forms = _chunks(page_ips, 10)
+    cases.append(('http_ip_post', 'request', len(forms), lambda: [
+        client.post('/ip', data={'ips': '\n'.join(form)}).get_data() for form in forms]))
+    cases.append(('http_api_lookup', 'ip', len(ips), lambda: [
+        client.post('/ip/api/lookup', data='\n'.join(batch), content_type='text/plain').get_data()
+        for batch in batches]))
+    return cases
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """返回吞吐量比基线下降超过tolerance的项目 [(名称, 基线, 本次), ...]"""
+    regressions = []
+    for name, entry in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old and entry['per_second'] < old['per_second'] * (1 - tolerance):
+            regressions.append((name, old['per_second'], entry['per_second']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='用合成IP库测量查询函数和接口的吞吐量')
+    parser.add_argument('-o', '--output', help='结果JSON文件，默认写到标准输出')
+    parser.add_argument('--db-dir', help='生成和复用合成IP库的目录，默认使用临时目录并在结束后删除')
+    parser.add_argument('--ips', type=int, default=20000, help='每项测试查询的IP数，默认20000')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快的一次，默认3')
+    parser.add_argument('--seed', type=int, default=20240601, help='生成IP库和测试IP的随机种子')
+    parser.add_argument('--v4-networks', type=int, default=20000, help='合成库中的IPv4网段数，默认20000')
+    parser.add_argument('--v6-networks', type=int, default=5000, help='合成库中的IPv6网段数，默认5000')
+    parser.add_argument('--only', help='只运行名称包含这些字符串的项目，逗号分隔')
+    parser.add_argument('--cache', action='store_true', help='保留结果缓存（默认关闭）')
+    parser.add_argument('--compare', help='与之前的结果JSON比较')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='视为性能退化的吞吐量下降比例，默认0.15')
+    args = parser.parse_args(argv)
+    # 之后会切换到IP库目录，先把命令行中的相对路径转换为绝对路径
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    db_dir = os.path.abspath(args.db_dir) if args.db_dir else tempfile.mkdtemp(prefix='ip-bench-')
+    try:
+        prepare_db(db_dir, args.seed, args.v4_networks, args.v6_networks)
+        if not args.cache:
+            os.environ['IP_CACHE_SIZE'] = '0'
+        os.environ.setdefault('IP_DB_WATCH_INTERVAL', '0')
+        # app按 ./db 下的相对路径打开IP库
+        os.chdir(db_dir)
+        sys.path.insert(0, ROOT)
+        import app
+
+        ips = sample_ips(args.ips, args.seed)
+        only = [s.strip() for s in args.only.split(',')] if args.only else None
+        results = {}
+        for name, unit, count, func in benchmarks(app, ips):
+            if only and not any(s in name for s in only):
+                continue
+            times = timed(func, max(1, args.repeat))
+            best = min(times)
+            results[name] = {
+                'unit': unit,
+                'count': count,
+                'best_seconds': round(best, 6),
+                'median_seconds': round(statistics.median(times), 6),
+                'per_second': round(count / best, 1),
+                'us_per_op': round(best / count * 1e6, 3),
+            }
+            print(f"{name:24s} {count / best:>12,.0f} {unit}/s {best / count * 1e6:>10.2f} us/{unit}", file=sys.stderr)
+    finally:
+        if not args.db_dir:
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'ips': args.ips,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'v4_networks': args.v4_networks,
+            'v6_networks': args.v6_networks,
+            'cache': args.cache,
+            'ip2region_cache_policy': app.IP2REGION_CACHE_POLICY,
+            'ip2location_engine': app.IP2LOCATION_ENGINE,
+            'ip_db_engine': app.IP_DB_ENGINE,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2) + '\n'
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print(f"regression: {name} {old:,.0f} -> {new:,.0f} ({new / old - 1:+.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"✓ no regressions beyond {args.tolerance:.0%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""比较同一IP库的两个版本，找出记录发生变化的网段
+
+    python db_diff.py db/db-ip/dbip-city-lite-2025-11.mmdb db/db-ip/dbip-city-lite-2025-12.mmdb
+    python db_diff.py old/ip2region_v4.xdb db/ip2region/ip2region_v4.xdb -o report.json
+
+同时遍历两个文件的区间索引（见 db_ranges），在两者的公共细分上逐段比较记录。同一文件中引用相同的记录
+一定相同，因此每对 (旧引用, 新引用) 只解码比较一次，耗时主要取决于两个版本中不同记录组合的数量。
+热加载时用比较结果只清除缓存中落在变化网段内的条目，报告同时保存下来供审计。
+"""
+import argparse
+import ipaddress
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from db_ranges import MMDBRanges, IpdbRanges, IP2LocationRanges, XdbRanges, to_networks
+
+# 按扩展名选择区间索引，用于命令行比较任意两个文件
+INDEX_CLASSES = {
+    '.mmdb': MMDBRanges,
+    '.ipdb': IpdbRanges,
+    '.bin': IP2LocationRanges,
+    '.xdb': XdbRanges,
+}
+
+# 每侧缓存的已解码记录数，区间按地址顺序遍历，相邻区间的记录往往相同
+DECODE_CACHE_SIZE = 4096
+
+
+def merge_ranges(ranges):
+    """排序并合并重叠或相邻的区间"""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [tuple(r) for r in merged]
+
+
+def changed_ranges(old, new, version):
+    """同时遍历两个区间索引的记录，返回记录不同的区间（相邻的合并），按地址排序"""
+    old_decode = lru_cache(DECODE_CACHE_SIZE)(old.decode)
+    new_decode = lru_cache(DECODE_CACHE_SIZE)(new.decode)
+    same = {}
+    changed = []
+    old_records = old.records(version)
+    new_records = new.records(version)
+    a = next(old_records, None)
+    b = next(new_records, None)
+    while a is not None and b is not None:
+        start = max(a[0], b[0])
+        end = min(a[1], b[1])
+        old_ref, new_ref = a[2], b[2]
+        if old_ref is None or new_ref is None:
+            equal = old_ref is new_ref
+        else:
+            equal = same.get((old_ref, new_ref))
+            if equal is None:
+                equal = same[(old_ref, new_ref)] = old_decode(old_ref) == new_decode(new_ref)
+        if not equal:
+            if changed and changed[-1][1] + 1 == start:
+                changed[-1][1] = end
+            else:
+                changed.append([start, end])
+        if a[1] == end:
+            a = next(old_records, None)
+        if b[1] == end:
+            b = next(new_records, None)
+    return [tuple(r) for r in changed]
+
+
+def diff(old, new):
+    """返回 {IP版本: 变化的区间列表}"""
+    changed = {version: changed_ranges(old, new, version) for version in (4, 6)}
+    if changed[4]:
+        # 按IPv4行查询、但无法按区间比较的IPv6地址（IP2Location的Teredo地址）整体视为变化
+        dependent = getattr(new, 'IPV4_DEPENDENT', ())
+        if dependent:
+            changed[6] = merge_ranges(changed[6] + list(dependent))
+    return changed
+
+
+def report(changed, old_path, new_path, seconds):
+    """变化的区间整理成报告：各IP版本变化的CIDR列表和地址数"""
+    return {
+        'old': old_path,
+        'new': new_path,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'seconds': round(seconds, 3),
+        'addresses': {str(version): sum(last - first + 1 for first, last in ranges)
+                      for version, ranges in changed.items()},
+        'changed': {str(version): to_networks(ranges, version) for version, ranges in changed.items()},
+    }
+
+
+def report_ranges(data):
+    """从报告中取回 {IP版本: 变化的区间列表}"""
+    ranges = {}
+    for version, networks in data['changed'].items():
+        parsed = [ipaddress.ip_network(n) for n in networks]
+        ranges[int(version)] = merge_ranges((int(n.network_address), int(n.broadcast_address)) for n in parsed)
+    return ranges
+
+
+def compare(old, new, old_path, new_path):
+    """比较两个已打开的区间索引，返回报告"""
+    started = time.perf_counter()
+    return report(diff(old, new), old_path, new_path, time.perf_counter() - started)
+
+
+def cached_report(path, build):
+    """读取保存在path的报告，没有时调用 build() 生成并保存
+
+    多个进程同时热加载时用文件锁保证只有一个进程比较，其余进程等待后直接读取结果。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        data = build()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+        return data
+
+
+def open_index(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in INDEX_CLASSES:
+        raise ValueError(f'不支持的IP库文件: {filename}')
+    return INDEX_CLASSES[ext](filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='比较同一IP库的两个版本，输出记录发生变化的网段')
+    parser.add_argument('old', help='旧版本文件')
+    parser.add_argument('new', help='新版本文件')
+    parser.add_argument('-o', '--output', help='报告JSON文件，默认写到标准输出')
+    args = parser.parse_args(argv)
+    if os.path.splitext(args.old)[1].lower() != os.path.splitext(args.new)[1].lower():
+        parser.error('两个文件的格式不同')
+    old = open_index(args.old)
+    new = open_index(args.new)
+    try:
+        data = compare(old, new, args.old, args.new)
+    finally:
+        old.close()
+        new.close()
+    text = json.dumps(data, ensure_ascii=False, indent=1) + '\n'
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    summary = ', '.join(f"IPv{version} {len(networks)} networks ({data['addresses'][version]} addresses)"
+                        for version, networks in data['changed'].items())
+    print(f"✓ compared in {data['seconds']:.1f}s: {summary}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""按地址范围遍历各IP库文件的区间
+
+每种IP库对应一个区间索引类，打开文件后可以反复调用 ranges(version, first, last)，按起始地址顺序返回
+[first, last] 内互不重叠的 (起始地址, 结束地址)，空记录也作为区间返回。同一区间内的地址在对应读取器中
+一定得到相同的结果。遍历整个地址空间用于编译合并库，只遍历一个网段用于范围查询，
+后者直接在搜索树或区间索引中定位，耗时与网段内的区间数有关，与地址数无关。
+
+records(version, first, last) 在区间之外还返回记录的引用（树的叶子节点、段的区域字符串位置等），
+同一文件中引用相同则记录相同；比较不同文件时用 decode(引用) 解码，引用为None表示没有数据。
+"""
+import heapq
+import ipaddress
+import json
+import mmap
+import struct
+
+import maxminddb
+from maxminddb.decoder import Decoder
+
+from ip2location_mem import MemoryIP2Location, MAX_IPV4
+from xdb import XdbFile
+
+MAX_IPV6 = (1 << 128) - 1
+
+
+def _bits(version):
+    return 32 if version == 4 else 128
+
+
+def _points(ranges):
+    for first, last in ranges:
+        yield first
+        yield last + 1
+
+
+def partition(streams, version, first=0, last=None):
+    """多组区间在 [first, last]（默认整个地址空间）内的公共细分，完整覆盖该范围
+
+    每组区间需按地址排序且互不重叠；返回的每个区间都不跨越任何一组区间的边界。
+    """
+    end = (1 << _bits(version)) if last is None else last + 1
+    prev = first
+    for point in heapq.merge(*(_points(ranges) for ranges in streams)):
+        if point > end:
+            break
+        if prev < point:
+            yield prev, point - 1
+            prev = point
+    if prev < end:
+        yield prev, end - 1
+
+
+def _walk_tree(read_node, node_count, root, bits, first=0, last=None):
+    """深度优先遍历二叉树，每个叶子（数据或空记录）对应一个区间，返回 (起始地址, 结束地址, 叶子节点)
+
+    只进入与 [first, last] 相交的子树，返回的区间裁剪到该范围内，耗时与范围内的叶子数有关。
+    """
+    last = (1 << bits) - 1 if last is None else last
+    stack = [(root, 0, 0)]
+    while stack:
+        node, depth, prefix = stack.pop()
+        if node >= node_count or depth == bits:
+            host = bits - depth
+            yield max(prefix << host, first), min(((prefix + 1) << host) - 1, last), node
+            continue
+        left, right = read_node(node)
+        right_prefix = (prefix << 1) | 1
+        # 右子树的起始地址，左子树到它之前结束
+        middle = right_prefix << (bits - depth - 1)
+        if middle <= last:
+            stack.append((right, depth + 1, right_prefix))
+        if middle > first:
+            stack.append((left, depth + 1, prefix << 1))
+
+
+def _follow(read_node, node_count, path):
+    """从根节点沿path（0/1序列）向下走，遇到叶子时停止"""
+    node = 0
+    for bit in path:
+        if node >= node_count:
+            break
+        node = read_node(node)[bit]
+    return node
+
+
+def _max_address(version):
+    return MAX_IPV4 if version == 4 else MAX_IPV6
+
+
+def to_networks(ranges, version):
+    """按地址排序的区间合并相邻部分后转换为最少的CIDR字符串"""
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    merged = []
+    for first, last in ranges:
+        if merged and merged[-1][1] + 1 == first:
+            merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return [str(network) for first, last in merged
+            for network in ipaddress.summarize_address_range(address(first), address(last))]
+
+
+class MMDBRanges:
+    """MMDB搜索树的区间索引
+
+    与 maxminddb 自带的迭代不同，这里不跳过指向IPv4子树的别名（::ffff:0:0/96、2002::/16等），
+    因为查询这些IPv6地址时读取器同样会走到IPv4子树。
+    """
+
+    def __init__(self, filename):
+        with maxminddb.open_database(filename, maxminddb.MODE_MMAP) as reader:
+            metadata = reader.metadata()
+        self.ip_version = metadata.ip_version
+        self.node_count = metadata.node_count
+        self.record_size = metadata.record_size
+        self._node_bytes = self.record_size // 4
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._search_tree_size = self.node_count * self._node_bytes
+        # 数据区在搜索树和16字节的分隔符之后
+        self._decoder = Decoder(self._mm, self._search_tree_size + 16)
+        self._ipv4_root = None
+
+    def read_node(self, node):
+        b = self._mm[node * self._node_bytes:(node + 1) * self._node_bytes]
+        if self.record_size == 24:
+            return int.from_bytes(b[0:3], 'big'), int.from_bytes(b[3:6], 'big')
+        if self.record_size == 28:
+            # 中间字节的高4位属于左记录，低4位属于右记录
+            return (((b[3] & 0xF0) << 20) | int.from_bytes(b[0:3], 'big'),
+                    ((b[3] & 0x0F) << 24) | int.from_bytes(b[4:7], 'big'))
+        return int.from_bytes(b[0:4], 'big'), int.from_bytes(b[4:8], 'big')
+
+    def _leaves(self, version, first, last):
+        last = _max_address(version) if last is None else last
+        if self.ip_version == 4:
+            if version == 6:
+                # IPv4库查询IPv6地址会报错，整个IPv6地址空间结果相同
+                return iter([(first, last, self.node_count)])
+            return _walk_tree(self.read_node, self.node_count, 0, 32, first, last)
+        if version == 4:
+            # IPv4地址在IPv6库中位于 ::/96
+            if self._ipv4_root is None:
+                self._ipv4_root = _follow(self.read_node, self.node_count, [0] * 96)
+            return _walk_tree(self.read_node, self.node_count, self._ipv4_root, 32, first, last)
+        return _walk_tree(self.read_node, self.node_count, 0, 128, first, last)
+
+    def ranges(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的区间"""
+        for low, high, _ in self._leaves(version, first, last):
+            yield low, high
+
+    def records(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的 (起始地址, 结束地址, 数据指针)"""
+        for low, high, node in self._leaves(version, first, last):
+            yield low, high, node if node > self.node_count else None
+
+    def decode(self, node):
+        return self._decoder.decode(node - self.node_count + self._search_tree_size)[0]
+
+    def close(self):
+        self._mm.close()
+
+
+class IpdbRanges:
+    """ipip.net ipdb搜索树的区间索引，IPv4地址位于 ::ffff:0:0/96"""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        meta_length = struct.unpack_from('>I', self._mm, 0)[0]
+        meta = json.loads(self._mm[4:4 + meta_length].decode('utf-8'))
+        self._tree = 4 + meta_length
+        self.node_count = meta['node_count']
+        # ip_version按位表示：1支持IPv4，2支持IPv6
+        self.ip_version = meta['ip_version']
+        self._ipv4_root = None
+
+    def read_node(self, node):
+        return struct.unpack_from('>II', self._mm, self._tree + node * 8)
+
+    def _leaves(self, version, first, last):
+        last = _max_address(version) if last is None else last
+        if not self.ip_version & (1 if version == 4 else 2):
+            return iter([(first, last, self.node_count)])
+        if version == 4:
+            if self._ipv4_root is None:
+                self._ipv4_root = _follow(self.read_node, self.node_count, [0] * 80 + [1] * 16)
+            return _walk_tree(self.read_node, self.node_count, self._ipv4_root, 32, first, last)
+        return _walk_tree(self.read_node, self.node_count, 0, 128, first, last)
+
+    def ranges(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的区间"""
+        for low, high, _ in self._leaves(version, first, last):
+            yield low, high
+
+    def records(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的 (起始地址, 结束地址, 叶子节点)"""
+        for low, high, node in self._leaves(version, first, last):
+            yield low, high, node if node > self.node_count else None
+
+    def decode(self, node):
+        """叶子节点对应的记录：各语言字段以制表符分隔的原始字节"""
+        offset = self._tree + node - self.node_count + self.node_count * 8
+        size = struct.unpack_from('>H', self._mm, offset)[0]
+        return self._mm[offset + 2:offset + 2 + size]
+
+    def close(self):
+        self._mm.close()
+
+
+# IP2Location把IPv4映射地址和6to4地址按其中的IPv4地址查询：(IPv6起始地址, IPv4地址左移位数, 主机位)
+_IP2LOCATION_ALIASES = ((0xffff << 32, 0, 0), (0x2002 << 112, 80, (1 << 80) - 1))
+
+
+# Teredo地址（2001::/32）按最后32位取反得到的IPv4地址查询
+_TEREDO = (0x20010000 << 96, (0x20010000 << 96) | ((1 << 96) - 1))
+
+
+def _alias_ranges(v4_ranges, base, shift, host):
+    for first, last in v4_ranges:
+        yield base | (first << shift), base | (last << shift) | host
+
+
+class IP2LocationRanges:
+    """IP2Location BIN文件按行划分的区间索引
+
+    Teredo地址（2001::/32）的结果只取决于最后32位，每个/96中的划分都相同，跨越多个/96的范围
+    无法表示为有限个区间：范围在一个/96之内时按对应的IPv4区间划分，否则整体作为一个区间，
+    由 unresolved() 给出，区间内各地址的结果不同。
+    """
+
+    # IPv4行变化时结果可能随之变化、但没有按区间划分的IPv6地址
+    IPV4_DEPENDENT = (_TEREDO,)
+
+    def __init__(self, filename):
+        self._reader = MemoryIP2Location(filename)
+
+    def _v4_ranges(self, first, last):
+        # 行不覆盖的地址（例如255.255.255.255）也要作为区间，映射地址块才能完整覆盖
+        return partition([self._reader.iter_ranges(4, first, last)], 4, first, last)
+
+    @staticmethod
+    def _teredo(first, last):
+        """[first, last] 与Teredo地址块的交集，没有时返回None"""
+        low, high = max(first, _TEREDO[0]), min(last, _TEREDO[1])
+        return (low, high) if low <= high else None
+
+    def unresolved(self, version, first=0, last=None):
+        """[first, last] 内无法按结果划分的区间：跨越多个/96的Teredo地址"""
+        last = _max_address(version) if last is None else last
+        if version == 4 or not self._reader.has_ipv6:
+            return []
+        teredo = self._teredo(first, last)
+        if teredo is None or teredo[0] >> 32 == teredo[1] >> 32:
+            return []
+        return [teredo]
+
+    def _teredo_ranges(self, low, high):
+        """同一个/96内的Teredo地址按对应的IPv4区间划分，最后32位取反后地址顺序相反"""
+        base = low & ~MAX_IPV4
+        v4_ranges = list(self._v4_ranges(MAX_IPV4 - (high & MAX_IPV4), MAX_IPV4 - (low & MAX_IPV4)))
+        for v4_first, v4_last in reversed(v4_ranges):
+            yield base | (MAX_IPV4 - v4_last), base | (MAX_IPV4 - v4_first)
+
+    def ranges(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的区间，unresolved() 给出的区间整体返回"""
+        last = _max_address(version) if last is None else last
+        if version == 4:
+            yield from self._v4_ranges(first, last)
+            return
+        if not self._reader.has_ipv6:
+            # 只含IPv4数据的BIN文件对所有IPv6地址返回相同的提示
+            yield first, last
+            return
+        streams = [self._reader.iter_ranges(6, first, last)]
+        for base, shift, host in _IP2LOCATION_ALIASES:
+            low = max(first, base)
+            high = min(last, base | (MAX_IPV4 << shift) | host)
+            if low > high:
+                continue
+            v4_ranges = self._v4_ranges((low - base) >> shift, (high - base) >> shift)
+            streams.append(_alias_ranges(v4_ranges, base, shift, host))
+        teredo = self._teredo(first, last)
+        if teredo is not None:
+            if self.unresolved(6, first, last):
+                streams.append([teredo])
+            else:
+                streams.append(self._teredo_ranges(*teredo))
+        yield from partition(streams, 6, first, last)
+
+    def records(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的 (起始地址, 结束地址, 行数据)"""
+        reader = self._reader
+        for low, high in self.ranges(version, first, last):
+            if version == 4:
+                ipv, ipnum = 4, low
+            elif not reader.has_ipv6:
+                yield low, high, None
+                continue
+            else:
+                ipv, ipnum = reader.parse_address(str(ipaddress.IPv6Address(low)))
+            found = reader.find_row(ipv, ipnum)
+            yield low, high, None if found is None else reader.row_data(ipv, found[0])
+
+    def decode(self, data):
+        return self._reader.decode_row_data(data)
+
+    def close(self):
+        self._reader.close()
+
+
+class XdbRanges:
+    """ip2region xdb段索引的区间索引"""
+
+    def __init__(self, filename):
+        self._xdb = XdbFile(filename)
+
+    def _segments(self, first, last):
+        """与 [first, last] 相交的段，返回 (起始地址, 结束地址, (区域字符串长度, 位置))"""
+        xdb = self._xdb
+        # 二分查找第一个结束地址不小于first的段
+        low, high = 0, xdb.count
+        while low < high:
+            mid = (low + high) // 2
+            if xdb.segment(mid)[1] < first:
+                low = mid + 1
+            else:
+                high = mid
+        for i in range(low, xdb.count):
+            start, end, length, ptr = xdb.segment(i)
+            if start > last:
+                break
+            yield max(start, first), min(end, last), (length, ptr)
+
+    def ranges(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的区间，段之间没有数据的空隙不返回"""
+        last = _max_address(version) if last is None else last
+        if self._xdb.ip_version != version:
+            # 版本不符时查询报错，整个地址空间结果相同
+            yield first, last
+            return
+        for low, high, _ in self._segments(first, last):
+            yield low, high
+
+    def records(self, version, first=0, last=None):
+        """按地址顺序返回 [first, last] 内的 (起始地址, 结束地址, (区域字符串长度, 位置))，空隙的记录为None"""
+        last = _max_address(version) if last is None else last
+        if self._xdb.ip_version != version:
+            yield first, last, None
+            return
+        position = first
+        for low, high, region in self._segments(first, last):
+            if position < low:
+                yield position, low - 1, None
+            yield low, high, region
+            position = high + 1
+        if position <= last:
+            yield position, last, None
+
+    def decode(self, region):
+        return self._xdb.region(*region)
+
+    def close(self):
+        self._xdb.close()
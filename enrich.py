@@ -0,0 +1,197 @@
+"""命令行批量查询
+
+    python app.py enrich ips.txt --format csv -o ips.csv
+    cat ips.txt | python app.py enrich - --format ndjson --providers ip2region --fields country,city
+
+从文件或标准输入逐行读取IP，按块分给fork出的进程池查询，子进程直接继承父进程已打开的IP库。
+同时在途的块数有上限，各块按输入顺序写出，内存占用只与块大小和进程数有关，与输入行数无关。
+"""
+import argparse
+import csv
+import io
+import ipaddress
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # 只有parquet输出需要pyarrow
+    pa = pq = None
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+
+# 当前任务，在fork之前设置，子进程通过继承拿到
+_job = None
+
+
+class EnrichJob:
+    """一次批量查询的参数和输出格式"""
+
+    def __init__(self, lookup, providers, fields, columns, output_format):
+        self.lookup = lookup
+        self.providers = providers
+        self.fields = fields
+        # [(数据源, (字段, ...)), ...]，决定CSV和parquet的列
+        self.columns = columns
+        self.output_format = output_format
+
+    def header(self):
+        names = ['ip', 'error']
+        for provider, fields in self.columns:
+            names.extend(f'{provider}_{field}' for field in fields + ('error',))
+        return names
+
+    def _items(self, lines):
+        """一块输入整体交给 lookup_items 批量查询，结果与输入的行一一对应（不去重）"""
+        parsed = []
+        for line in lines:
+            raw = line.strip()
+            if not raw:
+                continue
+            try:
+                parsed.append((raw, str(ipaddress.ip_address(raw))))
+            except ValueError:
+                parsed.append((raw, None))
+        return self.lookup(parsed, self.providers, self.fields)
+
+    def _flatten(self, item):
+        row = [item['ip'], item.get('error')]
+        for provider, fields in self.columns:
+            result = item.get(provider, {})
+            for field in fields + ('error',):
+                value = result.get(field)
+                row.append(None if value is None else str(value))
+        return row
+
+    def run(self, lines):
+        """查询一块输入，返回 (IP数, 输出内容)：文本格式为字符串，parquet为按列组织的列表"""
+        items = self._items(lines)
+        if self.output_format == 'ndjson':
+            return len(items), ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items)
+        rows = [self._flatten(item) for item in items]
+        if self.output_format == 'csv':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            return len(items), buffer.getvalue()
+        return len(items), [list(column) for column in zip(*rows)]
+
+
+def _run_chunk(lines):
+    return _job.run(lines)
+
+
+def _chunks(stream, size):
+    while True:
+        chunk = list(islice(stream, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bounded_imap(pool, chunks, max_pending):
+    """按顺序返回各块结果；与Pool.imap不同，最多只读入max_pending块输入"""
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(_run_chunk, (chunk,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class _ParquetOutput:
+    def __init__(self, path, header):
+        self.schema = pa.schema([(name, pa.string()) for name in header])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, columns):
+        if columns:
+            self.writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(column, pa.string()) for column in columns], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def main(argv, app):
+    """命令行入口，app为已经加载好IP库的app模块"""
+    global _job
+    parser = argparse.ArgumentParser(prog='app.py enrich', description='批量查询文件中的IP')
+    parser.add_argument('input', help='输入文件，每行一个IP，- 表示标准输入')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='输出格式，默认ndjson')
+    parser.add_argument('-o', '--output', help='输出文件，默认标准输出（parquet必须指定）')
+    parser.add_argument('--providers', help='只查询这些IP库，逗号分隔')
+    parser.add_argument('--fields', help='只返回这些字段，逗号分隔')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='进程数，默认为CPU核数')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='每块的行数，默认5000')
+    parser.add_argument('--progress-interval', type=float, default=5, help='进度输出间隔（秒），0表示不输出')
+    args = parser.parse_args(argv)
+
+    try:
+        providers, fields = app.parse_selection(args.providers, args.fields)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.format == 'parquet':
+        if pq is None:
+            parser.error('parquet输出需要安装pyarrow')
+        if not args.output:
+            parser.error('parquet输出必须用 -o 指定文件')
+    workers = max(1, args.workers)
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        print("fork is not available on this platform, running in a single process", file=sys.stderr)
+        workers = 1
+
+    columns = app.result_columns(providers, fields)
+    _job = EnrichJob(app.lookup_items, providers, fields, columns, args.format)
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', errors='replace')
+    if args.format == 'parquet':
+        output = _ParquetOutput(args.output, _job.header())
+    else:
+        output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+        if args.format == 'csv':
+            csv.writer(output).writerow(_job.header())
+
+    pool = None
+    started = last_report = time.monotonic()
+    # 在fork之前打开用到的IP库，子进程直接继承，不用各自打开
+    app.open_readers(providers, fields)
+    total = 0
+    try:
+        chunks = _chunks(source, args.chunk_size)
+        if workers > 1:
+            # 子进程继承已打开的IP库，只重新打开按文件偏移读取的读取器
+            pool = multiprocessing.get_context('fork').Pool(workers, initializer=app.reopen_file_readers)
+            results = _bounded_imap(pool, chunks, workers * 2)
+        else:
+            results = map(_run_chunk, chunks)
+        for count, payload in results:
+            output.write(payload)
+            total += count
+            now = time.monotonic()
+            if args.progress_interval and now - last_report >= args.progress_interval:
+                last_report = now
+                print(f"{total} IPs, {total / (now - started):.0f} IP/s", file=sys.stderr)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        else:
+            output.flush()
+    elapsed = time.monotonic() - started
+    print(f"✓ enriched {total} IPs in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} IP/s, "
+          f"{workers} workers)", file=sys.stderr)
+    return 0
@@ -0,0 +1,486 @@
+"""IP库读取器的分代管理，用于不停机热加载
+
+每次加载得到一代读取器（ReaderGeneration）。新一代在后台打开并预热后原子地替换当前代，
+旧的一代等到替换前开始的请求全部结束后再关闭。
+"""
+import glob
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# 同时打开IP库的线程数
+OPEN_THREADS = 8
+
+# 多个线程同时打开IP库时，各自的报告逐行输出，不混在一行中
+_report_lock = threading.Lock()
+
+
+def resolve_db_paths(patterns):
+    """把DB_PATH中的路径解析为实际文件，带通配符时取排序最后（即日期最新）的文件"""
+    paths = {}
+    for key, pattern in patterns.items():
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            paths[key] = matches[-1] if matches else pattern
+        else:
+            paths[key] = pattern
+    return paths
+
+
+def file_signature(path):
+    """(修改时间, 大小, inode)；用新文件替换（重命名）时inode改变，原地改写时inode不变"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+
+# 通过文件描述符重新打开已被替换的文件，不支持时为None
+_FD_DIR = next((path for path in ('/proc/self/fd', '/dev/fd') if os.path.isdir(path)), None)
+
+
+def _hold_file(path):
+    """只读打开文件，返回 (文件描述符, 签名)；文件被替换后仍能通过描述符读到这个版本，打不开时描述符为None"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None, file_signature(path)
+    st = os.fstat(fd)
+    return fd, (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _close_quietly(reader):
+    close = getattr(reader, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        print(f"Error closing reader: {e}")
+
+
+class _ThreadHandles(dict):
+    """一个线程另外打开的读取器，线程结束时随线程局部数据一起释放"""
+
+
+def _thread_exit(pool_ref, opened):
+    pool = pool_ref()
+    for reader in opened:
+        if pool is not None and pool._forget(reader):
+            _close_quietly(reader)
+
+
+# 已登记但还没有打开的读取器
+_NOT_OPENED = object()
+
+
+class ReaderPool(dict):
+    """一代读取器，第一次按名称取读取器时才打开，有状态的读取器每个线程各用一个
+
+    add() 登记的读取器在第一次使用时打开并预热，也可以用 open_all() 在多个线程中同时打开全部读取器；
+    打开失败的读取器从本代中移除，错误记入errors。
+    ip2region的file/vectorIndex模式和ip2location官方库通过seek+read读文件，同一个对象在多个线程中
+    同时查询会读到错误的数据。stateful的读取器，每个线程第一次使用时用opener另外打开一个，
+    线程结束或整代关闭时关闭；其余读取器（mmap或全部读入内存）所有线程共享，不加锁。
+    values()/items() 返回的是登记时的对象（未打开的为占位对象），只用于关闭。
+    """
+
+    def __init__(self, errors=None, on_open=None, signatures=None):
+        super().__init__()
+        # on_open(名称, 耗时秒数, 异常或None) 在每个读取器打开后调用
+        self.errors = {} if errors is None else errors
+        # 读取器名称 -> 本代打开的文件的签名
+        self.signatures = {} if signatures is None else signatures
+        self.open_seconds = {}
+        self._on_open = on_open
+        self._lazy = {}
+        self._openers = {}
+        self._local = threading.local()
+        self._opened = set()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._background_pid = None
+        # 按记录位置缓存的查询结果（见 app._memoized），记录位置只在本代的文件中有效
+        self.records = {}
+        # 命名空间 -> 在多进程共享缓存中的标记（见 app._shared_tag），由本代文件的签名得出
+        self.shared_tags = {}
+
+    def add(self, key, opener, stateful=False, warm=None):
+        """登记读取器：opener() 打开读取器，warm(reader) 在打开后预热"""
+        dict.__setitem__(self, key, _NOT_OPENED)
+        self._lazy[key] = (opener, warm)
+        if stateful:
+            self._openers[key] = opener
+
+    def open(self, key):
+        """打开登记的读取器并返回，已打开时直接返回；同一读取器同时只有一个线程在打开"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            reader = dict.get(self, key, _NOT_OPENED)
+            if reader is not _NOT_OPENED:
+                return reader
+            if key not in self:
+                raise KeyError(key)
+            opener, warm = self._lazy[key]
+            started = time.perf_counter()
+            try:
+                reader = opener()
+                if warm is not None:
+                    warm(reader)
+            except Exception as e:
+                dict.__delitem__(self, key)
+                self._openers.pop(key, None)
+                self.errors[key] = str(e)
+                if self._on_open is not None:
+                    self._on_open(key, time.perf_counter() - started, e)
+                raise
+            self.open_seconds[key] = time.perf_counter() - started
+            dict.__setitem__(self, key, reader)
+        if self._on_open is not None:
+            self._on_open(key, self.open_seconds[key], None)
+        return reader
+
+    def pending(self):
+        """还没有打开的读取器名称"""
+        return [key for key, reader in list(dict.items(self)) if reader is _NOT_OPENED]
+
+    def open_all(self, keys=None):
+        """在多个线程中同时打开keys（默认全部）中还没有打开的读取器，等待全部完成
+
+        各IP库互相独立，读文件和mmap时不占用GIL，同时打开比依次打开快；失败的读取器记入errors。
+        """
+        pending = self.pending()
+        keys = pending if keys is None else [key for key in keys if key in pending]
+        if not keys:
+            return
+
+        def open_quietly(key):
+            try:
+                self.open(key)
+            except Exception:
+                pass
+
+        if len(keys) == 1:
+            open_quietly(keys[0])
+            return
+        with ThreadPoolExecutor(min(OPEN_THREADS, len(keys)), thread_name_prefix='ip-db-open') as pool:
+            list(pool.map(open_quietly, keys))
+
+    def open_in_background(self):
+        """启动后台线程打开全部读取器，请求先用到的读取器由请求线程打开；每个进程只启动一次"""
+        if self._background_pid == os.getpid():
+            return None
+        with self._lock:
+            if self._background_pid == os.getpid() or not self.pending():
+                return None
+            self._background_pid = os.getpid()
+        thread = threading.Thread(target=self.open_all, name='ip-db-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def __getitem__(self, key):
+        reader = dict.__getitem__(self, key)
+        if reader is _NOT_OPENED:
+            reader = self.open(key)
+        opener = self._openers.get(key)
+        if opener is None:
+            return reader
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = _ThreadHandles()
+            handles.opened = []
+            weakref.finalize(handles, _thread_exit, weakref.ref(self), handles.opened)
+        reader = handles.get(key)
+        if reader is None:
+            reader = handles[key] = opener()
+            handles.opened.append(reader)
+            with self._lock:
+                self._opened.add(reader)
+        return reader
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def _forget(self, reader):
+        with self._lock:
+            if reader not in self._opened:
+                return False
+            self._opened.discard(reader)
+            return True
+
+    def _drop_thread_handles(self):
+        with self._lock:
+            opened, self._opened = self._opened, set()
+            old_local, self._local = self._local, threading.local()
+        # 旧的线程局部数据在锁外释放，其中的finalize回调需要获取锁
+        del old_local
+        for reader in opened:
+            _close_quietly(reader)
+
+    def reopen(self):
+        """重新打开全部已打开的有状态读取器，fork之后在子进程中调用，不再与父进程共用文件偏移"""
+        # fork时其他线程可能正持有锁，子进程中重新创建
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._drop_thread_handles()
+        for key, opener in self._openers.items():
+            old = dict.__getitem__(self, key)
+            if old is _NOT_OPENED:
+                continue
+            dict.__setitem__(self, key, opener())
+            _close_quietly(old)
+
+    def close(self):
+        self._drop_thread_handles()
+        for reader in self.values():
+            if reader is not _NOT_OPENED:
+                _close_quietly(reader)
+
+
+class ReaderGeneration:
+    """同一次加载打开的一组读取器"""
+
+    def __init__(self, number, paths):
+        self.number = number
+        self.paths = dict(paths)
+        # 登记时就打开各文件并保留描述符，lazy模式下还没有打开读取器时文件被替换，也能读到本代的版本
+        self._files = {}
+        self.signatures = {}
+        for key, path in self.paths.items():
+            self._files[key], self.signatures[key] = _hold_file(path)
+        self.errors = {}
+        self.readers = ReaderPool(self.errors, self._report_open, self.signatures)
+        self.loaded_at = None
+        self.load_seconds = None
+        # 与上一代相比发生变化的读取器 -> {IP版本: 记录变化的区间}，热加载时按此清除缓存
+        self.diffs = {}
+        self.closed = False
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def _size(self, key):
+        signature = self.signatures.get(key)
+        return signature[1] if signature is not None else None
+
+    def _report_open(self, key, seconds, error):
+        size = self._size(key)
+        size = f"{size / 1048576:.1f}MB" if size is not None else "-"
+        with _report_lock:
+            if error is not None:
+                print(f"Error opening {key} from {self.paths.get(key)}: {error}")
+            else:
+                print(f"✓ {key} opened in {seconds * 1000:.0f}ms ({size}, generation {self.number})")
+
+    def databases(self):
+        """各IP库的文件大小和打开耗时，还没有打开的耗时为None"""
+        return {key: {
+            'path': path,
+            'size': self._size(key),
+            'open_seconds': round(self.readers.open_seconds[key], 4) if key in self.readers.open_seconds else None,
+            'error': self.errors.get(key),
+        } for key, path in self.paths.items()}
+
+    def info(self):
+        return {
+            'generation': self.number,
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.loaded_at)) if self.loaded_at else None,
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'readers': sorted(self.readers),
+            'pending': sorted(self.readers.pending()),
+            'paths': self.paths,
+            'databases': self.databases(),
+            'changed_ranges': {key: {str(version): len(ranges) for version, ranges in diff.items()}
+                               for key, diff in self.diffs.items()},
+            'errors': self.errors,
+        }
+
+    def changed_keys(self, other):
+        """与另一代相比，文件路径或内容发生变化的读取器名称"""
+        keys = set(self.paths) | set(other.paths)
+        return {key for key in keys
+                if self.paths.get(key) != other.paths.get(key)
+                or self.signatures.get(key) != other.signatures.get(key)}
+
+    def derived(self, key, factory):
+        """按需建立并缓存由本代IP库派生的对象（例如批量查询用的数组），随本代一起关闭"""
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = factory()
+            return self._derived[key]
+
+    def has_derived(self, key):
+        return key in self._derived
+
+    def modified_in_place(self, key):
+        """key 对应的文件在本代加载之后被原地改写（inode不变而内容变化），本代的版本已经读不到"""
+        signature = self.signatures.get(key)
+        current = file_signature(self.paths[key])
+        return signature is not None and current is not None and current != signature and current[2] == signature[2]
+
+    def source_path(self, key):
+        """能读到本代加载时 key 对应文件内容的路径
+
+        文件没有变化时为原路径；被替换（重命名或删除）后为登记时保留的文件描述符的路径，
+        原地改写或没有保留描述符时返回None。
+        """
+        path = self.paths[key]
+        if file_signature(path) == self.signatures.get(key):
+            return path
+        fd = self._files.get(key)
+        if fd is None or _FD_DIR is None or self.modified_in_place(key):
+            return None
+        return os.path.join(_FD_DIR, str(fd))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.readers.close()
+        for obj in self._derived.values():
+            _close_quietly(obj)
+        for fd in self._files.values():
+            if fd is not None:
+                os.close(fd)
+        self._files = {}
+
+
+class GenerationManager:
+    """管理当前代和等待关闭的旧代
+
+    请求开始时 acquire() 取得当前代，结束时 release()。被替换的旧代在没有任何
+    持有它或更早代的请求时关闭：请求在替换后读到的可能是更新的一代读取器，
+    因此只要还有更早开始的请求，之后被替换的代也不能关闭。
+    """
+
+    def __init__(self, loader, on_swap=None):
+        # loader(number, paths) 打开并预热一代读取器，返回ReaderGeneration
+        self._loader = loader
+        self._on_swap = on_swap
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._active = Counter()
+        self._retired = []
+        self._next_number = 1
+        self.current = None
+        self.last_error = None
+        self.reloading = False
+        self._watcher_pid = None
+
+    def acquire(self):
+        with self._lock:
+            gen = self.current
+            self._active[gen.number] += 1
+            return gen
+
+    def release(self, gen):
+        with self._lock:
+            self._active[gen.number] -= 1
+            if not self._active[gen.number]:
+                del self._active[gen.number]
+            drained = self._collect_drained()
+        for old in drained:
+            old.close()
+
+    def _collect_drained(self):
+        oldest_active = min(self._active) if self._active else None
+        drained = [g for g in self._retired if oldest_active is None or g.number < oldest_active]
+        self._retired = [g for g in self._retired if g not in drained]
+        return drained
+
+    def status(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'current': self.current.info() if self.current is not None else None,
+                'reloading': self.reloading,
+                'last_error': self.last_error,
+                'retired': [g.number for g in self._retired],
+                'in_flight': {str(number): count for number, count in sorted(self._active.items())},
+            }
+
+    def load(self, patterns):
+        """同步加载新的一代并替换当前代，同一时间只进行一次加载"""
+        with self._reload_lock:
+            self.reloading = True
+            try:
+                number = self._next_number
+                self._next_number += 1
+                gen = self._loader(number, resolve_db_paths(patterns))
+                current = self.current
+                missing = set(current.readers) - set(gen.readers) if current is not None else set()
+                if missing:
+                    # 文件可能正在被替换，保留当前代，等下一次加载
+                    gen.close()
+                    raise RuntimeError(f'新加载的IP库缺少读取器: {", ".join(sorted(missing))}，'
+                                       f'继续使用第{current.number}代')
+                self.swap(gen)
+                self.last_error = None
+                return gen
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                self.reloading = False
+
+    def reload_async(self, patterns):
+        """在后台线程中加载新的一代，已有加载在进行时直接返回False"""
+        if self.reloading:
+            return False
+
+        def run():
+            try:
+                self.load(patterns)
+            except Exception as e:
+                print(f"Error reloading IP databases: {e}")
+
+        threading.Thread(target=run, name='ip-db-reload', daemon=True).start()
+        return True
+
+    def swap(self, gen):
+        with self._lock:
+            old = self.current
+            # 先让on_swap切换全局读取器，再发布新一代：取得新一代的请求不会读到旧读取器
+            if self._on_swap is not None:
+                self._on_swap(gen, old)
+            self.current = gen
+            if old is not None:
+                self._retired.append(old)
+            drained = self._collect_drained()
+        for old_gen in drained:
+            old_gen.close()
+
+    def needs_reload(self, patterns):
+        """磁盘上的文件（包括通配符匹配到的新文件）与当前代不一致时返回True"""
+        gen = self.current
+        paths = resolve_db_paths(patterns)
+        return any(paths[key] != gen.paths.get(key) or file_signature(paths[key]) != gen.signatures.get(key)
+                   for key in paths)
+
+    def start_watcher(self, patterns, interval):
+        """启动后台线程，每隔interval秒检查IP库文件，发生变化时重新加载
+
+        每个进程只启动一次；fork出的子进程没有父进程的线程，会各自启动。
+        """
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return None
+            self._watcher_pid = os.getpid()
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.needs_reload(patterns):
+                        print("IP database files changed, reloading")
+                        self.load(patterns)
+                except Exception as e:
+                    print(f"Error reloading IP databases: {e}")
+
+        thread = threading.Thread(target=watch, name='ip-db-watcher', daemon=True)
+        thread.start()
+        return thread
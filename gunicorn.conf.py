@@ -0,0 +1,40 @@
+"""gunicorn预加载部署配置
+
+    gunicorn -c gunicorn.conf.py app:app
+
+主进程导入app时打开全部IP库，worker由fork得到，直接共享主进程中的读取器：
+mmap方式打开的库（maxminddb、常驻内存的ip2location、content模式的ip2region、合并库）共享页缓存，
+整个读入内存的ipipfree/qqwry按写时复制共享。按文件偏移读取的读取器在fork后重新打开。
+增加worker时常驻内存基本不变。
+
+worker中的热加载（自动检查、管理接口）只作用于各自的进程，新一代读取器不再与其他worker共享；
+更新IP库后可以用 kill -USR2 重新启动主进程，让所有worker重新共享同一份数据。
+"""
+import gc
+import multiprocessing
+import os
+
+# ip2region使用mmap方式，fork后不需要重新打开，并且多个worker共享同一份页缓存
+os.environ.setdefault('IP2REGION_CACHE_POLICY', 'content')
+# 主进程在fork之前打开全部IP库，worker直接共享，不各自打开
+os.environ.setdefault('IP_DB_OPEN', 'eager')
+# 各worker共用的结果缓存（MB），一个worker查到的结果其他worker直接命中
+os.environ.setdefault('IP_SHARED_CACHE_MB', '64')
+
+bind = os.environ.get('IP_BIND', '0.0.0.0:5002')
+workers = int(os.environ.get('IP_WORKERS', multiprocessing.cpu_count()))
+preload_app = True
+
+# 加载期间不做垃圾回收，避免在已分配的内存页中间留下空洞
+gc.disable()
+
+
+def when_ready(server):
+    # 加载完成后把现有对象移出垃圾回收的范围，worker中的回收不会写这些对象所在的页面，写时复制共享的页面得以保留
+    gc.freeze()
+    gc.enable()
+
+
+def post_fork(server, worker):
+    from app import reopen_file_readers
+    reopen_file_readers()
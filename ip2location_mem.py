@@ -0,0 +1,296 @@
+"""常驻内存的IP2Location BIN读取器
+
+官方 IP2Location 库每次查询都通过文件IO做二分查找并解码所有列。这里把BIN文件mmap到内存，
+加载时建立按地址前16位划分的跳转表，IPv4的起始地址列直接作为memoryview交给bisect（C实现），
+并且只解码调用方需要的列。查询结果与官方库 get_all() 的对应字段一致。
+"""
+import mmap
+import socket
+import struct
+import sys
+from bisect import bisect_right
+
+# 各字段在不同DB类型中的列位置（与官方库一致，0表示该类型不提供此字段）
+_COLUMN_POSITION = {
+    'country': (0, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2),
+    'region': (0, 0, 0, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3),
+    'city': (0, 0, 0, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4),
+    'latitude': (0, 0, 0, 0, 0, 5, 5, 0, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5),
+    'longitude': (0, 0, 0, 0, 0, 6, 6, 0, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6),
+    'zipcode': (0, 0, 0, 0, 0, 0, 0, 0, 0, 7, 7, 7, 7, 0, 7, 7, 7, 0, 7, 0, 7, 7, 7, 0, 7, 7, 7),
+    'isp': (0, 0, 3, 0, 5, 0, 7, 5, 7, 0, 8, 0, 9, 0, 9, 0, 9, 0, 9, 7, 9, 0, 9, 7, 9, 9, 9),
+    'domain': (0, 0, 0, 0, 0, 0, 0, 6, 8, 0, 9, 0, 10, 0, 10, 0, 10, 0, 10, 8, 10, 0, 10, 8, 10, 10, 10),
+}
+
+# 官方库对当前DB类型不提供的字段返回的占位文本
+UNAVAILABLE = 'This parameter is unavailable in selected .BIN data file. Please upgrade data file.'
+IPV6_MISSING = 'IPV6 ADDRESS MISSING IN IPV4 BIN'
+INVALID_ADDRESS = 'INVALID IP ADDRESS'
+
+MAX_IPV4 = (1 << 32) - 1
+MAX_IPV6 = (1 << 128) - 1
+
+# 按其中的IPv4地址查询的IPv6地址块 (起始地址, 结束地址)：IPv4映射 ::ffff:0:0/96、Teredo 2001::/32、6to4 2002::/16
+IPV4_ALIAS_BLOCKS = (
+    (0xffff << 32, (0xffff << 32) | MAX_IPV4),
+    (0x20010000 << 96, (0x20010000 << 96) | ((1 << 96) - 1)),
+    (0x2002 << 112, (0x2002 << 112) | ((1 << 112) - 1)),
+)
+
+
+def exclude_alias_blocks(ipnum, first, last):
+    """把包含IPv6地址ipnum的行区间 [first, last] 缩小到不含IPv4别名地址块的部分
+
+    IPv6行的区间可能跨过这些地址块，块中的地址按IPv4行查询，结果与该行不同。
+    """
+    for block_first, block_last in IPV4_ALIAS_BLOCKS:
+        if block_first <= last and first <= block_last:
+            if block_last < ipnum:
+                first = block_last + 1
+            else:
+                last = block_first - 1
+    return first, last
+
+
+class IP2LocationRow:
+    """一条IP2Location记录，只有被请求的列有值"""
+
+    __slots__ = ('country_short', 'country_long', 'region', 'city', 'latitude', 'longitude',
+                 'zipcode', 'isp', 'domain')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class MemoryIP2Location:
+    """mmap方式打开的IP2Location BIN文件，多个进程打开同一文件时共享页缓存"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._mm[0:32]
+        (self._dbtype, self._dbcolumn, self._dbyear, _, _,
+         self._ipv4count, self._ipv4addr, self._ipv6count, self._ipv6addr,
+         self._ipv4indexaddr, self._ipv6indexaddr,
+         productcode, _, _) = struct.unpack('<BBBBBIIIIIIBBB', header)
+        if productcode != 1 and self._dbyear > 20 and productcode != 0:
+            self._mm.close()
+            raise ValueError('Incorrect IP2Location BIN file format. '
+                             'Please make sure that you are using the latest IP2Location BIN file.')
+        self._v4_width = self._dbcolumn * 4
+        self._v6_width = self._dbcolumn * 4 + 12
+        self._views = []
+        self._v4_starts = self._column_view(self._ipv4addr, self._ipv4count + 1, self._dbcolumn)
+        self._v4_jump = self._jump_table(self._ipv4indexaddr, self._ipv4count, 4)
+        self._v6_jump = self._jump_table(self._ipv6indexaddr, self._ipv6count, 6) if self._ipv6count else None
+
+    def _column_view(self, baseaddr, rows, stride):
+        """把每行开头的起始地址列视为一个uint32序列，不复制数据"""
+        start = baseaddr - 1
+        end = min(start + rows * stride * 4, len(self._mm)) // 4 * 4
+        if sys.byteorder != 'little':
+            # BIN文件为小端序，在大端机器上只能复制一份并转换字节序
+            from array import array
+            column = array('I', self._mm[start:end])
+            column.byteswap()
+            return column[::stride]
+        raw = memoryview(self._mm)[start:end]
+        words = raw.cast('I')
+        column = words[::stride]
+        self._views.extend([raw, words, column])
+        return column
+
+    def _jump_table(self, indexaddr, count, ipv):
+        """按地址前16位划分的 [low, high] 行号表；文件没有索引时在加载时自行建立"""
+        if indexaddr > 0:
+            raw = self._mm[indexaddr - 1:indexaddr - 1 + 65536 * 8]
+            pairs = struct.unpack('<131072I', raw)
+            return pairs[0::2], pairs[1::2]
+        shift = 16 if ipv == 4 else 112
+        lows, highs = [], []
+        row = 0
+        for key in range(65536):
+            first = key << shift
+            last = ((key + 1) << shift) - 1
+            while row < count and self._row_start(row + 1, ipv) <= first:
+                row += 1
+            end = row
+            while end < count and self._row_start(end + 1, ipv) <= last:
+                end += 1
+            lows.append(row)
+            highs.append(end)
+        return lows, highs
+
+    def _row_start(self, row, ipv):
+        if ipv == 4:
+            return self._v4_starts[row]
+        off = self._ipv6addr - 1 + row * self._v6_width
+        return int.from_bytes(self._mm[off:off + 16], 'little')
+
+    @staticmethod
+    def parse_address(addr):
+        """与官方库相同的地址解析：IPv4映射、6to4和Teredo地址按IPv4查询
+
+        返回 (版本, 整数地址)，无效地址返回 (0, -1)。
+        """
+        if ':' in addr:
+            try:
+                hi, lo = struct.unpack('!QQ', socket.inet_pton(socket.AF_INET6, addr))
+            except (OSError, ValueError):
+                return 0, -1
+            ipnum = (hi << 64) | lo
+            if 42545680458834377588178886921629466624 <= ipnum <= 42550872755692912415807417417958686719:
+                return 4, (ipnum >> 80) % 4294967296
+            if 42540488161975842760550356425300246528 <= ipnum <= 42540488241204005274814694018844196863:
+                return 4, (~ipnum) % 4294967296
+            if 281470681743360 <= ipnum <= 281474976710655:
+                return 4, ipnum - 281470681743360
+            return 6, ipnum
+        # 与官方库一样只接受四段十进制（inet_pton），"127.1"、"01.2.3.4" 这类inet_aton能解析的写法视为无效
+        try:
+            return 4, struct.unpack('!L', socket.inet_pton(socket.AF_INET, addr))[0]
+        except (OSError, ValueError):
+            return 0, -1
+
+    def find_row(self, ipv, ipnum):
+        """返回 (行号, 起始地址, 结束地址)，未找到返回None"""
+        if ipv == 4:
+            ipno = ipnum - 1 if ipnum == MAX_IPV4 else ipnum
+            lows, highs = self._v4_jump
+            key = ipno >> 16
+            low, high = lows[key], highs[key]
+            row = bisect_right(self._v4_starts, ipno, low, high + 1) - 1
+            if row < low:
+                return None
+            ip_to = self._v4_starts[row + 1] if row + 1 < len(self._v4_starts) else MAX_IPV4 + 1
+            if ipno < ip_to:
+                return row, self._v4_starts[row], ip_to - 1
+            return None
+
+        ipno = ipnum - 1 if ipnum == MAX_IPV6 else ipnum
+        lows, highs = self._v6_jump
+        key = ipno >> 112
+        low, high = lows[key], highs[key]
+        mm = self._mm
+        base = self._ipv6addr - 1
+        width = self._v6_width
+        while low <= high:
+            mid = (low + high) >> 1
+            off = base + mid * width
+            ip_from = int.from_bytes(mm[off:off + 16], 'little')
+            if ipno < ip_from:
+                high = mid - 1
+                continue
+            ip_to = int.from_bytes(mm[off + width:off + width + 16], 'little')
+            if ipno < ip_to:
+                return mid, ip_from, ip_to - 1
+            low = mid + 1
+        return None
+
+    @property
+    def has_ipv6(self):
+        return bool(self._ipv6count)
+
+    def iter_ranges(self, ipv, first=0, last=None):
+        """按地址顺序返回ipv对应部分与 [first, last] 相交的各行的 (起始地址, 结束地址)"""
+        count = self._ipv4count if ipv == 4 else self._ipv6count
+        if not count:
+            return
+        start = 0
+        if first:
+            found = self.find_row(ipv, first)
+            if found is not None:
+                start = found[0]
+        ip_from = self._row_start(start, ipv)
+        for row in range(start + 1, count + 1):
+            if last is not None and ip_from > last:
+                return
+            ip_to = self._row_start(row, ipv)
+            yield ip_from, ip_to - 1
+            ip_from = ip_to
+
+    def _read_string(self, offset):
+        length = self._mm[offset]
+        return self._mm[offset + 1:offset + 1 + length].decode('iso-8859-1')
+
+    def _row_offset(self, ipv, row):
+        """行中第1列所在的位置，第n列在其后 (n-1)*4 字节处；IPv6的起始地址占16字节，按第1列之前多12字节计算"""
+        if ipv == 4:
+            return self._ipv4addr - 1 + row * self._v4_width
+        return self._ipv6addr - 1 + row * self._v6_width + 12
+
+    def _read_row(self, ipv, row, columns):
+        return self._decode_columns(self._mm, self._row_offset(ipv, row), columns)
+
+    def _decode_columns(self, data, row_off, columns):
+        rec = IP2LocationRow()
+        dbtype = self._dbtype
+        for column in columns:
+            position = _COLUMN_POSITION[column][dbtype]
+            if position == 0:
+                value = UNAVAILABLE
+                if column == 'country':
+                    continue
+            else:
+                off = row_off + (position - 1) * 4
+                raw = data[off:off + 4]
+                if column in ('latitude', 'longitude'):
+                    value = format(round(struct.unpack('<f', raw)[0], 6), '.6f')
+                else:
+                    pointer = struct.unpack('<I', raw)[0]
+                    if column == 'country':
+                        rec.country_short = self._read_string(pointer)
+                        rec.country_long = self._read_string(pointer + 3)
+                        continue
+                    value = self._read_string(pointer)
+            setattr(rec, column, value)
+        return rec
+
+    def row_data(self, ipv, row):
+        """行中起始地址之后各列的原始字节（字符串指针和经纬度），同一文件中相同即记录相同"""
+        off = self._row_offset(ipv, row) + 4
+        return self._mm[off:off + (self._dbcolumn - 1) * 4]
+
+    def decode_row_data(self, data):
+        """把 row_data() 解码为全部列的值，用于比较不同文件中的记录"""
+        # data从第2列开始，相当于行偏移为-4
+        rec = self._decode_columns(data, -4, _COLUMN_POSITION)
+        return tuple(getattr(rec, name) for name in IP2LocationRow.__slots__)
+
+    @staticmethod
+    def _placeholder(columns, text):
+        rec = IP2LocationRow()
+        for column in columns:
+            if column == 'country':
+                rec.country_short = rec.country_long = text
+            else:
+                setattr(rec, column, text)
+        return rec
+
+    def lookup(self, addr, columns=('country', 'region', 'city', 'isp', 'domain', 'zipcode')):
+        """查询地址，只解码columns中的列
+
+        返回 (记录, 起始地址, 结束地址, 行所在的IP版本)，未找到返回None；区间内的地址都得到同样的记录，
+        IPv6行的区间不含按IPv4查询的地址块。与官方库一样，地址无效时各字段为 INVALID_ADDRESS（IP版本为0），
+        IPv6地址查询仅含IPv4数据的BIN文件时各字段为 IPV6_MISSING。
+        """
+        ipv, ipnum = self.parse_address(addr)
+        if ipv == 0:
+            return self._placeholder(columns, INVALID_ADDRESS), ipnum, ipnum, 0
+        if ipv == 6 and not self._ipv6count:
+            return self._placeholder(columns, IPV6_MISSING), ipnum, ipnum, 6
+        found = self.find_row(ipv, ipnum)
+        if found is None:
+            return None
+        row, first, last = found
+        if ipv == 6:
+            first, last = exclude_alias_blocks(ipnum, first, last)
+        return self._read_row(ipv, row, columns), first, last, ipv
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mm.close()
@@ -0,0 +1,68 @@
+"""按叶子节点查询的ipdb读取器
+
+ipdb 官方库每次查询都逐位读取搜索树，再解码整条记录、按制表符拆分并构造字典。这里在官方库读入内存的
+数据上自己查找搜索树，只返回记录所在的叶子节点和前缀长度，调用方按节点缓存由记录得到的结果；
+地址前16位对应的节点在第一次用到时记下。查找过程与官方库相同，解码仍由官方库完成。
+"""
+import ipaddress
+import socket
+
+from ipdb import City
+from ipdb.exceptions import IPNotFound, NoSupportIPv4Error, NoSupportIPv6Error
+
+
+class MemoryIpdb(City):
+    """ipdb.City，另外提供 find() 返回记录所在的叶子节点"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._data = self.db.data
+        self.node_count = self.db.get_meta_data().node_count
+        # 与官方库相同，IPv4地址从走过80个0和16个1之后的节点开始查找
+        node = 0
+        for i in range(96):
+            node = self._child(node, 1 if i >= 80 else 0)
+        self._ipv4_start = node
+        # (IP版本, 地址前16位) -> (节点, 已走过的位数)
+        self._jump = {}
+
+    def _child(self, node, bit):
+        off = node * 8 + bit * 4
+        return int.from_bytes(self._data[off:off + 4], 'big')
+
+    def _descend(self, node, depth, number, bits, stop):
+        """与官方库相同，遇到数据节点（大于node_count）时停止"""
+        data = self._data
+        node_count = self.node_count
+        while depth < stop and node <= node_count:
+            off = node * 8 + ((number >> (bits - 1 - depth)) & 1) * 4
+            node = int.from_bytes(data[off:off + 4], 'big')
+            depth += 1
+        return node, depth
+
+    def find(self, ip):
+        """查询地址，返回 (叶子节点, 前缀长度)，同一文件中节点相同即记录相同
+
+        地址无效、库不支持该IP版本或没有记录时与 find_map() 一样抛出异常。
+        """
+        try:
+            version, number = 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except OSError:
+            addr = ipaddress.ip_address(ip)
+            version, number = addr.version, int(addr)
+        if version == 6:
+            if not self.db.is_support_ipv6():
+                raise NoSupportIPv6Error('database is not support ipv6')
+            bits, start = 128, 0
+        else:
+            if not self.db.is_support_ipv4():
+                raise NoSupportIPv4Error('database is not support ipv4')
+            bits, start = 32, self._ipv4_start
+        key = (version, number >> (bits - 16))
+        jump = self._jump.get(key)
+        if jump is None:
+            jump = self._jump[key] = self._descend(start, 0, number, bits, 16)
+        node, depth = self._descend(*jump, number, bits, bits)
+        if node > self.node_count:
+            return node, depth
+        raise IPNotFound('ip not found')
@@ -0,0 +1,116 @@
+"""按数据位置查询的MMDB读取器
+
+maxminddb 每次查询都从数据区完整解码一条记录（GeoLite2-City的记录带有全部语言的名称），
+而大量网段共用同一条记录。这里把文件mmap到内存，自己在搜索树中查找，只返回记录在数据区的位置
+和前缀长度，调用方按位置缓存由记录得到的结果，同一条记录只解码一次。
+地址前16位对应的节点在第一次用到时记下，之后的查询从该节点继续。解码仍由 maxminddb 完成。
+"""
+import mmap
+import socket
+
+import maxminddb
+
+
+class MemoryMMDB:
+    """mmap方式打开的MMDB文件，get()/get_with_prefix_len()/metadata() 与 maxminddb 的读取器相同"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._reader = maxminddb.open_database(filename)
+        metadata = self._reader.metadata()
+        self.ip_version = metadata.ip_version
+        self.node_count = metadata.node_count
+        self.record_size = metadata.record_size
+        if self.record_size not in (24, 28, 32):
+            self._reader.close()
+            raise ValueError(f'不支持的MMDB记录长度: {self.record_size}')
+        self._node_bytes = self.record_size // 4
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # IPv6库中IPv4地址位于 ::/96，从走过96个0之后的节点开始查找
+        self._ipv4_start = (0, 0)
+        if self.ip_version == 6:
+            self._ipv4_start = self._descend(0, 0, 0, 96, 96)
+        # (IP版本, 地址前16位) -> (节点, 已走过的位数)
+        self._jump = {}
+
+    def _descend(self, node, depth, number, bits, stop):
+        """从depth位处的node开始，按number（共bits位）的各位向下走到stop位或叶子"""
+        mm = self._mm
+        node_count = self.node_count
+        size = self._node_bytes
+        if self.record_size == 32:
+            while depth < stop and node < node_count:
+                off = node * 8 + ((number >> (bits - 1 - depth)) & 1) * 4
+                node = int.from_bytes(mm[off:off + 4], 'big')
+                depth += 1
+        elif self.record_size == 24:
+            while depth < stop and node < node_count:
+                off = node * 6 + ((number >> (bits - 1 - depth)) & 1) * 3
+                node = int.from_bytes(mm[off:off + 3], 'big')
+                depth += 1
+        else:
+            # 28位记录：中间字节的高4位属于左记录，低4位属于右记录
+            while depth < stop and node < node_count:
+                off = node * size
+                if (number >> (bits - 1 - depth)) & 1:
+                    node = ((mm[off + 3] & 0x0F) << 24) | int.from_bytes(mm[off + 4:off + 7], 'big')
+                else:
+                    node = ((mm[off + 3] & 0xF0) << 20) | int.from_bytes(mm[off:off + 3], 'big')
+                depth += 1
+        return node, depth
+
+    @staticmethod
+    def _parse(ip):
+        """与 maxminddb 相同的地址解析，返回 (版本, 整数地址)"""
+        for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+            try:
+                return version, int.from_bytes(socket.inet_pton(family, ip), 'big')
+            except OSError:
+                pass
+        # maxminddb 用getaddrinfo解析，也接受 1.2.3 这样的简写IPv4地址
+        try:
+            ip = socket.getaddrinfo(ip, None, socket.AF_INET, 0, 0, socket.AI_NUMERICHOST)[0][4][0]
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except (OSError, UnicodeError):
+            raise ValueError(f"'{ip}' does not appear to be an IPv4 or IPv6 address.") from None
+
+    def find(self, ip):
+        """查询地址，返回 (记录位置, 前缀长度)，没有记录时位置为None
+
+        记录位置为指向数据区的树节点值，同一文件中位置相同即记录相同；前缀长度与 get_with_prefix_len() 一致。
+        """
+        version, number = self._parse(ip)
+        if version == 6:
+            if self.ip_version == 4:
+                raise ValueError(f'Error looking up {ip}. You attempted to look up an IPv6 address '
+                                 f'in an IPv4-only database.')
+            bits, base, offset = 128, (0, 0), 0
+        else:
+            bits, base = 32, self._ipv4_start
+            # IPv6库中IPv4地址的前缀长度不计 ::/96 的96位
+            offset = 96 if self.ip_version == 6 else 0
+        key = (version, number >> (bits - 16))
+        start = self._jump.get(key)
+        if start is None:
+            node, depth = base
+            start = self._jump[key] = self._descend(node, depth - offset, number, bits, 16)
+        node, depth = start
+        node, depth = self._descend(node, depth, number, bits, bits)
+        prefix_len = max(depth, 0)
+        if node <= self.node_count:
+            return None, prefix_len
+        return node, prefix_len
+
+    def get(self, ip):
+        return self._reader.get(ip)
+
+    def get_with_prefix_len(self, ip):
+        return self._reader.get_with_prefix_len(ip)
+
+    def metadata(self):
+        return self._reader.metadata()
+
+    def close(self):
+        self._reader.close()
+        self._mm.close()
@@ -0,0 +1,202 @@
+"""按网段缓存IP库查询结果
+
+IP库返回的结果对整个网段都相同（例如maxminddb的前缀长度给出的网段），
+因此缓存以 (命名空间, IP版本, 前缀长度, 网络号) 为键，同一网段内的其他IP直接命中。
+"""
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+
+def range_prefix_len(ip_int, first, last, bits):
+    """返回包含ip_int且完全落在 [first, last] 区间内的最大网段的前缀长度
+
+    用于把区间型IP库（IP2Location、ip2region等）命中的区间换算成可缓存的网段。
+    """
+    # 网络号不小于first：主机位数不能超过ip与first-1最高的不同位
+    host_bits = bits
+    if first > 0:
+        host_bits = min(host_bits, (ip_int ^ (first - 1)).bit_length() - 1)
+    # 广播地址不大于last：主机位数不能超过ip与last+1最高的不同位
+    if last + 1 < 1 << bits:
+        host_bits = min(host_bits, (ip_int ^ (last + 1)).bit_length() - 1)
+    # ip_int不在区间内时（IP2Location把最大地址按前一个地址查询）只缓存该IP本身
+    return bits - max(host_bits, 0)
+
+
+class PrefixCache:
+    """带容量上限（LRU）和过期时间（TTL）的网段结果缓存
+
+    命名空间通常是 (数据源, 字段集合)，不同命名空间的结果互不影响。
+    通过 watch_files 登记IP库文件后，文件变化时会自动清空对应命名空间。
+    """
+
+    def __init__(self, maxsize=100000, ttl=3600, check_interval=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._data = OrderedDict()
+        # (命名空间, IP版本) -> {前缀长度: 条目数}，查询时只探测出现过的前缀长度
+        self._lengths = {}
+        self._lock = threading.Lock()
+        self._files = {}
+        self._signatures = {}
+        self._next_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+        # 每次清除时加1；查询前取得、写入时已变化的结果可能来自清除前的IP库，不再写入
+        self.epoch = 0
+
+    @staticmethod
+    def _bits(version):
+        return 32 if version == 4 else 128
+
+    def get(self, namespace, version, ip_int):
+        """查找包含ip_int的缓存网段，未命中返回None"""
+        self._maybe_check_files()
+        bits = self._bits(version)
+        now = time.monotonic()
+        with self._lock:
+            lengths = self._lengths.get((namespace, version))
+            if lengths:
+                for prefix_len in lengths:
+                    key = (namespace, version, prefix_len, ip_int >> (bits - prefix_len))
+                    entry = self._data.get(key)
+                    if entry is None:
+                        continue
+                    if entry[0] < now:
+                        self._remove(key)
+                        self.expirations += 1
+                        break
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, namespace, version, ip_int, prefix_len, value, epoch=None):
+        """缓存ip_int所在的 /prefix_len 网段的查询结果
+
+        epoch为查询IP库之前取得的 self.epoch，之后缓存被清除过时不写入：查询期间热加载换代，
+        旧一代的结果不会在清除之后留在缓存中。
+        """
+        if self.maxsize <= 0:
+            return
+        bits = self._bits(version)
+        key = (namespace, version, prefix_len, ip_int >> (bits - prefix_len))
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                self.stale_puts += 1
+                return
+            if key not in self._data:
+                lengths = self._lengths.setdefault((namespace, version), {})
+                lengths[prefix_len] = lengths.get(prefix_len, 0) + 1
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self._data[key]
+        namespace, version, prefix_len, _ = key
+        lengths = self._lengths[(namespace, version)]
+        lengths[prefix_len] -= 1
+        if not lengths[prefix_len]:
+            del lengths[prefix_len]
+
+    def invalidate(self, match=None):
+        """清空缓存；match为函数时只删除 match(命名空间) 为真的条目"""
+        with self._lock:
+            if match is None:
+                removed = len(self._data)
+                self._data.clear()
+                self._lengths.clear()
+            else:
+                keys = [key for key in self._data if match(key[0])]
+                for key in keys:
+                    self._remove(key)
+                removed = len(keys)
+            self.invalidations += 1
+            self.epoch += 1
+        return removed
+
+    def invalidate_ranges(self, match, ranges):
+        """只删除 match(命名空间) 为真、且网段与ranges中任一区间相交的条目，返回删除的条目数
+
+        ranges为 {IP版本: 按地址排序、互不重叠的 [(起始地址, 结束地址), ...]}，通常来自两版IP库的比较结果。
+        """
+        starts = {version: [first for first, _ in items] for version, items in ranges.items()}
+        with self._lock:
+            keys = []
+            for key in self._data:
+                namespace, version, prefix_len, network = key
+                if version not in starts or not match(namespace):
+                    continue
+                host = self._bits(version) - prefix_len
+                low = network << host
+                # 起始地址不大于网段末尾的最后一个区间，结束地址不小于网段开头时与网段相交
+                i = bisect_right(starts[version], low | ((1 << host) - 1)) - 1
+                if i >= 0 and ranges[version][i][1] >= low:
+                    keys.append(key)
+            for key in keys:
+                self._remove(key)
+            self.invalidations += 1
+            self.epoch += 1
+        return len(keys)
+
+    def watch_files(self, name, paths):
+        """登记数据源name依赖的IP库文件，文件变化时清空命名空间以name开头的条目"""
+        self._files[name] = list(paths)
+        self._signatures[name] = self._signature(self._files[name])
+
+    @staticmethod
+    def _signature(paths):
+        signature = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _maybe_check_files(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        self.check_files()
+
+    def check_files(self):
+        """检查登记的IP库文件，返回发生变化的数据源名称列表"""
+        changed = []
+        for name, paths in list(self._files.items()):
+            signature = self._signature(paths)
+            if signature != self._signatures.get(name):
+                self._signatures[name] = signature
+                self.invalidate(lambda namespace, name=name: namespace[0] == name)
+                changed.append(name)
+        return changed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'stale_puts': self.stale_puts,
+        }
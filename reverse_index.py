@@ -0,0 +1,146 @@
+"""反向索引：从国家、地区、ASN反查IP库中的全部网段
+
+    python reverse_index.py            # 生成到 IP_REVERSE_INDEX_PATH
+    python reverse_index.py -o x.json
+
+生成时按数据源遍历整个地址空间的区间（见 app.lookup_range），把每个区间归入结果中各字段的取值，
+同一取值的区间排序合并后转换为最少的CIDR列表。索引以JSON保存并记录源文件的签名，
+源文件没有变化时直接载入，查询只是一次字典查找。
+
+IPv6中内嵌IPv4地址的网段（IPv4兼容、IPv4映射、Teredo、6to4）查到的是对应IPv4地址的结果，不计入索引。
+"""
+import argparse
+import ipaddress
+import json
+import os
+import threading
+import time
+
+from db_ranges import to_networks
+
+FORMAT_VERSION = 1
+# 每个索引缓存的已编码响应数，超过后清空重新缓存
+ENCODED_CACHE_SIZE = 1024
+
+# 按IPv4地址查询的IPv6网段
+IPV4_EMBEDDED = tuple(ipaddress.ip_network(n) for n in ('::/96', '::ffff:0:0/96', '2001::/32', '2002::/16'))
+
+
+def search_networks():
+    """生成索引时遍历的网段：整个IPv4地址空间和去掉内嵌IPv4网段后的IPv6地址空间"""
+    networks = [ipaddress.ip_network('::/0')]
+    for embedded in IPV4_EMBEDDED:
+        networks = [part for network in networks
+                    for part in (network.address_exclude(embedded) if embedded.subnet_of(network) else [network])]
+    return [ipaddress.ip_network('0.0.0.0/0')] + sorted(networks)
+
+
+def build(dimensions, blocks):
+    """生成索引 {数据源: {字段: {取值: [CIDR, ...]}}}
+
+    dimensions为 {数据源: (字段, ...)}；blocks(数据源, 字段集合) 按地址顺序返回 (IP版本, 起始地址, 结束地址, 结果)。
+    取值统一转换为字符串，没有该字段或查询出错的区间跳过。
+    """
+    index = {}
+    for name, fields in dimensions.items():
+        # 字段 -> 取值 -> IP版本 -> 区间列表
+        ranges = {field: {} for field in fields}
+        for version, first, last, result in blocks(name, frozenset(fields)):
+            if 'error' in result:
+                continue
+            for field in fields:
+                value = result.get(field)
+                if value is None or value == '':
+                    continue
+                ranges[field].setdefault(str(value), {}).setdefault(version, []).append((first, last))
+        index[name] = {field: {value: [n for version in sorted(by_version)
+                                       for n in to_networks(by_version[version], version)]
+                               for value, by_version in sorted(values.items())}
+                       for field, values in ranges.items()}
+    return index
+
+
+class ReverseIndex:
+    def __init__(self, index, sources, build_time):
+        self.index = index
+        self.sources = sources
+        self.build_time = build_time
+        self._encoded = {}
+
+    def networks(self, provider, field, value):
+        """返回取值对应的CIDR列表（IPv4在前），没有时返回None"""
+        return self.index.get(provider, {}).get(field, {}).get(str(value))
+
+    def values(self, provider, field):
+        """返回 {取值: 网段数}"""
+        return {value: len(networks) for value, networks in self.index.get(provider, {}).get(field, {}).items()}
+
+    def encoded(self, key, encode):
+        """缓存由索引内容编码出的响应体，大的网段列表只在第一次请求时序列化"""
+        try:
+            return self._encoded[key]
+        except KeyError:
+            if len(self._encoded) >= ENCODED_CACHE_SIZE:
+                self._encoded.clear()
+            body = self._encoded[key] = encode()
+            return body
+
+    def save(self, path):
+        tmp = f'{path}.tmp'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'format': FORMAT_VERSION, 'build_time': self.build_time,
+                       'sources': self.sources, 'index': self.index}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, sources=None):
+        """载入保存的索引；文件不存在、格式不符或源文件签名与sources不同时返回None"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('format') != FORMAT_VERSION or (sources is not None and data.get('sources') != sources):
+            return None
+        return cls(data['index'], data['sources'], data['build_time'])
+
+
+class BackgroundIndex:
+    """在后台线程中载入或生成反向索引，完成前 get() 返回None，失败时抛出RuntimeError"""
+
+    def __init__(self, loader):
+        self._index = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(loader,), name='reverse-index', daemon=True)
+        self._thread.start()
+
+    def _run(self, loader):
+        try:
+            self._index = loader()
+        except Exception as e:
+            self._error = str(e)
+            print(f"Error building reverse index: {e}")
+
+    def get(self):
+        if self._error is not None:
+            raise RuntimeError(self._error)
+        return self._index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成从国家、地区、ASN反查网段的索引')
+    parser.add_argument('-o', '--output', help='输出文件，默认为 IP_REVERSE_INDEX_PATH')
+    args = parser.parse_args(argv)
+    os.environ['IP_DB_WATCH_INTERVAL'] = '0'
+    os.environ['IP_CACHE_SIZE'] = '0'
+    import app
+    started = time.perf_counter()
+    index = app.build_reverse_index(args.output or app.REVERSE_INDEX_PATH)
+    counts = ', '.join(f'{provider}.{field} {len(values)}'
+                       for provider, fields in index.index.items() for field, values in fields.items())
+    print(f"✓ reverse index written in {time.perf_counter() - started:.1f}s ({counts})")
+
+
+if __name__ == '__main__':
+    main()
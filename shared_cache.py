@@ -0,0 +1,187 @@
+"""多个worker进程共享的查询结果缓存
+
+缓存是一个mmap到内存的文件（默认在 /dev/shm），同一台机器上的所有worker映射同一个文件：一个worker查到的结果
+其他worker直接命中，增加worker既不降低命中率也不多占内存。表的大小固定，按键的哈希开放寻址，
+每个键最多探测 PROBES 个相邻的槽，写入时替换其中最早过期的槽，不需要删除。
+
+键由标记（数据源、字段和IP库文件签名的摘要，见 make_tag）、IP版本和打包的网段组成：网段覆盖整个
+BLOCK_BITS 块（IPv4的/24、IPv6的/48）时以块为键，块内所有地址都能命中；更小的网段以IP本身为键。
+查询最多探测两个键，槽中记录实际的前缀长度，调用方据此把结果放入本进程的网段缓存。
+IP库更新后文件签名变化，标记随之改变，旧的条目不会再被命中，之后被新的条目覆盖。
+
+读写都不加锁：每个槽带有序号（写入期间为奇数）和覆盖整个槽内容的CRC32，
+读到正在写入、被并发写入交错或校验不符的槽都视为未命中。
+结果用marshal序列化，超过槽大小的结果不进入共享缓存；文件头记录格式和Python版本，不一致时重新创建文件。
+"""
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b'IPRC'
+FORMAT_VERSION = 1
+# 文件头：魔数、格式版本、Python版本、槽大小、槽数
+HEADER = struct.Struct('<4sHxxIIQ40x')
+SLOT_SIZE = 256
+# 槽：序号、CRC32，之后为CRC覆盖的内容：标记、IP版本、键的前缀长度、实际前缀长度、结果长度、过期时间、网络号高低64位
+SLOT = struct.Struct('<IIQBBBxHxxIQQ4x')
+SEQ = struct.Struct('<I')
+CRC = struct.Struct('<I')
+TAG = struct.Struct('<Q')
+BODY = struct.Struct(SLOT.format.replace('<II', '<', 1))
+MAX_PAYLOAD = SLOT_SIZE - SLOT.size
+# 每个键探测的槽数
+PROBES = 2
+# 网段不小于这个块时以块为键
+BLOCK_BITS = {4: 24, 6: 48}
+_MASK64 = (1 << 64) - 1
+
+
+def make_tag(text):
+    """由文本得到64位标记，各进程对同一文本得到相同的值（不使用随机化的字符串哈希）"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class SharedResultCache:
+    def __init__(self, path, size, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.slots = max(size // SLOT_SIZE, PROBES)
+        self._mm = self._open(path, HEADER.size + self.slots * SLOT_SIZE)
+        # 本进程的计数，不加锁，多线程时为近似值
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.oversized = 0
+
+    def _header(self):
+        return HEADER.pack(MAGIC, FORMAT_VERSION, sys.hexversion, SLOT_SIZE, self.slots)
+
+    def _open(self, path, length):
+        """映射已有的缓存文件；不存在或格式、大小不符时创建新文件替换
+
+        用文件锁保证同时启动的多个进程只有一个创建；替换而不是截断旧文件，仍在映射旧文件的进程不受影响。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f'{path}.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, 'r+b') as f:
+                    if os.fstat(f.fileno()).st_size == length and f.read(HEADER.size) == self._header():
+                        return mmap.mmap(f.fileno(), length)
+            except OSError:
+                pass
+            tmp = f'{path}.{os.getpid()}.tmp'
+            fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                # 截断出的空间读出来全为0，即全部为空槽；tmpfs上只有写入过的页面才占用内存
+                os.ftruncate(fd, length)
+                os.pwrite(fd, self._header(), 0)
+                os.replace(tmp, path)
+                return mmap.mmap(fd, length)
+            finally:
+                os.close(fd)
+
+    def _key(self, version, ip_int, prefix_len):
+        """返回 (键的前缀长度, 网络号)"""
+        bits = 32 if version == 4 else 128
+        block = BLOCK_BITS[version]
+        if prefix_len <= block:
+            return block, ip_int >> (bits - block)
+        return bits, ip_int
+
+    def _offsets(self, tag, version, key_len, network):
+        start = hash((tag, version, key_len, network))
+        return [HEADER.size + (start + i) % self.slots * SLOT_SIZE for i in range(PROBES)]
+
+    def _read(self, off, tag, version, key_len, network, now):
+        mm = self._mm
+        # 先只比较标记，不同数据源的条目占大多数，不必解出整个槽
+        if TAG.unpack_from(mm, off + 8)[0] != tag:
+            return None
+        seq, crc, _, slot_version, slot_key_len, prefix_len, length, expires, high, low = SLOT.unpack_from(mm, off)
+        if (low != network & _MASK64 or high != network >> 64 or slot_version != version
+                or slot_key_len != key_len or seq & 1 or expires < now or length > MAX_PAYLOAD):
+            return None
+        body = mm[off + 8:off + SLOT.size + length]
+        if zlib.crc32(body) != crc or SEQ.unpack_from(mm, off)[0] != seq:
+            return None
+        try:
+            return prefix_len, marshal.loads(body[BODY.size:])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def get(self, tag, version, ip_int):
+        """查找包含ip_int的条目，返回 (前缀长度, 结果)，未命中返回None"""
+        now = int(time.time())
+        bits = 32 if version == 4 else 128
+        block = BLOCK_BITS[version]
+        for key_len, network in ((block, ip_int >> (bits - block)), (bits, ip_int)):
+            for off in self._offsets(tag, version, key_len, network):
+                entry = self._read(off, tag, version, key_len, network, now)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+        self.misses += 1
+        return None
+
+    def put(self, tag, version, ip_int, prefix_len, value):
+        """缓存ip_int所在的 /prefix_len 网段的查询结果"""
+        payload = marshal.dumps(value)
+        if len(payload) > MAX_PAYLOAD:
+            self.oversized += 1
+            return
+        key_len, network = self._key(version, ip_int, prefix_len)
+        now = int(time.time())
+        mm = self._mm
+        # 同一个键的槽直接覆盖，否则替换探测范围内最早过期（空槽的过期时间为0）的槽
+        victim = None
+        for off in self._offsets(tag, version, key_len, network):
+            _, _, slot_tag, slot_version, slot_key_len, _, _, expires, high, low = SLOT.unpack_from(mm, off)
+            if (slot_tag == tag and slot_version == version and slot_key_len == key_len
+                    and high == network >> 64 and low == network & _MASK64):
+                victim = off
+                break
+            if victim is None or expires < victim_expires:
+                victim, victim_expires = off, expires
+        body = BODY.pack(tag, version, key_len, prefix_len, len(payload), now + self.ttl,
+                         network >> 64, network & _MASK64) + payload
+        seq = ((SEQ.unpack_from(mm, victim)[0] + 1) | 1) & 0xFFFFFFFF
+        SEQ.pack_into(mm, victim, seq)
+        mm[victim + 8:victim + 8 + len(body)] = body
+        CRC.pack_into(mm, victim + 4, zlib.crc32(body))
+        SEQ.pack_into(mm, victim, (seq + 1) & 0xFFFFFFFF)
+        self.writes += 1
+
+    def clear(self):
+        """清空全部条目（所有进程都不再命中）"""
+        mm = self._mm
+        empty = bytes(SLOT_SIZE * 1024)
+        for off in range(HEADER.size, len(mm), len(empty)):
+            end = min(off + len(empty), len(mm))
+            mm[off:end] = empty[:end - off]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'slots': self.slots,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'writes': self.writes,
+            'oversized': self.oversized,
+        }
+
+    def close(self):
+        self._mm.close()
@@ -0,0 +1,110 @@
+"""合并并发的相同查询
+
+同一个键同时只有一个调用方（领头者）实际执行，在它执行期间到达的调用方等待并直接使用它的结果。
+领头者不需要等待任何人，只多了两次加锁的字典操作；执行完成后键即被移除，之后的调用方重新执行（通常命中结果缓存）。
+do_many() 一次处理一批键：没有在执行中的键由本次调用一起执行，其余的等待各自的领头者。
+"""
+import threading
+
+# 执行中的调用：[结果, 是否成功, 等待用的锁]
+_VALUE, _OK, _DONE = range(3)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def _join(self, key):
+        """在执行中的调用上登记等待，返回等待用的锁；调用时须持有self._lock"""
+        flight = self._flights[key]
+        done = flight[_DONE]
+        if done is None:
+            # 第一个等待者才创建锁并替领头者持有，领头者完成时释放
+            done = flight[_DONE] = threading.Lock()
+            done.acquire()
+        self.shared += 1
+        return flight, done
+
+    def _finish(self, keys, flights):
+        with self._lock:
+            for key in keys:
+                del self._flights[key]
+        for flight in flights:
+            if flight[_DONE] is not None:
+                flight[_DONE].release()
+
+    @staticmethod
+    def _wait(flight, done):
+        # 等待者依次获取、释放同一把锁
+        done.acquire()
+        done.release()
+        return flight[_OK]
+
+    def do(self, key, func):
+        """执行 func() 或等待正在执行的同键调用，返回 (结果, 是否为等待得到的共享结果)
+
+        领头者出错时异常只抛给领头者，等待者各自重新执行 func()。
+        """
+        with self._lock:
+            if key in self._flights:
+                flight, done = self._join(key)
+            else:
+                flight = self._flights[key] = [None, False, None]
+                self.leaders += 1
+                done = None
+        if done is not None:
+            if self._wait(flight, done):
+                return flight[_VALUE], True
+            return func(), False
+        try:
+            value = flight[_VALUE] = func()
+            flight[_OK] = True
+            return value, False
+        finally:
+            self._finish((key,), (flight,))
+
+    def do_many(self, keys, func, lead=True):
+        """对一组不重复的键执行 func(需要执行的键列表)，返回与keys对应的结果列表和其中等待得到的结果数
+
+        func 按传入的顺序返回各键的结果。正在执行中的键等待其领头者，领头者出错的键由本次调用重新执行。
+        整批的结果要等func返回才一起就绪，lead为False时本次执行的键不登记，其他调用方不会等待这一批。
+        """
+        run = []
+        waiting = []
+        with self._lock:
+            for key in keys:
+                if key in self._flights:
+                    waiting.append((key, *self._join(key)))
+                else:
+                    run.append(key)
+            flights = None
+            if lead:
+                flights = [[None, False, None] for _ in run]
+                self._flights.update(zip(run, flights))
+                self.leaders += len(run)
+        values = {}
+        if run and flights:
+            try:
+                for key, flight, value in zip(run, flights, func(run)):
+                    flight[_VALUE] = values[key] = value
+                    flight[_OK] = True
+            finally:
+                self._finish(run, flights)
+        elif run:
+            values.update(zip(run, func(run)))
+        failed = []
+        for key, flight, done in waiting:
+            if self._wait(flight, done):
+                values[key] = flight[_VALUE]
+            else:
+                failed.append(key)
+        if failed:
+            values.update(zip(failed, func(failed)))
+        return [values[key] for key in keys], len(waiting) - len(failed)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'leaders': self.leaders, 'shared': self.shared}
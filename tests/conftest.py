@@ -0,0 +1,36 @@
+"""测试用的合成IP库：用 bench/fixtures.py 在临时目录中生成，在该目录中导入app"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from fixtures import build_fixtures  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def db_dir(tmp_path_factory):
+    """生成合成IP库的目录，结构与 ./db 一致"""
+    path = tmp_path_factory.mktemp('ipdb')
+    build_fixtures(str(path / 'db'), v4_networks=2000, v6_networks=500)
+    return path
+
+
+@pytest.fixture(scope='session')
+def app(db_dir):
+    os.environ.setdefault('IP_DB_WATCH_INTERVAL', '0')
+    # app按 ./db 下的相对路径打开IP库，延迟打开时也用这个路径
+    os.chdir(db_dir)
+    import app
+    return app
+
+
+@pytest.fixture
+def result_cache(app):
+    """每个测试从空的结果缓存开始"""
+    app.result_cache.invalidate()
+    yield app.result_cache
+    app.result_cache.invalidate()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import pytest
+
+
+def test_iter_unique_ips_dedups(app):
+    lines = ['8.8.8.8', b'1.1.1.1\n', ' 8.8.8.8 ', '', 'bad', 'bad', '::FFFF:1.2.3.4']
+    assert list(app.iter_unique_ips(lines)) == [
+        ('8.8.8.8', '8.8.8.8'), ('1.1.1.1', '1.1.1.1'),
+        ('bad', None), ('bad', None), ('::FFFF:1.2.3.4', '::ffff:102:304')]
+
+
+def test_iter_unique_ips_memory_is_bounded(app):
+    seen = OrderedDict()
+    lines = ['10.0.%d.%d' % (i >> 8, i & 255) for i in range(5000)]
+    assert len(list(app.iter_unique_ips(lines, seen, max_seen=100))) == 5000
+    assert len(seen) == 100
+    # 最近出现过的IP仍然去重，被忘掉的IP再次输出
+    assert list(app.iter_unique_ips([lines[-1], lines[0]], seen, max_seen=100)) == [(lines[0], lines[0])]
+    assert len(seen) == 100
+
+
+def test_iter_unique_ips_keeps_recently_repeated_ips(app):
+    seen = OrderedDict()
+    hot = '8.8.8.8'
+    lines = []
+    for i in range(1000):
+        lines += [hot, '10.1.%d.%d' % (i >> 8, i & 255)]
+    ips = [ip for _, ip in app.iter_unique_ips(lines, seen, max_seen=10)]
+    assert ips.count(hot) == 1
+
+
+def _asgi_post(path, body, content_type='application/json'):
+    """以ASGI方式POST请求体body，返回 (状态码, 响应体)"""
+    return _asgi_request('POST', path, b'', body, content_type)
+
+
+def _asgi_request(method, path, query_string, body=b'', content_type='application/json'):
+    import asgi
+    messages = []
+    chunks = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        return chunks.pop(0) if chunks else {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'root_path': '',
+             'client': ('127.0.0.1', 50000), 'headers': [(b'content-type', content_type.encode())]}
+    asyncio.run(asgi.app(scope, receive, send))
+    return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+
+@pytest.mark.parametrize('body', [
+    {'ips': ['8.8.8.8'], 'providers': 5},
+    {'ips': ['8.8.8.8'], 'fields': True},
+    {'ips': ['8.8.8.8'], 'providers': ['ip2region', 1]},
+    {'ips': ['8.8.8.8'], 'fields': {'country': 1}},
+])
+def test_selection_of_wrong_type_is_rejected(app, body):
+    response = app.app.test_client().post('/ip/api/lookup', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'providers/fields必须是字符串或数组'}
+    status, data = _asgi_post('/ip/api/lookup', json.dumps(body).encode())
+    assert status == 400
+    assert json.loads(data) == {'error': 'providers/fields必须是字符串或数组'}
+
+
+def test_selection_accepts_strings_and_lists(app):
+    assert app.parse_selection('ip2region, geolite2', ['country', 'asn']) == (
+        ['ip2region', 'geolite2'], frozenset(['country', 'asn']))
+    assert app.parse_selection('', []) == (None, None)
+
+
+@pytest.mark.parametrize('body, error', [
+    (b'{"ips": [', '请求体不是有效的JSON'),
+    (b'{"ips": 5}', 'ips必须是数组或字符串'),
+    (b'{"providers": "ip2region"}', 'ips必须是数组或字符串'),
+    (b'null', 'ips必须是数组或字符串'),
+])
+def test_invalid_json_body_is_rejected(app, body, error):
+    response = app.app.test_client().post('/ip/api/lookup', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+    status, data = _asgi_post('/ip/api/lookup', body)
+    assert status == 400
+    assert json.loads(data) == {'error': error}
+
+
+def test_get_without_ip_is_rejected(app):
+    response = app.app.test_client().get('/ip/api/lookup?providers=ip2region')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': '缺少ip参数'}
+    status, data = _asgi_request('GET', '/ip/api/lookup', b'providers=ip2region')
+    assert status == 400
+    assert json.loads(data) == {'error': '缺少ip参数'}
+
+
+def test_valid_json_body_is_looked_up(app):
+    for body in (b'["8.8.8.8"]', b'{"ips": "8.8.8.8\\n1.1.1.1"}'):
+        response = app.app.test_client().post('/ip/api/lookup?providers=ip2region', data=body,
+                                              content_type='application/json')
+        assert response.status_code == 200
+        assert response.get_data().count(b'\n') == body.count(b'.') // 3
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(app):
+    import asgi
+    return asgi
+
+
+def _call(asgi, path, headers=(), disconnect_after=None):
+    """以ASGI方式请求path，返回发出的消息；disconnect_after为发送第几个消息时模拟客户端断开"""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+        if disconnect_after is not None and len(messages) >= disconnect_after:
+            raise OSError('client disconnected')
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+             'client': ('127.0.0.1', 50000), 'headers': [(k.encode(), v.encode()) for k, v in headers]}
+
+    async def main():
+        try:
+            await asgi.app(scope, receive, send)
+        except OSError:
+            pass
+
+    asyncio.run(main())
+    return messages
+
+
+def test_flask_response_is_streamed(app, asgi):
+    headers = [('x-real-ip', '8.8.8.8')]
+    messages = _call(asgi, '/ip', headers)
+    assert messages[0]['type'] == 'http.response.start' and messages[0]['status'] == 200
+    bodies = messages[1:]
+    assert len(bodies) > 2
+    assert all(m['more_body'] for m in bodies[:-1]) and not bodies[-1].get('more_body')
+    expected = app.app.test_client().get('/ip', headers=dict(headers)).get_data()
+    assert b''.join(m['body'] for m in bodies) == expected
+
+
+def test_flask_error_status(asgi):
+    messages = _call(asgi, '/no-such-page')
+    assert messages[0]['status'] == 404
+    assert not messages[-1].get('more_body')
+
+
+def test_disconnect_stops_rendering(asgi):
+    messages = _call(asgi, '/ip', [('x-real-ip', '8.8.8.8')], disconnect_after=2)
+    assert len(messages) == 2
+    # 生成线程已经结束，线程池的任务数恢复
+    assert not asgi._slots.locked() and asgi._slots._value == asgi.ASGI_THREADS + asgi.ASGI_MAX_PENDING
@@ -0,0 +1,64 @@
+import ipaddress
+
+import pytest
+
+from ip2location_mem import IPV4_ALIAS_BLOCKS, MAX_IPV6, exclude_alias_blocks
+
+# 按IPv4地址查询的IPv6地址，前面先查询的IPv6地址所在的行跨过了它们所在的地址块
+ALIASED = ['::ffff:8.8.8.8', '2002:808:808::1', '2001::f7f7:f7f7']
+
+
+def test_exclude_alias_blocks():
+    for block_first, block_last in IPV4_ALIAS_BLOCKS:
+        _, last = exclude_alias_blocks(block_first - 1, 0, MAX_IPV6)
+        assert last < block_first
+        first, _ = exclude_alias_blocks(block_last + 1, 0, MAX_IPV6)
+        assert first > block_last
+
+
+def test_row_does_not_cover_alias_blocks(app):
+    provider = app.PROVIDERS['ip2location']
+    for ip in ['::', '2001:db8::1', '2001:1::', '::1']:
+        _, prefix_len = provider.lookup(ip)
+        assert prefix_len is not None
+        bits = 128 - prefix_len
+        network = int(ipaddress.ip_address(ip)) >> bits << bits
+        for block_first, block_last in IPV4_ALIAS_BLOCKS:
+            assert network > block_last or network | ((1 << bits) - 1) < block_first, ip
+
+
+@pytest.mark.parametrize('first', ['::', '2001:db8::1'])
+def test_cached_row_does_not_answer_aliased_addresses(app, result_cache, first):
+    provider = app.PROVIDERS['ip2location']
+    cached = app.query_ip2location(first)
+    for ip in ALIASED:
+        expected, _ = provider.lookup(ip)
+        assert expected != cached
+        assert app.query_ip2location(ip) == expected
+
+
+def test_batch_does_not_reuse_row_for_aliased_addresses(app, result_cache):
+    provider = app.PROVIDERS['ip2location']
+    ips = ['::'] + ALIASED
+    expected = [provider.lookup(ip)[0] for ip in ips]
+    assert provider.query_many(ips, None) == expected
+    app.result_cache.invalidate()
+    assert [item['ip2location'] for item in app.lookup_batch(ips, ['ip2location'])] == expected
+
+
+# inet_aton能解析、官方库却视为无效的写法，以及正常地址
+GET_ALL_INPUTS = ['127.1', '1', '0x7f.0.0.1', '1.2.3', '01.2.3.4', '1.2.3.04',
+                  '8.8.8.8', '::ffff:1.2.3.4', '2001:db8::1']
+
+
+@pytest.mark.parametrize('ip', GET_ALL_INPUTS)
+def test_same_result_as_official_get_all(app, result_cache, ip):
+    IP2Location = pytest.importorskip('IP2Location')
+    key = 'ip2location_v6' if ':' in ip else 'ip2location_v4'
+    rec = IP2Location.IP2Location(app.DB_PATH[key]).get_all(ip)
+    expected = {name: getattr(rec, column) for name, column in [
+        ('city', 'city'), ('country', 'country_long'), ('region', 'region'),
+        ('isp', 'isp'), ('domain', 'domain'), ('zipcode', 'zipcode')] if getattr(rec, column)}
+    assert app.query_ip2location(ip) == expected
+    # 第二次查询不能命中为无效写法缓存的结果
+    assert app.query_ip2location(ip) == expected
@@ -0,0 +1,73 @@
+import ipaddress
+import random
+
+import pytest
+
+from generations import ReaderPool
+from xdb import XdbFile
+
+
+def _sample(rng, version, count):
+    bits = 32 if version == 4 else 128
+    base = 0 if version == 4 else int(ipaddress.ip_address('2400::'))
+    span = 1 << (32 if version == 4 else 116)
+    return [str(ipaddress.ip_address(base + rng.randrange(span) if version == 6 else rng.randrange(1 << bits)))
+            for _ in range(count)]
+
+
+@pytest.fixture(params=[4, 6])
+def xdb_pair(app, request):
+    """同一个xdb文件的content模式读取器和官方库读取器"""
+    path = app.DB_PATH[f'ip2region_v{request.param}']
+    content = app.open_ip2region(path, 'content')
+    library = app.open_ip2region(path, 'vectorIndex')
+    yield request.param, content, library
+    content.close()
+    library.close()
+
+
+def test_content_reader_matches_official_search(xdb_pair):
+    version, content, library = xdb_pair
+    assert isinstance(content, XdbFile)
+    for ip in _sample(random.Random(version), version, 2000):
+        region, first, last = content.lookup(ip)
+        assert region == library.search(ip), ip
+        if region:
+            assert first <= int(ipaddress.ip_address(ip)) <= last
+
+
+@pytest.mark.parametrize('ip', ['127.1', 'abc', '::1', '1.2.3.4'])
+def test_content_reader_raises_like_official_search(xdb_pair, ip):
+    _, content, library = xdb_pair
+    try:
+        expected = library.search(ip)
+    except Exception as e:
+        with pytest.raises(type(e)):
+            content.lookup(ip)
+    else:
+        assert content.search(ip) == expected
+
+
+@pytest.fixture
+def content_readers(app, monkeypatch):
+    pool = ReaderPool()
+    for key in ('ip2region_v4', 'ip2region_v6'):
+        pool.add(key, lambda key=key: app.open_ip2region(app.DB_PATH[key], 'content'))
+    monkeypatch.setattr(app, 'readers', pool)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize('version', [4, 6])
+def test_content_lookup_is_cached_by_segment(app, content_readers, version):
+    rng = random.Random(version)
+    prefixes = []
+    for ip in _sample(rng, version, 300):
+        result, prefix_len = app._lookup_ip2region(ip)
+        prefixes.append(prefix_len)
+        network = ipaddress.ip_network(f'{ip}/{prefix_len}', strict=False)
+        # 网段的两端和其中的随机地址查询结果相同
+        for value in {int(network.network_address), int(network.broadcast_address),
+                      rng.randint(int(network.network_address), int(network.broadcast_address))}:
+            assert app._lookup_ip2region(str(ipaddress.ip_address(value)))[0] == result, (ip, prefix_len)
+    assert min(prefixes) < (32 if version == 4 else 128)
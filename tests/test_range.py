@@ -0,0 +1,105 @@
+import ipaddress
+import json
+import os
+import random
+
+import pytest
+
+
+def _range(app, cidr, provider):
+    response = app.app.test_client().get(f'/ip/api/range?cidr={cidr}&providers={provider}')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def _check_points(app, lines, provider, rng):
+    """每个区间的两端和其中一个随机地址的查询结果都与区间的结果相同"""
+    blocks = [line for line in lines if 'first' in line]
+    assert blocks
+    for line in blocks:
+        first = int(ipaddress.ip_address(line['first']))
+        last = int(ipaddress.ip_address(line['last']))
+        for value in {first, last, rng.randint(first, last)}:
+            ip = str(ipaddress.ip_address(value))
+            assert app.PROVIDERS[provider].lookup(ip)[0] == line['result'], ip
+
+
+@pytest.mark.parametrize('cidr', ['2001::/96', '2001:0:abcd:1234:5678::/100', '2001::f7f7:0/112'])
+def test_teredo_blocks_match_point_lookups(app, cidr):
+    _check_points(app, _range(app, cidr, 'ip2location'), 'ip2location', random.Random(cidr))
+
+
+@pytest.mark.parametrize('cidr', ['1.0.0.0/8', '2400::/16', '::ffff:0:0/104', '2002:800::/24'])
+def test_blocks_match_point_lookups(app, cidr):
+    for provider in ('ip2location', 'geolite2'):
+        _check_points(app, _range(app, cidr, provider), provider, random.Random(cidr))
+
+
+def test_teredo_spanning_several_96_is_flagged(app):
+    lines = _range(app, '2000::/7', 'ip2location')
+    mixed = [line for line in lines if line.get('mixed')]
+    assert [(line['first'], line['last'], line['result']) for line in mixed] == \
+        [('2001::', '2001:0:ffff:ffff:ffff:ffff:ffff:ffff', None)]
+    _check_points(app, [line for line in lines if not line.get('mixed')], 'ip2location', random.Random(7))
+
+
+KEY = 'ip2region_v4'
+
+
+@pytest.fixture
+def lazy_generation(app, tmp_path, monkeypatch):
+    """lazy模式登记的一代IP库（没有打开读取器和区间索引），以及另一版本的同一组文件"""
+    from fixtures import build_fixtures
+    paths = build_fixtures(str(tmp_path / 'old'), seed=1, v4_networks=300, v6_networks=50)
+    new_paths = build_fixtures(str(tmp_path / 'new'), seed=2, v4_networks=300, v6_networks=50)
+    monkeypatch.setattr(app, 'IP_DB_OPEN', 'lazy')
+    monkeypatch.setattr(app, 'IP_DB_DIFF_DIR', str(tmp_path / 'diff'))
+    old = app.load_readers(1, paths)
+    assert old.readers.pending() and not old.has_derived(f'{KEY}_ranges')
+    yield old, paths, new_paths
+    old.close()
+
+
+def _reload(app, old, paths):
+    from generations import ReaderGeneration
+    gen = ReaderGeneration(2, paths)
+    for key, (opener, stateful) in app.READER_OPENERS.items():
+        app.add_reader(gen.readers, key, opener, paths[key], stateful)
+    app.diff_generations(old, gen)
+    gen.close()
+    return gen
+
+
+def test_lazy_generation_is_compared_after_replace(app, lazy_generation, capsys, tmp_path):
+    old, paths, new_paths = lazy_generation
+    os.replace(new_paths[KEY], paths[KEY])
+    gen = _reload(app, old, paths)
+    assert 'Skipping' not in capsys.readouterr().out
+    assert gen.diffs[KEY][4]
+    # 与直接比较两个版本的文件结果相同：比较的确实是被替换前的旧版本
+    from db_diff import compare, report_ranges
+    from fixtures import build_fixtures
+    copy = build_fixtures(str(tmp_path / 'copy'), seed=1, v4_networks=300, v6_networks=50)[KEY]
+    index = app.RANGE_INDEXES[KEY]
+    expected = report_ranges(compare(index(copy), index(paths[KEY]), copy, paths[KEY]))
+    assert gen.diffs[KEY] == expected
+
+
+def test_in_place_rewrite_is_reported(app, lazy_generation, capsys):
+    old, paths, new_paths = lazy_generation
+    with open(new_paths[KEY], 'rb') as src, open(paths[KEY], 'r+b') as dst:
+        dst.write(src.read())
+        dst.truncate()
+    gen = _reload(app, old, paths)
+    assert f'Skipping comparison of {KEY}: {paths[KEY]} was modified in place' in capsys.readouterr().out
+    assert KEY not in gen.diffs
+
+
+def test_unretained_old_version_is_reported(app, lazy_generation, capsys, monkeypatch):
+    import generations
+    old, paths, new_paths = lazy_generation
+    monkeypatch.setattr(generations, '_FD_DIR', None)
+    os.replace(new_paths[KEY], paths[KEY])
+    gen = _reload(app, old, paths)
+    assert f'Skipping comparison of {KEY}: old version of {paths[KEY]} was not retained' in capsys.readouterr().out
+    assert KEY not in gen.diffs
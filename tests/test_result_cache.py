@@ -0,0 +1,41 @@
+from result_cache import PrefixCache
+
+NAMESPACE = ('geolite2', None)
+
+
+def test_put_after_invalidate_is_dropped():
+    cache = PrefixCache()
+    epoch = cache.epoch
+    cache.invalidate(lambda namespace: namespace[0] == 'geolite2')
+    cache.put(NAMESPACE, 4, 0x01020304, 24, {'city': 'old'}, epoch)
+    assert cache.get(NAMESPACE, 4, 0x01020304) is None
+    assert cache.stats()['stale_puts'] == 1
+    cache.put(NAMESPACE, 4, 0x01020304, 24, {'city': 'new'}, cache.epoch)
+    assert cache.get(NAMESPACE, 4, 0x01020305) == {'city': 'new'}
+
+
+def test_put_after_invalidate_ranges_is_dropped():
+    cache = PrefixCache()
+    epoch = cache.epoch
+    cache.invalidate_ranges(lambda namespace: True, {4: [(0x01020300, 0x010203ff)]})
+    cache.put(NAMESPACE, 4, 0x01020304, 24, {'city': 'old'}, epoch)
+    assert cache.get(NAMESPACE, 4, 0x01020304) is None
+
+
+def test_lookup_during_swap_is_not_cached(app, result_cache, monkeypatch):
+    """查询期间换代并清除缓存（见 _activate_generation）时，旧一代的结果不留在缓存中"""
+    provider = app.PROVIDERS['geolite2']
+    lookup = provider.lookup
+
+    def swapping_lookup(ip, fields=None):
+        found = lookup(ip, fields)
+        result_cache.invalidate(lambda namespace: namespace[0] == 'geolite2')
+        return found
+
+    monkeypatch.setattr(provider, 'lookup', swapping_lookup)
+    assert provider.query('1.2.3.4') == lookup('1.2.3.4')[0]
+    assert provider.query_many(['1.2.3.5', '1.2.3.6'], None) == [lookup('1.2.3.5')[0], lookup('1.2.3.6')[0]]
+    assert result_cache.stats()['size'] == 0
+    monkeypatch.setattr(provider, 'lookup', lookup)
+    provider.query('1.2.3.4')
+    assert result_cache.stats()['size'] == 1
@@ -0,0 +1,79 @@
+import ipaddress
+import random
+
+import pytest
+
+from generations import ReaderPool
+from unified_db import UnifiedDB
+
+
+@pytest.fixture(scope='module')
+def unified(app, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('unified') / 'unified.db')
+    app.compile_unified_db(path)
+    db = UnifiedDB(path)
+    yield db
+    db.close()
+
+
+def _sample(rng, network, count):
+    network = ipaddress.ip_network(network)
+    return [str(network.network_address + rng.randrange(network.num_addresses)) for _ in range(count)]
+
+
+def test_teredo_is_not_compiled_as_ranges(unified):
+    record = unified.lookup('2001::1')[0]
+    assert record['ip2location'] is None
+    assert record['geolite2'] is not None
+
+
+@pytest.mark.parametrize('network', ['2001::/32', '2001::/96', '2001:0:1234::/48'])
+def test_teredo_matches_live_lookups(app, unified, network):
+    rng = random.Random(network)
+    for ip in _sample(rng, network, 300) + ['2001::', '2001:0:ffff:ffff:ffff:ffff:ffff:ffff']:
+        record = app._unified_record(unified, unified.lookup(ip)[0], ip)
+        for name, provider in app.PROVIDERS.items():
+            assert record[name] == provider.lookup(ip)[0], (name, ip)
+
+
+@pytest.mark.parametrize('network', ['0.0.0.0/0', '2400::/12', '::ffff:0:0/96', '2002::/16', '::/0'])
+def test_matches_live_lookups(app, unified, network):
+    rng = random.Random(network)
+    for ip in _sample(rng, network, 300):
+        record = app._unified_record(unified, unified.lookup(ip)[0], ip)
+        for name, provider in app.PROVIDERS.items():
+            assert record[name] == provider.lookup(ip)[0], (name, ip)
+
+
+# ipaddress不接受、在线查询时部分数据源能解析的写法
+ODD_INPUTS = ['127.1', '1.2.3', '1', '0', '0x7f.0.0.1', '01.2.3.4', '1.2.3.04', '010.0.0.1', '4294967295',
+              '8.8.8.8\n', ' 8.8.8.8', '1.2.3.256', '1.2.3.4/32', 'abc', '']
+
+
+@pytest.fixture
+def unified_pool(unified):
+    pool = ReaderPool()
+    pool.add('unified', lambda: unified)
+    return pool
+
+
+@pytest.mark.parametrize('ip', ODD_INPUTS)
+def test_odd_inputs_match_live_lookups(app, unified_pool, ip):
+    names = list(app.PROVIDERS)
+    results = app._unified_fallback(unified_pool, ip, names)
+    for name, provider in app.PROVIDERS.items():
+        expected = provider.lookup(ip)[0]
+        if name in app.UNIFIED_MMDB_PROVIDERS + ('ip2location',) and 'error' not in expected:
+            assert results[name] == expected, (name, ip)
+        else:
+            assert results[name] == {'error': '无效的IP地址'}, (name, ip)
+
+
+def test_records_are_decoded_once(app, unified, unified_pool, monkeypatch):
+    decoded = []
+    record = unified.record
+    monkeypatch.setattr(unified, 'record', lambda record_id: decoded.append(record_id) or record(record_id))
+    ips = ['8.8.8.8', '8.8.4.4', '1.1.1.1', '8.8.8.8', '1.1.1.1', '8.8.4.4']
+    found = [app._unified_find(unified_pool, 4, int(ipaddress.ip_address(ip)))[0] for ip in ips]
+    assert sorted(decoded) == sorted(set(decoded))
+    assert found[0] is found[3] and found[2] is found[4]
@@ -0,0 +1,232 @@
+"""把所有IP库合并编译成一个可mmap的区间表
+
+在线查询一个IP要分别在六个IP库中做树查找或二分查找。编译时遍历每个IP库的全部区间，
+对每个数据源的区间调用一次查询函数得到结果，再把所有数据源的区间求公共细分，
+相邻且结果相同的区间合并，结果组合去重后保存。查询时只需在区间起始地址上做一次二分查找。
+
+文件格式（小端序，各段按8字节对齐）：
+  头部        MAGIC、格式版本、IPv4区间数、IPv6区间数、记录数、元数据长度
+  IPv4区间    起始地址 uint32[n4]，记录号 uint32[n4]
+  IPv6区间    起始地址高64位 uint64[n6]，低64位 uint64[n6]，记录号 uint32[n6]
+  记录        偏移 uint64[记录数+1]，UTF-8 JSON数据 {数据源: 结果}
+  元数据      JSON：数据源列表、编译时间、源文件
+
+区间内各地址的结果不同、无法编译的部分（ip2location跨越多个/96的Teredo地址）中该数据源的结果为null，
+查询时由调用方另行处理。
+
+lookup() 只接受 ipaddress 能解析的地址；各IP库对其他写法的处理不同（maxminddb接受 127.1 这类简写，
+ip2location官方库返回 INVALID IP ADDRESS），同样由调用方按数据源处理。
+"""
+import argparse
+import heapq
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from db_ranges import partition
+
+MAGIC = b'IPUNIFY\0'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIIIIQ')
+HEADER_LENGTH = 64
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _provider_intervals(lookup, streams, version, results, unresolved=()):
+    """对一个数据源的区间逐个查询，返回结果变化处的 (起始地址, 结果号)
+
+    results为 结果JSON -> 结果号 的字典，相同结果共用一个结果号；unresolved中的区间不查询，结果记为null。
+    """
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    previous = None
+    for first, last in partition(list(streams) + [unresolved], version):
+        if any(low <= first and last <= high for low, high in unresolved):
+            key = 'null'
+        else:
+            key = json.dumps(lookup(str(address(first))), ensure_ascii=False)
+        result_id = results.setdefault(key, len(results))
+        if result_id != previous:
+            yield first, result_id
+            previous = result_id
+
+
+def _combine(providers, version, results, records, progress):
+    """对所有数据源的区间求公共细分，返回 (起始地址列表, 记录号列表)"""
+    def tagged(index, lookup, ranges, unresolved=None):
+        spans = unresolved(version) if unresolved is not None else ()
+        for first, result_id in _provider_intervals(lookup, ranges(version), version, results[index], spans):
+            yield first, index, result_id
+
+    streams = [tagged(index, *provider[1:]) for index, provider in enumerate(providers)]
+
+    starts, ids = [], []
+    current = [None] * len(providers)
+    pending = None
+
+    def emit(first):
+        record_id = records.setdefault(tuple(current), len(records))
+        if not ids or ids[-1] != record_id:
+            starts.append(first)
+            ids.append(record_id)
+
+    started = time.perf_counter()
+    for first, index, result_id in heapq.merge(*streams):
+        if pending is not None and first != pending:
+            emit(pending)
+        current[index] = result_id
+        pending = first
+    emit(pending)
+    progress(f"IPv{version}: {len(starts)} ranges in {time.perf_counter() - started:.1f}s")
+    return starts, ids
+
+
+def compile_unified(output, providers, sources=None, progress=print):
+    """编译合并库并写入output
+
+    providers为 (数据源名称, lookup, ranges[, unresolved]) 列表：lookup(ip) 返回该数据源的结果，
+    ranges(version) 返回若干组 (起始地址, 结束地址) 区间，同一区间内lookup的结果必须相同；
+    unresolved(version) 返回不满足这一点的区间列表，这些区间的结果记为null。
+    先写入临时文件再替换，热加载不会读到写了一半的文件。
+    """
+    started = time.perf_counter()
+    results = [{} for _ in providers]
+    records = {}
+    v4_starts, v4_ids = _combine(providers, 4, results, records, progress)
+    v6_starts, v6_ids = _combine(providers, 6, results, records, progress)
+
+    names = [provider[0] for provider in providers]
+    result_texts = [list(r) for r in results]
+    offsets = array('Q', [0])
+    data = bytearray()
+    for combination in records:
+        parts = [f'{json.dumps(name)}:{result_texts[i][result_id]}'
+                 for i, (name, result_id) in enumerate(zip(names, combination))]
+        data += ('{' + ','.join(parts) + '}').encode('utf-8')
+        offsets.append(len(data))
+
+    metadata = json.dumps({
+        'providers': names,
+        'build_time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'sources': sources or {},
+    }, ensure_ascii=False).encode('utf-8')
+
+    sections = [
+        array('I', v4_starts), array('I', v4_ids),
+        array('Q', (s >> 64 for s in v6_starts)), array('Q', (s & 0xFFFFFFFFFFFFFFFF for s in v6_starts)),
+        array('I', v6_ids), offsets,
+    ]
+    if sys.byteorder != 'little':
+        for section in sections:
+            section.byteswap()
+
+    tmp = f'{output}.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(tmp, 'wb') as f:
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(v4_starts), len(v6_starts), len(records), len(metadata))
+        f.write(header.ljust(HEADER_LENGTH, b'\0'))
+        for chunk in sections + [data, metadata]:
+            raw = chunk.tobytes() if isinstance(chunk, array) else bytes(chunk)
+            f.write(raw)
+            f.write(b'\0' * (_align(len(raw)) - len(raw)))
+    os.replace(tmp, output)
+    progress(f"✓ unified database written to {output}: {len(v4_starts)} IPv4 ranges, "
+             f"{len(v6_starts)} IPv6 ranges, {len(records)} records in {time.perf_counter() - started:.1f}s")
+
+
+class UnifiedDB:
+    """mmap方式打开的合并库，一次二分查找得到所有数据源的结果"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._v4_count, self._v6_count, self._record_count, meta_length = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f'不是合并库文件或格式版本不支持: {filename}')
+        self._views = []
+        offset = HEADER_LENGTH
+        self._v4_starts, offset = self._section(offset, 'I', self._v4_count)
+        self._v4_ids, offset = self._section(offset, 'I', self._v4_count)
+        self._v6_high, offset = self._section(offset, 'Q', self._v6_count)
+        self._v6_low, offset = self._section(offset, 'Q', self._v6_count)
+        self._v6_ids, offset = self._section(offset, 'I', self._v6_count)
+        self._offsets, offset = self._section(offset, 'Q', self._record_count + 1)
+        self._data_start = offset
+        offset += _align(self._offsets[self._record_count])
+        self.metadata = json.loads(self._mm[offset:offset + meta_length].decode('utf-8'))
+        self.providers = self.metadata['providers']
+
+    def _section(self, offset, typecode, count):
+        size = count * struct.calcsize(typecode)
+        if sys.byteorder != 'little':
+            view = array(typecode, self._mm[offset:offset + size])
+            view.byteswap()
+        else:
+            raw = memoryview(self._mm)[offset:offset + size]
+            view = raw.cast(typecode)
+            self._views.extend([raw, view])
+        return view, offset + _align(size)
+
+    def find(self, version, ip_int):
+        """返回 (记录号, 区间起始地址, 区间结束地址)"""
+        if version == 4:
+            row = bisect_right(self._v4_starts, ip_int) - 1
+            last = self._v4_starts[row + 1] - 1 if row + 1 < self._v4_count else (1 << 32) - 1
+            return self._v4_ids[row], self._v4_starts[row], last
+        high, low = ip_int >> 64, ip_int & 0xFFFFFFFFFFFFFFFF
+        # 先按高64位确定范围，再在高64位相同的区间中按低64位查找
+        end = bisect_right(self._v6_high, high)
+        begin = bisect_left(self._v6_high, high, 0, end)
+        row = bisect_right(self._v6_low, low, begin, end) - 1
+        if row < begin:
+            row = begin - 1
+        first = (self._v6_high[row] << 64) | self._v6_low[row]
+        if row + 1 < self._v6_count:
+            last = ((self._v6_high[row + 1] << 64) | self._v6_low[row + 1]) - 1
+        else:
+            last = (1 << 128) - 1
+        return self._v6_ids[row], first, last
+
+    def record(self, record_id):
+        start = self._data_start + self._offsets[record_id]
+        end = self._data_start + self._offsets[record_id + 1]
+        return json.loads(self._mm[start:end].decode('utf-8'))
+
+    def lookup(self, addr):
+        """返回 ({数据源: 结果}, 区间起始地址, 区间结束地址, IP版本)，地址无效时抛出ValueError"""
+        ip = ipaddress.ip_address(addr)
+        record_id, first, last = self.find(ip.version, int(ip))
+        return self.record(record_id), first, last, ip.version
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mm.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把所有IP库编译成一个合并区间表')
+    parser.add_argument('-o', '--output', help='输出文件，默认为 UNIFIED_DB_PATH')
+    args = parser.parse_args(argv)
+    # 编译需要在线读取器，不使用合并库，也不需要检查文件变化和缓存结果
+    os.environ['IP_DB_ENGINE'] = 'live'
+    os.environ['IP_DB_WATCH_INTERVAL'] = '0'
+    os.environ['IP_CACHE_SIZE'] = '0'
+    import app
+    app.compile_unified_db(args.output or app.UNIFIED_DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""ip2region xdb文件解析
+
+xdb由256字节的头部、按地址前两个字节划分的向量索引（256×256×8字节）、区域字符串和段索引组成。
+官方库只提供单个IP的查询，这里直接读取段索引，用于遍历全部区间和批量查询。
+"""
+import mmap
+import socket
+import struct
+
+# 只有批量查询需要NumPy，第一次批量查询时才导入，不增加启动时间
+np = None
+
+HEADER_LENGTH = 256
+VECTOR_INDEX_LENGTH = 256 * 256 * 8
+
+# 每个段的长度：起始地址、结束地址、区域字符串长度(2字节)、区域字符串位置(4字节)
+SEGMENT_SIZE = {4: 14, 6: 38}
+
+
+class XdbFile:
+    """只读mmap打开的xdb文件"""
+
+    def __init__(self, filename, willneed=False):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if willneed and hasattr(self._mm, 'madvise'):
+            self._mm.madvise(mmap.MADV_WILLNEED)
+        (self.version, self.index_policy, self.created_at, self.start_index_ptr,
+         self.end_index_ptr, ip_version, runtime_ptr_bytes) = struct.unpack_from('<HHIIIHH', self._mm, 0)
+        # 2.0格式的头部没有IP版本字段，只支持IPv4
+        self.ip_version = 6 if self.version != 2 and ip_version == 6 else 4
+        if runtime_ptr_bytes not in (0, 4):
+            self._mm.close()
+            raise ValueError(f'不支持的xdb指针长度: {runtime_ptr_bytes}')
+        self.segment_size = SEGMENT_SIZE[self.ip_version]
+        self.count = (self.end_index_ptr - self.start_index_ptr) // self.segment_size + 1
+
+    def segment(self, i):
+        """第i个段，返回 (起始地址, 结束地址, 区域字符串长度, 区域字符串位置)"""
+        return self._segment_at(self.start_index_ptr + i * self.segment_size)
+
+    def _segment_at(self, off):
+        if self.ip_version == 4:
+            return struct.unpack_from('<IIHI', self._mm, off)
+        # IPv6段的地址按网络字节序存放
+        start = int.from_bytes(self._mm[off:off + 16], 'big')
+        end = int.from_bytes(self._mm[off + 16:off + 32], 'big')
+        return (start, end) + struct.unpack_from('<HI', self._mm, off + 32)
+
+    def region(self, length, ptr):
+        return self._mm[ptr:ptr + length].decode('utf-8')
+
+    def lookup(self, ip):
+        """与官方库的 search() 相同地解析和查询IP，返回 (区域字符串, 段起始地址, 段结束地址)
+
+        按地址前两个字节在向量索引中取得段的范围，再在其中二分查找；未找到时区域字符串为空，区间为None。
+        """
+        try:
+            packed = socket.inet_pton(socket.AF_INET, ip)
+        except OSError:
+            packed = socket.inet_pton(socket.AF_INET6, ip)
+        if len(packed) != (4 if self.ip_version == 4 else 16):
+            raise ValueError('invalid ip version')
+        ip_int = int.from_bytes(packed, 'big')
+        s_ptr, e_ptr = struct.unpack_from('<II', self._mm, HEADER_LENGTH + (packed[0] * 256 + packed[1]) * 8)
+        low, high = 0, (e_ptr - s_ptr) // self.segment_size
+        while low <= high:
+            mid = (low + high) >> 1
+            start, end, length, ptr = self._segment_at(s_ptr + mid * self.segment_size)
+            if ip_int < start:
+                high = mid - 1
+            elif ip_int > end:
+                low = mid + 1
+            else:
+                return self.region(length, ptr), start, end
+        return '', None, None
+
+    def search(self, ip):
+        """与官方库的 search() 相同，返回区域字符串"""
+        return self.lookup(ip)[0]
+
+    def iter_segments(self):
+        """按地址顺序返回全部 (起始地址, 结束地址, 区域字符串)"""
+        for i in range(self.count):
+            start, end, length, ptr = self.segment(i)
+            yield start, end, self.region(length, ptr)
+
+    def close(self):
+        self._mm.close()
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('批量查询需要安装numpy') from None
+        np = numpy
+    return np
+
+
+def pack_addresses(ips, version):
+    """把IP字符串列表转换成批量查询的输入：IPv4为uint32数组，IPv6为16字节网络字节序数组"""
+    _import_numpy()
+    if version == 4:
+        packed = b''.join(socket.inet_aton(ip) for ip in ips)
+        return np.frombuffer(packed, dtype='>u4').astype(np.uint32)
+    packed = b''.join(socket.inet_pton(socket.AF_INET6, ip) for ip in ips)
+    return np.frombuffer(packed, dtype='S16')
+
+
+class XdbBulk:
+    """把xdb段索引载入NumPy数组，用searchsorted批量查询
+
+    lookup() 返回每个地址在 regions 字符串表中的下标，regions[0] 为空字符串，表示未找到，
+    与官方库 search() 未找到时的返回值相同。
+    """
+
+    def __init__(self, xdb):
+        _import_numpy()
+        self.ip_version = xdb.ip_version
+        if xdb.ip_version == 4:
+            dtype = np.dtype([('start', '<u4'), ('end', '<u4'), ('length', '<u2'), ('ptr', '<u4')])
+        else:
+            # 16字节的网络字节序地址按字节比较即按数值比较
+            dtype = np.dtype([('start', 'S16'), ('end', 'S16'), ('length', '<u2'), ('ptr', '<u4')])
+        segments = np.frombuffer(xdb._mm, dtype=dtype, count=xdb.count, offset=xdb.start_index_ptr)
+        self.starts = segments['start'].copy()
+        self.ends = segments['end'].copy()
+
+        # 每个区域字符串只解码一次，内容相同的字符串共用一个下标
+        pointers, first, inverse = np.unique(segments['ptr'], return_index=True, return_inverse=True)
+        lengths = segments['length'][first]
+        self.regions = ['']
+        index = {'': 0}
+        ids = np.empty(len(pointers), dtype=np.uint32)
+        for i, (ptr, length) in enumerate(zip(pointers.tolist(), lengths.tolist())):
+            region = xdb.region(length, ptr)
+            if region not in index:
+                index[region] = len(self.regions)
+                self.regions.append(region)
+            ids[i] = index[region]
+        self.region_ids = ids[inverse.reshape(-1)]
+        del segments
+
+    def lookup(self, addresses):
+        """批量查询，addresses为 pack_addresses() 格式的数组，返回regions下标数组"""
+        if self.ip_version == 4:
+            addresses = np.asarray(addresses, dtype=np.uint32)
+        else:
+            addresses = np.asarray(addresses, dtype='S16')
+        rows = np.searchsorted(self.starts, addresses, side='right') - 1
+        clipped = np.maximum(rows, 0)
+        found = (rows >= 0) & (addresses <= self.ends[clipped])
+        return np.where(found, self.region_ids[clipped], 0).astype(np.uint32)